@@ -0,0 +1,115 @@
+import numpy as np
+
+"""
+Reproducible synthetic data for benchmarks: every generator takes a seed and returns the same data for the same arguments.
+"""
+
+def gaussian_mixture(dim, n_samples, n_components = 3, seed = 0):
+    """
+    Samples from a random Gaussian mixture.
+
+    Arguments:
+        :int dim:          number of dimensions
+        :int n_samples:    number of samples
+        :int n_components: number of mixture components
+        :int seed:         random seed
+
+    Returns:
+        :np.ndarray: samples, shape (n_samples, dim)
+        :np.ndarray: bounds enclosing the samples, shape (dim, 2)
+    """
+    rng   = np.random.default_rng(seed)
+    means = rng.uniform(-5, 5, size = (n_components, dim))
+    covs  = []
+    for _ in range(n_components):
+        A = rng.normal(size = (dim, dim))*0.5
+        covs.append(A @ A.T + np.identity(dim)*0.5)
+    w       = rng.dirichlet(np.ones(n_components)*5)
+    idx     = rng.choice(n_components, p = w, size = n_samples)
+    samples = np.array([rng.multivariate_normal(means[i], covs[i]) for i in idx])
+    margin  = 0.1*(samples.max(axis = 0) - samples.min(axis = 0)) + 1e-3
+    bounds  = np.array([samples.min(axis = 0) - margin, samples.max(axis = 0) + margin]).T
+    return samples, bounds
+
+def mock_gw_posterior(n_samples, max_dist = 500., seed = 0):
+    """
+    GW-like sky position and luminosity distance posterior: an elongated, curved sky arc with distance correlated with the position along the arc.
+
+    Arguments:
+        :int n_samples:   number of samples
+        :double max_dist: maximum luminosity distance
+        :int seed:        random seed
+
+    Returns:
+        :np.ndarray: samples (ra, dec, D_L), shape (n_samples, 3)
+    """
+    rng = np.random.default_rng(seed)
+    ra0 = rng.uniform(0.5, 2*np.pi-0.5)
+    dec0 = rng.uniform(-0.8, 0.8)
+    D0  = rng.uniform(0.2, 0.5)*max_dist
+    t   = rng.normal(size = n_samples)
+    ra  = ra0 + 0.3*t + rng.normal(scale = 0.03, size = n_samples)
+    dec = dec0 + 0.1*t**2 - 0.1 + rng.normal(scale = 0.03, size = n_samples)
+    D   = D0*(1 + 0.1*t) + rng.normal(scale = 0.1*D0, size = n_samples)
+    ra  = np.mod(ra, 2*np.pi)
+    dec = np.clip(dec, -np.pi/2*0.98, np.pi/2*0.98)
+    D   = np.clip(D, 0.02*max_dist, 0.98*max_dist)
+    return np.array([ra, dec, D]).T
+
+def mock_event_catalog(n_events, n_samples, dim = 1, seed = 0):
+    """
+    Catalog of mock events for hierarchical inference: true values are drawn from a two-component population and each event has a Gaussian posterior with its own uncertainty.
+
+    Arguments:
+        :int n_events:  number of events
+        :int n_samples: number of posterior samples per event
+        :int dim:       number of dimensions
+        :int seed:      random seed
+
+    Returns:
+        :list: posterior samples for each event, each with shape (n_samples, dim)
+        :np.ndarray: bounds enclosing every event, shape (dim, 2)
+    """
+    rng    = np.random.default_rng(seed)
+    events = []
+    for _ in range(n_events):
+        if rng.uniform() < 0.7:
+            true = rng.normal(-2, 1, size = dim)
+        else:
+            true = rng.normal(3, 0.5, size = dim)
+        sigma = rng.uniform(0.2, 0.8)
+        obs   = true + rng.normal(scale = sigma, size = dim)
+        events.append(obs + rng.normal(scale = sigma, size = (n_samples, dim)))
+    all_samples = np.concatenate(events)
+    margin = 0.1*(all_samples.max(axis = 0) - all_samples.min(axis = 0))
+    bounds = np.array([all_samples.min(axis = 0) - margin, all_samples.max(axis = 0) + margin]).T
+    return events, bounds
+
+def mock_event_draws(n_events, n_draws = 5, n_samples = 200, dim = 1, seed = 0):
+    """
+    Single-event DPGMM draws for a catalog of mock events (input of HDPGMM).
+
+    Arguments:
+        :int n_events:  number of events
+        :int n_draws:   number of draws per event
+        :int n_samples: number of posterior samples per event
+        :int dim:       number of dimensions
+        :int seed:      random seed
+
+    Returns:
+        :list: draws (mixture instances) for each event
+        :np.ndarray: bounds
+    """
+    from figaro.mixture import DPGMM
+    events, bounds = mock_event_catalog(n_events, n_samples, dim = dim, seed = seed)
+    np.random.seed(seed)
+    mix   = DPGMM(bounds)
+    draws = []
+    for ev in events:
+        ev_draws = []
+        for _ in range(n_draws):
+            mix.density_from_samples(ev[np.random.permutation(len(ev))])
+            ev_draws.append(mix.build_mixture())
+            mix.initialise()
+        draws.append(ev_draws)
+    return draws, bounds
@@ -0,0 +1,103 @@
+import numpy as np
+
+import optparse as op
+import json
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+from benchmarks.suite import benchmarks, scales
+
+"""
+Runs the benchmark suite and stores the results in a JSON file.
+Usage: python -m benchmarks.run -s small -o results.json [--compare baseline.json]
+"""
+
+def metadata():
+    """
+    Information identifying the run (commit, versions, machine)
+    """
+    import scipy
+    import numba
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output = True, text = True, cwd = Path(__file__).parent).stdout.strip()
+    except OSError:
+        commit = None
+    return {'commit':    commit,
+            'date':      datetime.now(timezone.utc).isoformat(),
+            'python':    platform.python_version(),
+            'numpy':     np.__version__,
+            'scipy':     scipy.__version__,
+            'numba':     numba.__version__,
+            'machine':   platform.machine(),
+            'processor': platform.processor(),
+            'system':    platform.platform(),
+            }
+
+def _key(res):
+    return res['name'] + json.dumps(res['params'], sort_keys = True, default = str)
+
+def compare(results, baseline, threshold = 0.2):
+    """
+    Compares best durations with a previous run.
+
+    Arguments:
+        :list results:     current results
+        :list baseline:    results of the reference run
+        :double threshold: relative slowdown flagged as a regression
+
+    Returns:
+        :list: (name, params, baseline best, current best, ratio) for every regression
+    """
+    ref         = {_key(r): r for r in baseline}
+    regressions = []
+    for r in results:
+        b = ref.get(_key(r))
+        if b is None:
+            continue
+        ratio = r['best']/b['best']
+        print('{0:32s} {1:60s} {2:10.4g} -> {3:10.4g} s  ({4:+.1%})'.format(r['name'], json.dumps(r['params'], default = str)[:60], b['best'], r['best'], ratio - 1))
+        if ratio > 1 + threshold:
+            regressions.append((r['name'], r['params'], b['best'], r['best'], ratio))
+    return regressions
+
+def main():
+
+    parser = op.OptionParser()
+    parser.add_option("-s", "--scale", type = "choice", choices = list(scales.keys()), dest = "scale", help = "Problem sizes: small, medium or large", default = 'small')
+    parser.add_option("-o", "--output", type = "string", dest = "output", help = "Output JSON file", default = 'benchmarks.json')
+    parser.add_option("-b", "--bench", type = "string", dest = "bench", help = "Comma-separated benchmarks to run ({0}). Default: all".format(', '.join(benchmarks.keys())), default = None)
+    parser.add_option("--repeat", type = "int", dest = "repeat", help = "Number of repetitions. Default: set by scale", default = None)
+    parser.add_option("--compare", type = "string", dest = "compare", help = "JSON file from a previous run to compare with", default = None)
+    parser.add_option("--threshold", type = "float", dest = "threshold", help = "Relative slowdown flagged as regression", default = 0.2)
+
+    (options, args) = parser.parse_args()
+
+    scale = dict(scales[options.scale])
+    if options.repeat is not None:
+        scale['repeat'] = options.repeat
+    if options.bench is not None:
+        names = options.bench.split(',')
+    else:
+        names = list(benchmarks.keys())
+
+    results = []
+    for name in names:
+        print('Running {0}...'.format(name))
+        results += benchmarks[name](scale)
+
+    with open(Path(options.output), 'w') as f:
+        json.dump({'metadata': metadata(), 'scale': options.scale, 'settings': scale, 'results': results}, f, indent = 1, default = str)
+
+    if options.compare is not None:
+        with open(Path(options.compare), 'r') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, options.threshold)
+        if len(regressions) > 0:
+            print('{0} regression(s) above {1:.0%}'.format(len(regressions), options.threshold))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+import numpy as np
+import dill
+import tempfile
+import warnings
+from pathlib import Path
+from time import perf_counter
+
+from benchmarks.generators import gaussian_mixture, mock_gw_posterior, mock_event_draws
+
+"""
+Benchmarks of FIGARO's hot paths.
+Each benchmark is a function taking the scale settings and returning a list of results (one per configuration).
+"""
+
+scales = {
+    'small':  {'dims': [1, 2, 3],       'n_samples': 200,  'grid_sizes': [10**4, 10**5],        'n_events': 5,  'n_draws': 3,  'volume_grid': [90, 45, 20],   'repeat': 3},
+    'medium': {'dims': [1, 2, 3, 6],    'n_samples': 1000, 'grid_sizes': [10**4, 10**5, 10**6], 'n_events': 20, 'n_draws': 10, 'volume_grid': [360, 180, 50], 'repeat': 3},
+    'large':  {'dims': [1, 2, 3, 4, 6], 'n_samples': 5000, 'grid_sizes': [10**5, 10**6, 10**7], 'n_events': 50, 'n_draws': 20, 'volume_grid': [720, 360, 100], 'repeat': 5},
+    }
+
+def measure(func, repeat = 3, setup = None):
+    """
+    Times a function.
+
+    Arguments:
+        :callable func:  function to time. If setup is given, it is called with the output of setup
+        :int repeat:     number of repetitions
+        :callable setup: function preparing a fresh input for each repetition (not timed)
+
+    Returns:
+        :list: durations [s]
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            args = setup()
+            t0   = perf_counter()
+            func(args)
+        else:
+            t0   = perf_counter()
+            func()
+        times.append(perf_counter() - t0)
+    return times
+
+def result(name, times, n_items = 1, info = None, **params):
+    """
+    Benchmark record.
+
+    Arguments:
+        :str name:      benchmark name
+        :list times:    durations [s]
+        :int n_items:   number of items processed per repetition (samples, grid points, ...)
+        :dict info:     outcome of the run that may change between versions (e.g. number of clusters), not used to match runs
+        :dict params:   configuration
+
+    Returns:
+        :dict: record with best and median durations, and best duration per item
+    """
+    return {'name':     name,
+            'params':   params,
+            'times':    list(times),
+            'best':     float(np.min(times)),
+            'median':   float(np.median(times)),
+            'n_items':  int(n_items),
+            'per_item': float(np.min(times))/n_items,
+            'info':     info if info is not None else {},
+            }
+
+def _warmup_dpgmm(dim):
+    """
+    Compiles numba functions before timing
+    """
+    from figaro.mixture import DPGMM
+    samples, bounds = gaussian_mixture(dim, 20, seed = 1)
+    DPGMM(bounds).density_from_samples(samples)
+
+def bench_dpgmm(scale):
+    """
+    DPGMM.density_from_samples (per sample) and build_mixture
+    """
+    from figaro.mixture import DPGMM
+    out = []
+    for dim in scale['dims']:
+        _warmup_dpgmm(dim)
+        samples, bounds = gaussian_mixture(dim, scale['n_samples'], seed = dim)
+        mix   = DPGMM(bounds)
+        def setup():
+            np.random.seed(0)
+            mix.initialise()
+            return samples
+        times = measure(mix.density_from_samples, scale['repeat'], setup = setup)
+        out.append(result('dpgmm_density_from_samples', times, n_items = len(samples), dim = dim, n_samples = len(samples), info = {'n_cl': mix.n_cl}))
+        times = measure(mix.build_mixture, scale['repeat'])
+        out.append(result('dpgmm_build_mixture', times, dim = dim, n_draws_norm = mix.n_draws_norm, info = {'n_cl': mix.n_cl}))
+    return out
+
+def bench_evaluate_mixture(scale):
+    """
+    mixture.evaluate_mixture on grids of increasing size
+    """
+    from figaro.mixture import DPGMM
+    out = []
+    for dim in [d for d in scale['dims'] if d <= 3]:
+        samples, bounds = gaussian_mixture(dim, scale['n_samples'], seed = dim)
+        np.random.seed(0)
+        mix = DPGMM(bounds)
+        mix.density_from_samples(samples)
+        draw = mix.build_mixture()
+        rng  = np.random.default_rng(0)
+        for n in scale['grid_sizes']:
+            x     = rng.uniform(bounds[:,0], bounds[:,1], size = (n, dim))
+            times = measure(lambda: draw.evaluate_mixture(x), scale['repeat'])
+            out.append(result('mixture_evaluate_mixture', times, n_items = n, dim = dim, n_points = n, info = {'n_cl': draw.n_cl}))
+    return out
+
+def bench_hdpgmm(scale):
+    """
+    HDPGMM.density_from_samples (per event, including MC predictives) and sample_point
+    """
+    from figaro.mixture import HDPGMM
+    from figaro.metropolis import sample_point, sample_point_1d
+    out = []
+    for dim in [d for d in scale['dims'] if d <= 2]:
+        draws, bounds = mock_event_draws(scale['n_events'], n_draws = scale['n_draws'], dim = dim, seed = dim)
+        mix = HDPGMM(bounds, MC_draws = 1e3)
+        mix.density_from_samples(draws[:2])
+        def setup():
+            np.random.seed(0)
+            mix.initialise()
+            return draws
+        times = measure(mix.density_from_samples, scale['repeat'], setup = setup)
+        out.append(result('hdpgmm_density_from_samples', times, n_items = len(draws), dim = dim, n_events = len(draws), n_draws = scale['n_draws'], info = {'n_cl': mix.n_cl}))
+        # Metropolis step for a component with all the events assigned to it
+        ev     = [d[0] for d in draws]
+        means  = [e.means for e in ev]
+        covs   = [e.covs for e in ev]
+        log_w  = [e.log_w for e in ev]
+        if dim == 1:
+            func = lambda: sample_point_1d(means, covs, log_w, a = mix.prior.nu+1, b = mix.prior.L[0,0])
+        else:
+            func = lambda: sample_point(means, covs, log_w, dim, a = mix.prior.nu, b = mix.prior.L)
+        func()
+        times = measure(func, scale['repeat'])
+        out.append(result('metropolis_sample_point', times, dim = dim, n_events = len(ev)))
+    return out
+
+def bench_volume(scale):
+    """
+    VolumeReconstruction grid build, sample assimilation, skymap and volume map evaluation, ConfidenceVolume
+    """
+    from figaro.threeDvolume import VolumeReconstruction
+    from figaro.credible_regions import ConfidenceVolume
+    out     = []
+    samples = mock_gw_posterior(scale['n_samples'], max_dist = 500., seed = 0)
+    ng      = scale['volume_grid']
+    n_grid  = int(np.prod(ng))
+    with tempfile.TemporaryDirectory() as folder, warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        t0  = perf_counter()
+        vol = VolumeReconstruction(500., out_folder = folder, n_gridpoints = ng)
+        out.append(result('volume_grid_build', [perf_counter() - t0], n_items = n_grid, n_gridpoints = ng))
+        np.random.seed(0)
+        t0 = perf_counter()
+        for s in samples:
+            vol.add_sample(s)
+        out.append(result('volume_add_sample', [perf_counter() - t0], n_items = len(samples), n_samples = len(samples), info = {'n_cl': vol.n_cl}))
+        def setup():
+            vol.volume_already_evaluated = False
+        times = measure(lambda _: vol.evaluate_skymap(), scale['repeat'], setup = setup)
+        out.append(result('volume_evaluate_skymap', times, n_items = n_grid, n_gridpoints = ng, info = {'n_cl': vol.n_cl}))
+        times = measure(vol.evaluate_volume_map, scale['repeat'])
+        out.append(result('volume_evaluate_volume_map', times, n_items = n_grid, n_gridpoints = ng))
+        log_p_vol = np.array(vol.log_p_vol)
+        times     = measure(lambda: ConfidenceVolume(log_p_vol, vol.ra, vol.dec, vol.dist, adLevels = vol.levels), scale['repeat'])
+        out.append(result('confidence_volume', times, n_items = n_grid, n_gridpoints = ng))
+        vol.close()
+    return out
+
+def bench_load_draws(scale):
+    """
+    Saving and loading draws (dill)
+    """
+    out = []
+    draws, _ = mock_event_draws(1, n_draws = scale['n_draws']*5, n_samples = scale['n_samples'], dim = 2, seed = 0)
+    draws    = np.array(draws[0])
+    with tempfile.TemporaryDirectory() as folder:
+        file = Path(folder, 'draws.pkl')
+        def dump():
+            with open(file, 'wb') as f:
+                dill.dump(draws, f)
+        def load():
+            with open(file, 'rb') as f:
+                dill.load(f)
+        out.append(result('draws_dump', measure(dump, scale['repeat']), n_items = len(draws), n_draws = len(draws)))
+        out.append(result('draws_load', measure(load, scale['repeat']), n_items = len(draws), n_draws = len(draws), info = {'size_bytes': file.stat().st_size}))
+    return out
+
+benchmarks = {'dpgmm':            bench_dpgmm,
+              'evaluate_mixture': bench_evaluate_mixture,
+              'hdpgmm':           bench_hdpgmm,
+              'volume':           bench_volume,
+              'load_draws':       bench_load_draws,
+              }
@@ -0,0 +1,403 @@
+import numpy as np
+import os
+import json
+import zlib
+import dill
+from pathlib import Path
+from multiprocessing import Pool
+from numba import njit
+
+from figaro.mixture import DPGMM, mixture
+from figaro.transform import transform_to_probit
+from figaro.load import load_single_event, SampleStream
+from figaro.cache import config_key
+
+"""
+Single-event reconstructions on a pool of processes, with per-event checkpoints.
+The draws of each event are stored in their own file (draws_<name>.pkl, or draws_<name>.npz in batch mode) as soon as the event is done. Files are written into a temporary file first and then moved, so that an existing file always holds a complete set of draws.
+A manifest (manifest.json) records, for each completed event, the draws file and a key built from the samples file (size, modification time) and from the configuration: when a run is restarted, events are skipped only if their key is unchanged.
+Every task reseeds both NumPy's and numba's random number generators, so that processes forked from the same parent do not share random streams.
+Batch mode (run_density_batch) reconstructs many samples files on a single pool, whose workers are kept alive for the whole batch (compiled kernels are reused), using the same manifest: reruns are idempotent.
+"""
+
+@njit(cache = True)
+def _seed_numba(seed):
+    np.random.seed(seed)
+
+def seed_everything(seed):
+    """
+    Seeds NumPy's and numba's random number generators (numba's generator is not affected by np.random.seed called outside compiled functions).
+
+    Arguments:
+        :int seed: random seed
+    """
+    np.random.seed(seed)
+    _seed_numba(seed)
+
+def event_seed(seed, i):
+    """
+    Random seed for the i-th event. If seed is None, a new seed is drawn from the OS entropy.
+
+    Arguments:
+        :int seed: base random seed
+        :int i:    event index
+
+    Returns:
+        :int: seed for the i-th event
+    """
+    if seed is None:
+        return int(np.random.SeedSequence().generate_state(1)[0])
+    return int(np.random.SeedSequence([seed, i]).generate_state(1)[0])
+
+def draws_file(out_folder, name, ext = 'pkl'):
+    """
+    File with the draws of an event.
+
+    Arguments:
+        :str or Path out_folder: folder with the draws
+        :str name:               name of the event
+        :str ext:                file extension (pkl or npz)
+
+    Returns:
+        :Path: file
+    """
+    return Path(out_folder, 'draws_'+name+'.'+ext)
+
+def save_draws(draws, file):
+    """
+    Stores draws with dill. The draws are written into a temporary file, then moved: readers never see a partial file.
+
+    Arguments:
+        :iterable draws:   draws (instances of figaro.mixture.mixture)
+        :str or Path file: output file
+    """
+    file = Path(file)
+    tmp  = Path(file.parent, '.' + file.name + '.{0}'.format(os.getpid()))
+    with open(tmp, 'wb') as f:
+        dill.dump(np.array(draws), f)
+    os.replace(tmp, file)
+
+def save_draws_npz(draws, file):
+    """
+    Stores DPGMM draws in a compressed .npz file: the components of every draw are concatenated and the normalisation constants are stored, so that loading does not estimate them again.
+    The file is written into a temporary file, then moved: readers never see a partial file.
+
+    Arguments:
+        :iterable draws:   draws (instances of figaro.mixture.mixture)
+        :str or Path file: output file
+    """
+    file = Path(file)
+    tmp  = Path(file.parent, '.' + file.name + '.{0}'.format(os.getpid()))
+    dim  = draws[0].dim
+    with open(tmp, 'wb') as f:
+        np.savez_compressed(f,
+                            means  = np.concatenate([np.reshape(d.means, (-1, dim)) for d in draws]),
+                            covs   = np.concatenate([np.reshape(d.covs, (-1, dim, dim)) for d in draws]),
+                            w      = np.concatenate([d.w for d in draws]),
+                            n_cl   = np.array([d.n_cl for d in draws]),
+                            n_pts  = np.array([d.n_pts for d in draws]),
+                            norm   = np.array([d.norm for d in draws]),
+                            bounds = np.array(draws[0].bounds, dtype = np.float64),
+                            )
+    os.replace(tmp, file)
+
+def _restore_mixture(means, covs, w, bounds, n_cl, n_pts, norm):
+    """
+    Instance of mixture with a known normalisation constant (no MC estimate).
+    """
+    draw          = mixture.__new__(mixture)
+    draw.means    = means
+    draw.covs     = covs
+    draw.w        = w
+    draw.log_w    = np.log(w)
+    draw.bounds   = bounds
+    draw.dim      = len(bounds)
+    draw.n_cl     = int(n_cl)
+    draw.n_pts    = int(n_pts)
+    draw.norm     = float(norm)
+    draw.log_norm = np.log(draw.norm)
+    return draw
+
+def load_draws(file):
+    """
+    Loads draws stored with save_draws (or with dill) or with save_draws_npz (.npz files).
+
+    Arguments:
+        :str or Path file: file
+
+    Returns:
+        :np.ndarray: draws
+    """
+    if Path(file).suffix == '.npz':
+        with np.load(file) as data:
+            edges = np.concatenate(([0], np.cumsum(data['n_cl'])))
+            return np.array([_restore_mixture(data['means'][i:j], data['covs'][i:j], data['w'][i:j], data['bounds'], n_cl, n_pts, norm) for i, j, n_cl, n_pts, norm in zip(edges[:-1], edges[1:], data['n_cl'], data['n_pts'], data['norm'])])
+    with open(file, 'rb') as f:
+        return dill.load(f)
+
+def reconstruct_single_event(samples, bounds, n_draws = 100, seed = None):
+    """
+    Draws from the DPGMM reconstruction of a single event, with the variance prior estimated from the samples (as in the hierarchical inference pipeline).
+
+    Arguments:
+        :np.ndarray samples: samples
+        :np.ndarray bounds:  density bounds
+        :int n_draws:        number of draws
+        :int seed:           random seed. If None, generators are not reseeded
+
+    Returns:
+        :np.ndarray: draws
+    """
+    if seed is not None:
+        seed_everything(seed)
+    bounds  = np.atleast_2d(bounds)
+    dim     = len(bounds)
+    samples = np.array(samples)
+    # Variance prior from samples
+    probit_samples = transform_to_probit(samples, bounds)
+    sigma = (np.std(probit_samples)/5)**2
+    mix   = DPGMM(bounds, prior_pars = (1e-1, np.identity(dim)*sigma, dim, np.zeros(dim)))
+    draws = []
+    for _ in range(n_draws):
+        np.random.shuffle(samples)
+        mix.density_from_samples(samples)
+        draws.append(mix.build_mixture())
+        mix.initialise()
+    return np.array(draws)
+
+def _single_event_worker(args):
+    samples, name, bounds, n_draws, out_folder, seed = args
+    draws = reconstruct_single_event(samples, bounds, n_draws = n_draws, seed = seed)
+    save_draws(draws, draws_file(out_folder, name))
+    return name
+
+def read_manifest(out_folder):
+    """
+    Manifest of the completed outputs of a batch: dictionary with an entry for each event (samples file, configuration key and draws file).
+
+    Arguments:
+        :str or Path out_folder: output folder
+
+    Returns:
+        :dict: manifest (empty if not available)
+    """
+    try:
+        with open(Path(out_folder, 'manifest.json'), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_manifest(manifest, out_folder):
+    tmp = Path(out_folder, '.manifest.json.{0}'.format(os.getpid()))
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent = 1, sort_keys = True)
+    os.replace(tmp, Path(out_folder, 'manifest.json'))
+
+def density_key(file, config):
+    """
+    Key of the reconstruction of a samples file: it changes if the file (size, modification time) or the configuration changes.
+
+    Arguments:
+        :str or Path file: samples file
+        :dict config:      reconstruction settings
+
+    Returns:
+        :str: key
+    """
+    stat = os.stat(file)
+    return config_key(file = str(Path(file).resolve()), size = stat.st_size, mtime = stat.st_mtime_ns, **config)
+
+def single_event_keys(names, files, bounds, n_draws = 100, seed = None, settings = {}):
+    """
+    Keys of the single-event reconstructions (see density_key): they change if the samples file or the configuration changes.
+
+    Arguments:
+        :iterable names:    names of the events
+        :iterable files:    samples files of the events
+        :np.ndarray bounds: density bounds
+        :int n_draws:       number of draws per event
+        :int seed:          base random seed
+        :dict settings:     other settings affecting the samples (e.g. parameters, downsampling, cosmology)
+
+    Returns:
+        :dict: key of each event
+    """
+    config = dict(settings, stage = 'single_event', bounds = np.array(bounds, dtype = np.float64).tolist(), n_draws = int(n_draws), seed = seed)
+    return {name: density_key(file, config) for name, file in zip(names, files)}
+
+def completed_events(names, out_folder, keys):
+    """
+    Events whose draws are stored in out_folder and whose entry in the manifest matches the current key.
+
+    Arguments:
+        :iterable names:         names of the events
+        :str or Path out_folder: folder with the draws
+        :dict keys:              key of each event (see single_event_keys)
+
+    Returns:
+        :list: names of the completed events
+    """
+    manifest = read_manifest(out_folder)
+    return [name for name in names if name in manifest and manifest[name]['key'] == keys[name] and Path(out_folder, manifest[name]['draws']).exists()]
+
+def run_single_events(events, names, keys, bounds, out_folder, n_draws = 100, n_parallel = 1, seed = None, resume = True, pool = None):
+    """
+    Reconstructs many events, one event per task, storing the draws of each event as soon as it is done (see draws_file) and recording them in the manifest (manifest.json) with their key.
+    If resume is True, events whose entry in the manifest matches the current key are skipped: draws obtained with a different configuration or from a different samples file are never reused.
+    Yields the name of each event as soon as it is done, in order of completion: the caller can plot or track progress while the workers keep running.
+    Seeds depend only on the base seed and on the position of the event, hence results do not depend on n_parallel.
+
+    Arguments:
+        :iterable events:        samples of each event
+        :iterable names:         names of the events
+        :dict keys:              key of each event (see single_event_keys)
+        :np.ndarray bounds:      density bounds
+        :str or Path out_folder: folder for the draws
+        :int n_draws:            number of draws per event
+        :int n_parallel:         number of processes
+        :int seed:               base random seed. If None, seeds are drawn from the OS entropy
+        :bool resume:            skip completed events. If False, every event is reconstructed again
+        :Pool pool:              pool of processes to use instead of creating a new one (n_parallel is then ignored)
+
+    Returns:
+        :generator: names of the completed events
+    """
+    out_folder = Path(out_folder)
+    done       = set(completed_events(names, out_folder, keys)) if resume else set()
+    manifest   = read_manifest(out_folder)
+    tasks      = [(ev, name, np.array(bounds), n_draws, out_folder, event_seed(seed, i)) for i, (ev, name) in enumerate(zip(events, names)) if name not in done]
+    own_pool   = None
+    if pool is not None:
+        results = pool.imap_unordered(_single_event_worker, tasks)
+    elif n_parallel == 1 or len(tasks) < 2:
+        results = map(_single_event_worker, tasks)
+    else:
+        own_pool = Pool(min(n_parallel, len(tasks)))
+        results  = own_pool.imap_unordered(_single_event_worker, tasks)
+    try:
+        for name in results:
+            manifest[name] = {'key': keys[name], 'draws': draws_file(out_folder, name).name}
+            _write_manifest(manifest, out_folder)
+            yield name
+    finally:
+        if own_pool is not None:
+            own_pool.close()
+            own_pool.join()
+
+def list_samples_files(path):
+    """
+    Samples files in a folder (hidden files and empty_files excluded, as in figaro.load.load_data) or listed in a text file (one file per line, relative paths with respect to the folder of the list, lines starting with # are ignored).
+
+    Arguments:
+        :str or Path path: folder or list of files
+
+    Returns:
+        :list: files
+    """
+    path = Path(path)
+    if path.is_dir():
+        return sorted([Path(path, f) for f in os.listdir(path) if not (f.startswith('.') or f.startswith('empty_files')) and Path(path, f).is_file()])
+    with open(path, 'r') as f:
+        lines = [line.strip() for line in f]
+    return [Path(path.parent, line).resolve() for line in lines if len(line) > 0 and not line.startswith('#')]
+
+def event_name(file):
+    """
+    Name of an event (file name without extension, as in figaro.load).
+    """
+    return str(file).split('/')[-1].split('.')[0]
+
+def check_unique_names(files):
+    """
+    Checks that no two samples files share the same event name (file name without extension): their outputs and manifest entries would overwrite each other.
+
+    Arguments:
+        :iterable files: samples files
+
+    Raises:
+        :ValueError: if two or more files share the same name
+    """
+    groups = {}
+    for file in files:
+        groups.setdefault(event_name(file), []).append(str(file))
+    duplicates = {name: group for name, group in groups.items() if len(group) > 1}
+    if len(duplicates) > 0:
+        raise ValueError("Samples files with the same event name: " + '; '.join(['{0} ({1})'.format(name, ', '.join(group)) for name, group in duplicates.items()]) + ". Please rename them")
+
+def _density_worker(args):
+    file, out_folder, config, seed = args
+    name = event_name(file)
+    # Downsampling and chunk permutations use their own stream, derived from the seed of the task
+    seed_everything(seed)
+    rdstate = np.random.RandomState(np.random.MT19937(np.random.SeedSequence(seed)))
+    if config['chunk_size'] is not None:
+        stream = SampleStream(file, chunk_size = config['chunk_size'], par = config['par'], n_samples = config['n_samples'], h = config['h'], om = config['om'], ol = config['ol'], rdstate = rdstate)
+    else:
+        samples, _ = load_single_event(file, par = config['par'], n_samples = config['n_samples'], h = config['h'], om = config['om'], ol = config['ol'], rdstate = rdstate)
+    mix   = DPGMM(config['bounds'])
+    draws = []
+    for _ in range(config['n_draws']):
+        if config['chunk_size'] is not None:
+            for chunk in stream:
+                mix.density_from_samples(chunk)
+        else:
+            np.random.shuffle(samples)
+            mix.density_from_samples(samples)
+        draws.append(mix.build_mixture())
+        mix.initialise()
+    out_file = draws_file(out_folder, name, ext = 'npz')
+    save_draws_npz(draws, out_file)
+    return name, out_file.name
+
+def run_density_batch(files, bounds, out_folder, n_draws = 100, par = ['m1'], n_samples = -1, h = 0.674, om = 0.315, ol = 0.685, chunk_size = None, n_parallel = 1, seed = None):
+    """
+    Reconstructs the density of many samples files (as pipelines/probability_density.py does for a single file) on a single pool of processes, whose workers are kept alive for the whole batch.
+    Draws are stored in out_folder as draws_<name>.npz (see save_draws_npz) and the manifest (manifest.json) is updated as soon as each file is done. Files whose entry in the manifest matches the current file and configuration are skipped, hence reruns are idempotent.
+    Event names (file names without extension) must be unique, otherwise a ValueError is raised before any reconstruction.
+    Yields the name of each event as soon as it is done, in order of completion.
+
+    Arguments:
+        :iterable files:         samples files
+        :np.ndarray bounds:      density bounds
+        :str or Path out_folder: folder for the draws and the manifest
+        :int n_draws:            number of draws per file
+        :list par:               GW parameter(s) to be read from files
+        :int n_samples:          number of samples for (random) downsampling. Default -1: all samples
+        :double h:               Hubble constant H0/100 [km/(s*Mpc)]
+        :double om:              matter density parameter
+        :double ol:              cosmological constant density parameter
+        :int chunk_size:         stream the samples in chunks of this size (see figaro.load.SampleStream). Default: no streaming
+        :int n_parallel:         number of processes
+        :int seed:               base random seed (the seed of each file depends on its name only). If None, seeds are drawn from the OS entropy
+
+    Returns:
+        :generator: names of the completed events
+    """
+    check_unique_names(files)
+    out_folder = Path(out_folder)
+    config     = {'bounds': np.array(bounds, dtype = np.float64).tolist(), 'n_draws': int(n_draws), 'par': list(par), 'n_samples': int(n_samples), 'h': h, 'om': om, 'ol': ol, 'chunk_size': chunk_size, 'seed': seed}
+    manifest   = read_manifest(out_folder)
+    tasks      = []
+    for file in files:
+        name  = event_name(file)
+        key   = density_key(file, config)
+        entry = manifest.get(name)
+        if entry is not None and entry['key'] == key and Path(out_folder, entry['draws']).exists():
+            continue
+        tasks.append((file, out_folder, config, event_seed(seed, zlib.crc32(name.encode()))))
+    keys = {event_name(task[0]): (str(Path(task[0]).resolve()), density_key(task[0], config)) for task in tasks}
+    if n_parallel == 1 or len(tasks) < 2:
+        results = map(_density_worker, tasks)
+        pool    = None
+    else:
+        pool    = Pool(min(n_parallel, len(tasks)))
+        results = pool.imap_unordered(_density_worker, tasks, chunksize = 1)
+    try:
+        for name, out_file in results:
+            manifest[name] = {'file': keys[name][0], 'key': keys[name][1], 'draws': out_file}
+            _write_manifest(manifest, out_folder)
+            yield name
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
@@ -0,0 +1,65 @@
+import numpy as np
+import json
+import os
+import shutil
+from hashlib import sha1
+from pathlib import Path
+
+"""
+Content-addressed cache of read-only arrays.
+Arrays are stored as .npy files in a folder named after a hash of the configuration that produced them and are memory-mapped when loaded: processes sharing the same configuration share the same pages.
+Every key includes CACHE_VERSION: increase it whenever the content or the format of cached arrays changes (grids, transforms, Jacobians, catalog or samples caches), so that entries built by older code are not loaded.
+"""
+
+CACHE_VERSION = 1
+
+def config_key(**config):
+    """
+    Hash of a configuration, including the cache version (CACHE_VERSION).
+
+    Arguments:
+        :dict config: configuration (JSON-serialisable values, numpy arrays are converted to lists)
+
+    Returns:
+        :str: key
+    """
+    def default(x):
+        if isinstance(x, np.ndarray):
+            return x.tolist()
+        if isinstance(x, np.generic):
+            return x.item()
+        return str(x)
+    return sha1(json.dumps(dict(config, cache_version = CACHE_VERSION), sort_keys = True, default = default).encode()).hexdigest()[:16]
+
+def load_cached_arrays(cache_folder, key, builder, mmap_mode = 'r'):
+    """
+    Loads a set of arrays from the cache, building and storing them if not available.
+
+    Arguments:
+        :str or Path cache_folder: cache folder
+        :str key:                  configuration key (see config_key)
+        :callable builder:         function with no arguments returning a dictionary of np.ndarrays
+        :str mmap_mode:            np.load memory-map mode
+
+    Returns:
+        :dict: memory-mapped arrays
+    """
+    folder = Path(cache_folder, key)
+    if not Path(folder, 'names.json').exists():
+        arrays     = builder()
+        # Write into a temporary folder first: concurrent processes never see a partial cache
+        tmp_folder = Path(cache_folder, '.{0}_{1}'.format(key, os.getpid()))
+        tmp_folder.mkdir(parents = True, exist_ok = True)
+        for name, array in arrays.items():
+            np.save(Path(tmp_folder, name+'.npy'), array)
+        with open(Path(tmp_folder, 'names.json'), 'w') as f:
+            json.dump(list(arrays.keys()), f)
+        del arrays
+        try:
+            tmp_folder.rename(folder)
+        except OSError:
+            # Another process completed the same cache in the meantime
+            shutil.rmtree(tmp_folder, ignore_errors = True)
+    with open(Path(folder, 'names.json'), 'r') as f:
+        names = json.load(f)
+    return {name: np.load(Path(folder, name+'.npy'), mmap_mode = mmap_mode) for name in names}
@@ -0,0 +1,185 @@
+import numpy as np
+import h5py
+import errno
+import json
+import os
+import shutil
+import warnings
+from hashlib import sha1
+from pathlib import Path
+
+from figaro.cache import CACHE_VERSION
+
+"""
+Distance-sorted, column-oriented cache for the GLADE+ catalog.
+The cache is built once per catalog file and cosmology and then memory-mapped, so that only the galaxies within the maximum distance are read.
+"""
+
+glade_columns = ['ra', 'dec', 'z', 'm_B', 'm_K', 'm_W1', 'm_bJ']
+
+def glade_cache_key(glade_file, cosmology):
+    """
+    Builds the key identifying a GLADE+ cache (source file, cosmological parameters and cache version).
+
+    Arguments:
+        :str or Path glade_file:           GLADE+ hdf5 file
+        :CosmologicalParameters cosmology: instance of CosmologicalParameters used to compute luminosity distances
+
+    Returns:
+        :str: cache key
+    """
+    glade_file = Path(glade_file).resolve()
+    stat       = glade_file.stat()
+    pars       = [cosmology.h, cosmology.om, cosmology.ol, cosmology.w0, cosmology.w1]
+    key        = '{0}_{1}_{2}_'.format(glade_file, stat.st_size, int(stat.st_mtime)) + '_'.join(['{0:.8f}'.format(p) for p in pars]) + '_v{0}'.format(CACHE_VERSION)
+    return sha1(key.encode()).hexdigest()[:16]
+
+def user_cache_folder():
+    """
+    User cache folder for FIGARO ($XDG_CACHE_HOME/figaro, default ~/.cache/figaro).
+
+    Returns:
+        :Path: folder
+    """
+    return Path(os.environ.get('XDG_CACHE_HOME', Path(Path.home(), '.cache')), 'figaro')
+
+def _write_glade_cache(glade_file, cosmology, folder):
+    """
+    Writes the GLADE+ cache into folder, through a temporary folder: concurrent processes never see a partial cache, and the temporary folder is removed if anything fails.
+    """
+    tmp_folder = Path(folder.parent, '.{0}_{1}'.format(folder.name, os.getpid()))
+    tmp_folder.mkdir(parents = True, exist_ok = True)
+    try:
+        with h5py.File(glade_file, 'r') as f:
+            z   = np.array(f['z'], dtype = np.float64)
+            DL  = cosmology.LuminosityDistance(np.ascontiguousarray(z))
+            idx = np.argsort(DL, kind = 'stable')
+            np.save(Path(tmp_folder, 'DL.npy'), DL[idx])
+            np.save(Path(tmp_folder, 'z.npy'), z[idx])
+            del z, DL
+            for col in glade_columns:
+                if col == 'z':
+                    continue
+                np.save(Path(tmp_folder, col+'.npy'), np.array(f[col])[idx])
+        meta = {'source':    str(glade_file),
+                'cosmology': {'h': cosmology.h, 'om': cosmology.om, 'ol': cosmology.ol, 'w0': cosmology.w0, 'w1': cosmology.w1},
+                'n_gal':     int(len(idx)),
+                'columns':   ['DL'] + glade_columns,
+                }
+        with open(Path(tmp_folder, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+    except BaseException:
+        shutil.rmtree(tmp_folder, ignore_errors = True)
+        raise
+    try:
+        tmp_folder.rename(folder)
+    except OSError:
+        # Another process completed the same cache in the meantime
+        shutil.rmtree(tmp_folder, ignore_errors = True)
+
+def build_glade_cache(glade_file, cosmology, cache_folder = None):
+    """
+    One-time preprocessing of the GLADE+ catalog.
+    Converts redshifts into luminosity distances, sorts the galaxies by distance and stores each column in a separate .npy file.
+    If the cache folder is not writable (e.g. GLADE+ stored in a shared, read-only location), the cache is stored in the user cache folder (see user_cache_folder) instead.
+    This is tailored to GLADE+ available on March 28th at http://glade.elte.hu - compatibility with more recent versions is not ensured.
+
+    Arguments:
+        :str or Path glade_file:           GLADE+ hdf5 file
+        :CosmologicalParameters cosmology: instance of CosmologicalParameters used to compute luminosity distances
+        :str or Path cache_folder:         folder where caches are stored. Default: same folder as glade_file
+
+    Returns:
+        :Path: folder containing the cache
+    """
+    glade_file = Path(glade_file).resolve()
+    if cache_folder is None:
+        cache_folder = glade_file.parent
+    name    = 'glade_cache_'+glade_cache_key(glade_file, cosmology)
+    folders = [Path(cache_folder, name), Path(user_cache_folder(), name)]
+    # Existing caches (possibly built by someone else in a read-only folder)
+    for folder in folders:
+        if Path(folder, 'meta.json').exists():
+            return folder
+    for i, folder in enumerate(folders):
+        try:
+            _write_glade_cache(glade_file, cosmology, folder)
+            return folder
+        except OSError as e:
+            if e.errno not in (errno.EACCES, errno.EPERM, errno.EROFS) or i == len(folders) - 1:
+                raise
+            warnings.warn("Cannot write the GLADE+ cache in {0}: using {1} instead".format(folder.parent, folders[i+1].parent))
+
+class GladeCache:
+    """
+    Memory-mapped access to a distance-sorted GLADE+ cache (see build_glade_cache).
+    Columns are opened lazily, so that only the requested ones are ever read from disk.
+
+    Arguments:
+        :str or Path folder: folder containing the cache
+
+    Returns:
+        :GladeCache: instance of GladeCache class
+    """
+    def __init__(self, folder):
+        self.folder   = Path(folder)
+        with open(Path(self.folder, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self._columns = {}
+
+    def column(self, name):
+        """
+        Memory-mapped column
+
+        Arguments:
+            :str name: column name (DL, ra, dec, z, m_B, m_K, m_W1, m_bJ)
+
+        Returns:
+            :np.memmap: column, sorted by luminosity distance
+        """
+        if name not in self._columns:
+            self._columns[name] = np.load(Path(self.folder, name+'.npy'), mmap_mode = 'r')
+        return self._columns[name]
+
+    def n_within(self, max_dist):
+        """
+        Number of galaxies with luminosity distance smaller than max_dist (binary search)
+
+        Arguments:
+            :double max_dist: maximum luminosity distance
+
+        Returns:
+            :int: number of galaxies
+        """
+        return int(np.searchsorted(self.column('DL'), max_dist, side = 'left'))
+
+    def load(self, columns, n_gal, idx = None):
+        """
+        Reads the requested columns for the n_gal closest galaxies, or for a subset of them.
+
+        Arguments:
+            :list columns:     columns to read
+            :int n_gal:        number of galaxies (see n_within)
+            :np.ndarray idx:   indices (among the n_gal closest galaxies) of the rows to read. Default: all
+
+        Returns:
+            :np.ndarray: array with shape (n_rows, len(columns))
+        """
+        if idx is None:
+            return np.array([np.asarray(self.column(c)[:n_gal]) for c in columns]).T
+        idx = np.asarray(idx, dtype = int)
+        return np.array([np.asarray(self.column(c)[:n_gal][idx]) for c in columns]).reshape(len(columns), len(idx)).T
+
+def load_glade_cache(glade_file, cosmology, cache_folder = None):
+    """
+    Opens the GLADE+ cache for a given cosmology, building it if not available.
+
+    Arguments:
+        :str or Path glade_file:           GLADE+ hdf5 file
+        :CosmologicalParameters cosmology: instance of CosmologicalParameters used to compute luminosity distances
+        :str or Path cache_folder:         folder where caches are stored. Default: same folder as glade_file
+
+    Returns:
+        :GladeCache: memory-mapped cache
+    """
+    return GladeCache(build_glade_cache(glade_file, cosmology, cache_folder = cache_folder))
@@ -0,0 +1,103 @@
+import numpy as np
+
+import optparse as op
+import sys
+from time import perf_counter
+
+from figaro.exceptions import except_hook
+
+"""
+Command line entry point (figaro <command>).
+Available commands:
+    warmup: compiles FIGARO's numba functions and stores them in numba's on-disk cache, so that the following runs start without JIT compilation
+    serve:  runs the inference service on a local UNIX socket (see figaro.service)
+"""
+
+def warmup(dims = [1, 2, 3], hierarchical = True, verbose = True):
+    """
+    Runs small DPGMM (and HDPGMM) reconstructions to compile every numba function used during inference.
+    Compiled functions are cached on disk (cache = True), hence this is needed once per installation.
+
+    Arguments:
+        :list dims:         dimensions to compile
+        :bool hierarchical: compile also the HDPGMM functions
+        :bool verbose:      print timings
+
+    Returns:
+        :double: total time [s]
+    """
+    from figaro.mixture import DPGMM, HDPGMM
+    rng = np.random.default_rng(0)
+    t0  = perf_counter()
+    for dim in dims:
+        t_dim   = perf_counter()
+        bounds  = np.array([[-5., 5.] for _ in range(dim)])
+        mix     = DPGMM(bounds)
+        events  = []
+        for _ in range(3):
+            mix.density_from_samples(rng.normal(size = (30, dim)))
+            draw = mix.build_mixture()
+            draw.evaluate_mixture(rng.uniform(-4, 4, size = (10, dim)))
+            draw.evaluate_log_mixture(rng.uniform(-4, 4, size = (10, dim)))
+            mix.initialise()
+            events.append([draw])
+        if hierarchical and dim < 3:
+            h_mix = HDPGMM(bounds, MC_draws = 1e2)
+            h_mix.density_from_samples(events)
+            h_mix.build_mixture()
+        if verbose:
+            print('{0}D: {1:.1f} s'.format(dim, perf_counter() - t_dim))
+    return perf_counter() - t0
+
+def main():
+
+    # FIGARO-specific hints for known improper usages
+    sys.excepthook = except_hook
+
+    commands = {'warmup': 'compile and cache the numba functions',
+                'serve':  'run the inference service on a local UNIX socket',
+                }
+    usage    = 'figaro <command> [options]\n\nCommands:\n' + '\n'.join(['    {0}: {1}'.format(c, h) for c, h in commands.items()])
+
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        print(usage)
+        sys.exit(1)
+    command = sys.argv[1]
+
+    if command == 'warmup':
+        parser = op.OptionParser(usage = 'figaro warmup [options]')
+        parser.add_option("--dims", type = "string", dest = "dims", help = "Comma-separated dimensions to compile", default = '1,2,3')
+        parser.add_option("--no_hierarchical", dest = "hierarchical", action = 'store_false', help = "Skip HDPGMM functions", default = True)
+        (options, args) = parser.parse_args(sys.argv[2:])
+        dims = [int(d) for d in options.dims.split(',')]
+        t    = warmup(dims, hierarchical = options.hierarchical)
+        print('Numba functions compiled and cached in {0:.1f} s'.format(t))
+
+    if command == 'serve':
+        parser = op.OptionParser(usage = 'figaro serve [options]')
+        parser.add_option("-s", "--socket", type = "string", dest = "socket", help = "UNIX socket file", default = 'figaro.sock')
+        parser.add_option("-o", "--output", type = "string", dest = "output", help = "Root output folder", default = '.')
+        parser.add_option("--max_dist", type = "string", dest = "max_dist", help = "Comma-separated maximum distances to preload", default = None)
+        parser.add_option("--n_gridpoints", type = "string", dest = "n_gridpoints", help = "Grid points (RA, dec, DL)", default = '720,360,100')
+        parser.add_option("--glade", type = "string", dest = "glade_file", help = "GLADE+ catalog file", default = None)
+        parser.add_option("--glade_cache", type = "string", dest = "glade_cache_folder", help = "Catalog cache folder", default = None)
+        parser.add_option("--grid_cache", type = "string", dest = "grid_cache_folder", help = "Grid cache folder", default = None)
+        parser.add_option("--max_instances", type = "int", dest = "max_instances", help = "Maximum number of configurations kept in memory", default = 4)
+        parser.add_option("--foreground_plots", dest = "background_plots", action = 'store_false', help = "Draw plots in the inference process", default = True)
+        (options, args) = parser.parse_args(sys.argv[2:])
+        from figaro.service import InferenceService, serve
+        defaults = {'n_gridpoints': [int(n) for n in options.n_gridpoints.split(',')]}
+        if options.glade_file is not None:
+            defaults['glade_file'] = options.glade_file
+        if options.glade_cache_folder is not None:
+            defaults['glade_cache_folder'] = options.glade_cache_folder
+        service = InferenceService(options.output, defaults = defaults, max_instances = options.max_instances, grid_cache_folder = options.grid_cache_folder, background_plots = options.background_plots)
+        if options.max_dist is not None:
+            t0 = perf_counter()
+            service.preload([float(d) for d in options.max_dist.split(',')])
+            print('Preloaded in {0:.1f} s'.format(perf_counter() - t0))
+        print('Listening on {0}'.format(options.socket))
+        serve(options.socket, service)
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,64 @@
 from __future__ import division
 import numpy as np
+import math
+from numba import njit
+
+from figaro.transform import ndtri, log2PI, probit_transform
+
+"""
+Coordinate conversions between celestial [ra, dec, D] and cartesian [x, y, z] coordinates, with
+    x = D sin(ra) cos(dec)
+    y = D cos(ra) cos(dec)
+    z = D sin(dec)
+Conversions are compiled loops over the points, reading the input and writing the output once. Output arrays can be passed with out (C-contiguous, e.g. a block of rows of a larger array), to fill large arrays in chunks without temporaries.
+"""
+
+@njit(cache = True, nogil = True)
+def _celestial_to_cartesian(c, out):
+    for i in range(len(c)):
+        cos_dec  = math.cos(c[i,1])
+        out[i,0] = c[i,2]*math.sin(c[i,0])*cos_dec
+        out[i,1] = c[i,2]*math.cos(c[i,0])*cos_dec
+        out[i,2] = c[i,2]*math.sin(c[i,1])
+
+@njit(cache = True, nogil = True)
+def _cartesian_to_celestial(x, out):
+    for i in range(len(x)):
+        r  = math.sqrt(x[i,0]**2 + x[i,1]**2 + x[i,2]**2)
+        ra = math.atan2(x[i,0], x[i,1])
+        if ra < 0:
+            ra += 2*np.pi
+        out[i,0] = ra
+        out[i,1] = math.asin(x[i,2]/r) if r > 0 else np.nan
+        out[i,2] = r
+
+@njit(cache = True, nogil = True)
+def _celestial_to_probit(c, lo, scale, log_volume, cartesian, probit, log_inv_J):
+    const = -1.5*log2PI - log_volume
+    v = np.empty(3)
+    for i in range(len(c)):
+        cos_dec = math.cos(c[i,1])
+        v[0]    = c[i,2]*math.sin(c[i,0])*cos_dec
+        v[1]    = c[i,2]*math.cos(c[i,0])*cos_dec
+        v[2]    = c[i,2]*math.sin(c[i,1])
+        s = 0.
+        for k in range(3):
+            t               = ndtri((v[k] - lo[k])/scale[k])
+            cartesian[i,k]  = v[k]
+            probit[i,k]     = t
+            s              += t*t
+        # log(D^2 cos(dec)) - log-Jacobian of the probit transformation
+        log_inv_J[i] = math.log(c[i,2]*c[i,2]*cos_dec) - const + 0.5*s
+
+def _as_points(vect):
+    return np.ascontiguousarray(np.atleast_2d(vect), dtype = np.float64)
+
+def _output(out, shape, dtype = np.float64):
+    if out is None:
+        return np.empty(shape, dtype = dtype)
+    if out.shape != shape or out.dtype not in [np.float64, np.float32] or not out.flags.c_contiguous:
+        raise ValueError("out must be a C-contiguous float64 or float32 array of shape {0}".format(shape))
+    return out
 
 def cartesian_to_spherical(vector):
     """Convert the Cartesian vector [x, y, z] to spherical coordinates [r, theta, phi].
@@ -12,13 +71,7 @@ def cartesian_to_spherical(vector):
     @return:        The spherical coordinate vector [r, theta, phi].
     @rtype:         numpy rank-1, 3D array
     """
-    r = np.linalg.norm(vector, axis = -1)
-    unit = np.array([v/np.linalg.norm(v) for v in vector])
-    theta = np.arcsin(unit[:,2])
-    phi = np.arctan2(unit[:,0], unit[:,1])
-    phi[phi<0] += 2*np.pi
-    coord = np.array([r,theta,phi]).T
-    return coord
+    return np.ascontiguousarray(cartesian_to_celestial(vector)[:,::-1])
 
 
 def spherical_to_cartesian(vector):
@@ -32,27 +85,50 @@ def spherical_to_cartesian(vector):
     @param cart_vect:       The Cartesian vector [x, y, z].
     @type cart_vect:        3D array or list
     """
-    # Trig alias.
-    cos_theta = np.cos(vector[:,1])
-    # The vector.
-    x = vector[:,2] * np.sin(vector[:,0]) * cos_theta
-    y = vector[:,2] * np.cos(vector[:,0]) * cos_theta
-    z = vector[:,2] * np.sin(vector[:,1])
-    return np.array([x,y,z]).T
-    
-def celestial_to_cartesian(celestial_vect):
+    return celestial_to_cartesian(vector)
+
+def celestial_to_cartesian(celestial_vect, out = None):
     """Convert the spherical coordinate vector [r, dec, ra] to the Cartesian vector [x, y, z]."""
-    celestial_vect = np.atleast_2d(celestial_vect)
-    return spherical_to_cartesian(celestial_vect)
+    celestial_vect = _as_points(celestial_vect)
+    out = _output(out, celestial_vect.shape)
+    _celestial_to_cartesian(celestial_vect, out)
+    return out
 
-def cartesian_to_celestial(cartesian_vect):
+def cartesian_to_celestial(cartesian_vect, out = None):
     """Convert the Cartesian vector [x, y, z] to the celestial coordinate vector [r, dec, ra]."""
-    cartesian_vect = np.atleast_2d(cartesian_vect)
-    spherical_vect = cartesian_to_spherical(cartesian_vect)
-    D   = spherical_vect[:,0]
-    dec = spherical_vect[:,1]
-    ra  = spherical_vect[:,2]
-    return np.array([ra, dec, D]).T
+    cartesian_vect = _as_points(cartesian_vect)
+    out = _output(out, cartesian_vect.shape)
+    _cartesian_to_celestial(cartesian_vect, out)
+    return out
+
+def celestial_to_probit(celestial_vect, bounds, out_cartesian = None, out_probit = None, out_log_inv_J = None, dtype = np.float64):
+    """
+    Converts celestial coordinates [ra, dec, D] into cartesian and probit-cartesian coordinates and computes the log of the inverse Jacobian of the whole transformation (celestial -> probit), in a single pass.
+    Equivalent to
+        cartesian = celestial_to_cartesian(celestial_vect)
+        probit    = transform_to_probit(cartesian, bounds)
+        log_inv_J = -np.log(inv_Jacobian(celestial_vect)) - probit_logJ(probit, bounds)
+
+    Arguments:
+        :np.ndarray celestial_vect: points in celestial coordinates
+        :np.ndarray bounds:         bounds of the cartesian coordinates
+        :np.ndarray out_cartesian:  output array for the cartesian coordinates (optional)
+        :np.ndarray out_probit:     output array for the probit coordinates (optional)
+        :np.ndarray out_log_inv_J:  output array for the log inverse Jacobian (optional)
+        :type dtype:                dtype of the output arrays that are not given (np.float64 or np.float32). Computations are in double precision
+
+    Returns:
+        :np.ndarray: cartesian coordinates
+        :np.ndarray: probit coordinates
+        :np.ndarray: log inverse Jacobian
+    """
+    celestial_vect = _as_points(celestial_vect)
+    transform      = probit_transform(bounds)
+    cartesian      = _output(out_cartesian, celestial_vect.shape, dtype)
+    probit         = _output(out_probit, celestial_vect.shape, dtype)
+    log_inv_J      = _output(out_log_inv_J, celestial_vect.shape[:1], dtype)
+    _celestial_to_probit(celestial_vect, transform.lo, transform.scale, transform.log_volume, cartesian, probit, log_inv_J)
+    return cartesian, probit, log_inv_J
 
 def Jacobian(cartesian_vect):
     cartesian_vect = np.atleast_2d(cartesian_vect)
@@ -62,7 +138,7 @@ def inv_Jacobian(celestial_vect):
     celestial_vect = np.atleast_2d(celestial_vect)
     detJ = Jacobian_in_celestial(celestial_vect)
     return 1/detJ
-    
+
 def Jacobian_in_celestial(celestial_vect):
     d = celestial_vect[:,2]
     theta = celestial_vect[:,1]
@@ -27,9 +27,11 @@ cdef class CosmologicalParameters:
         cdef unsigned int i, n = z.shape[0]
         cdef np.ndarray[double, ndim=1, mode="c"] DL = np.zeros(n)
         cdef double[:] DL_view = DL
+        cdef double[:] z_view  = z
         
-        for i in range(n):
-            DL_view[i] = self._LuminosityDistance_double(z[i])
+        with nogil:
+            for i in range(n):
+                DL_view[i] = self._LuminosityDistance_double(z_view[i])
         
         return DL
         
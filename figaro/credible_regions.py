@@ -1,90 +1,336 @@
 import numpy as np
 from figaro.cumulative import fast_log_cumulative
-from scipy.special import logsumexp
 
 # -----------------------
 # confidence calculations
 # -----------------------
 def FindNearest(ra, dec, dist, value):
-    idx = np.zeros(3, dtype = int)
-    for i, (d, v) in enumerate(zip([ra, dec, dist], value)):
-        idx[i] = int(np.abs(d-v).argmin())
+    """
+    Grid indices of the pixel closest to one or more points (binary search on each axis).
+    
+    Arguments:
+        :np.ndarray ra:    right ascension grid
+        :np.ndarray dec:   declination grid
+        :np.ndarray dist:  luminosity distance grid
+        :np.ndarray value: point (ra, dec, D) or array of points with shape (n, 3)
+    
+    Returns:
+        :np.ndarray: indices, shape (3,) or (n, 3)
+    """
+    value = np.asarray(value, dtype = np.float64)
+    pts   = np.atleast_2d(value)
+    idx   = np.array([_nearest_index(d, pts[:,i]) for i, d in enumerate([ra, dec, dist])], dtype = int).T
+    if value.ndim == 1:
+        return idx[0]
     return idx
 
+def log_sum(log_map):
+    """
+    log(sum(exp(log_map))), with the sum accumulated in double precision whatever the dtype of the map
+    
+    Arguments:
+        :np.ndarray log_map: log values
+    
+    Returns:
+        :double: log of the sum
+    """
+    if np.size(log_map) == 0:
+        return -np.inf
+    m = np.max(log_map)
+    if not np.isfinite(m):
+        return float(m)
+    return float(m) + np.log(np.sum(np.exp(log_map - m), dtype = np.float64))
+
 def FindHeights(args):
     (sortarr,cumarr,level) = args
     return sortarr[np.abs(cumarr-np.log(level)).argmin()]
 
+class RankedMap:
+    """
+    Log probability map ranked by decreasing probability, built once and queried many times with binary searches.
+    Only the highest pixels, holding at least max_level of the total probability, are sorted: they are selected with a partition and the low-probability tail is left unsorted.
+    Queries falling in the tail are answered with a single pass over the map.
+    Single precision maps are supported: normalisation and cumulative sums are accumulated in double precision.
+    
+    Arguments:
+        :np.ndarray log_map: log probability map
+        :double max_level:   highest credible level to be resolved by the sorted part (1 for a full sort)
+    
+    Returns:
+        :RankedMap: instance of RankedMap class
+    """
+    def __init__(self, log_map, max_level = 0.99):
+        self.log_map  = log_map
+        self.flat     = np.ravel(log_map)
+        self.size     = self.flat.size
+        self.log_norm = log_sum(self.flat)
+        self._cum_w   = {}
+        if max_level >= 1.:
+            self._rank(self.size)
+            return
+        k = min(self.size, max(1024, self.size//64))
+        while True:
+            self._rank(k)
+            if k == self.size or self.log_cum[-1] >= np.log(max_level):
+                break
+            k = min(self.size, 4*k)
+    
+    def _rank(self, k):
+        """
+        Sort the k highest pixels
+        
+        Arguments:
+            :int k: number of pixels to sort
+        """
+        if k >= self.size:
+            order = np.argsort(self.flat)[::-1]
+        else:
+            top   = np.argpartition(self.flat, self.size-k)[self.size-k:]
+            order = top[np.argsort(self.flat[top])[::-1]]
+        self.order  = order
+        self.sorted = np.ascontiguousarray(self.flat[order])
+        # Normalised cumulative distribution (the sorted part does not hold all the probability)
+        self.log_cum = fast_log_cumulative(self.sorted) + (log_sum(self.sorted) - self.log_norm)
+        self._cum_w  = {}
+    
+    @property
+    def complete(self):
+        return len(self.order) == self.size
+    
+    def _tail(self, heights):
+        """
+        Indices of the heights falling below the ranked part.
+        A single query is answered with one pass over the map: for more than one, the whole map is ranked instead.
+        """
+        if self.complete:
+            return []
+        tail = np.where(heights < self.sorted[-1])[0]
+        if len(tail) > 1:
+            self._rank(self.size)
+            return []
+        return tail
+    
+    def heights(self, adLevels):
+        """
+        Log probability thresholds of the credible regions
+        
+        Arguments:
+            :iterable adLevels: credible levels
+        
+        Returns:
+            :np.ndarray: heights
+        """
+        log_levels = np.log(np.ravel([adLevels]))
+        if not self.complete and np.any(log_levels > self.log_cum[-1]):
+            self._rank(self.size)
+        return self.sorted[_nearest_index(self.log_cum, log_levels)]
+    
+    def n_above(self, heights):
+        """
+        Number of pixels with log probability greater than or equal to each height
+        
+        Arguments:
+            :iterable heights: log probability thresholds
+        
+        Returns:
+            :np.ndarray: number of pixels
+        """
+        heights = np.ravel([heights])
+        tail    = self._tail(heights)
+        n       = np.searchsorted(-self.sorted, -heights, side = 'right')
+        for i in tail:
+            n[i] = np.count_nonzero(self.flat >= heights[i])
+        return n
+    
+    def levels(self, heights):
+        """
+        Credible level of the smallest credible region including each height
+        
+        Arguments:
+            :iterable heights: log probability thresholds
+        
+        Returns:
+            :np.ndarray: credible levels
+        """
+        heights = np.ravel([heights])
+        tail    = self._tail(heights)
+        # Closest ranked value (binary search on the decreasing sorted map)
+        idx     = len(self.sorted) - 1 - _nearest_index(self.sorted[::-1], heights)
+        levels  = np.exp(self.log_cum[idx])
+        for i in tail:
+            levels[i] = np.exp(log_sum(self.flat[self.flat >= heights[i]]) - self.log_norm)
+        return levels
+    
+    def measures(self, heights, weights):
+        """
+        Measure (area or volume) of the regions above each height
+        
+        Arguments:
+            :iterable heights:   log probability thresholds
+            :np.ndarray weights: pixel measures, independent of the first axis (shape log_map.shape[1:])
+        
+        Returns:
+            :np.ndarray: measures
+        """
+        heights = np.ravel([heights])
+        tail    = self._tail(heights)
+        # The weights are stored with their cumulative sum: the id cannot be reused by another array while cached
+        key     = id(weights)
+        if key not in self._cum_w or self._cum_w[key][0] is not weights:
+            self._cum_w[key] = (weights, np.cumsum(np.ravel(weights)[self.order%np.size(weights)]))
+        cum_w = self._cum_w[key][1]
+        n   = np.searchsorted(-self.sorted, -heights, side = 'right')
+        res = np.where(n > 0, cum_w[np.maximum(n-1, 0)], 0.)
+        for i in tail:
+            res[i] = np.sum(np.sum(self.log_map >= heights[i], axis = 0)*weights)
+        return res
+
+def _ranked(log_map, max_level = 0.99):
+    """
+    Returns a RankedMap (building it if a plain array is given)
+    """
+    if isinstance(log_map, RankedMap):
+        return log_map
+    return RankedMap(log_map, max_level = max_level)
+
 def FindHeightForLevel(inLogArr, adLevels):
-    # flatten and create reversed sorted list
-    adSorted = np.ascontiguousarray(np.sort(inLogArr.flatten())[::-1])
-    # create a normalized cumulative distribution
-    adCum = fast_log_cumulative(adSorted)
-    # find values closest to levels
-    adHeights = []
     adLevels = np.ravel([adLevels])
-    for level in adLevels:
-        idx = (np.abs(adCum-np.log(level))).argmin()
-        adHeights.append(adSorted[idx])
-    adHeights = np.array(adHeights)
-    return adHeights
+    return _ranked(inLogArr, max_level = np.max(adLevels)).heights(adLevels)
 
 def FindLevelForHeight(inLogArr, logvalue):
-    # flatten and create reversed sorted list
-    adSorted = np.ascontiguousarray(np.sort(inLogArr.flatten())[::-1])
-    # create a normalized cumulative distribution
-    adCum = fast_log_cumulative(adSorted)
-    # find index closest to value
-    idx = (np.abs(adSorted-logvalue)).argmin()
-    return np.exp(adCum[idx])
-
-def ConfidenceVolume(log_volume_map, ra_grid, dec_grid, distance_grid, adLevels = [0.68, 0.90]):
-    # create a normalized cumulative distribution
-    log_volume_map_sorted = np.ascontiguousarray(np.sort(log_volume_map.flatten())[::-1])
-    log_volume_map_cum = fast_log_cumulative(log_volume_map_sorted)
-    
-    # find the indeces  corresponding to the given CLs
-    adLevels = np.ravel([adLevels])
-    args = [(log_volume_map_sorted, log_volume_map_cum, level) for level in adLevels]
-    adHeights = [FindHeights(a) for a in args]
-    heights = {str(lev):hei for lev,hei in zip(adLevels,adHeights)}
-    dd  = np.diff(distance_grid)[0]
-    ddec = np.diff(dec_grid)[0]
-    dra = np.diff(ra_grid)[0]
-    volumes         = []
-    index           = []
-    for height in adHeights:
-        
-        (i_ra, i_dec, i_d,) = np.where(log_volume_map>=height)
-        volumes.append(np.sum([distance_grid[i_d]**2. *np.cos(dec_grid[i_dec]) * dd * dra * ddec for i_d,i_dec in zip(i_d,i_dec)]))
-        index.append(np.array([i_ra, i_dec, i_d]).T)
+    levels = _ranked(inLogArr).levels(logvalue)
+    if np.ndim(logvalue) == 0:
+        return levels[0]
+    return levels
 
-    volume_confidence = np.array(volumes)
+class CredibleRegionIndex:
+    """
+    Sequence of the pixel indices belonging to each credible region.
+    Index arrays are only materialised when accessed.
     
-    return volume_confidence, index, np.array(adHeights)
+    Arguments:
+        :np.ndarray log_map: log probability map
+        :np.ndarray heights: log probability thresholds of the credible regions
+    
+    Returns:
+        :CredibleRegionIndex: instance of CredibleRegionIndex class
+    """
+    def __init__(self, log_map, heights):
+        self.log_map = log_map
+        self.heights = np.atleast_1d(heights)
+    
+    def __len__(self):
+        return len(self.heights)
+    
+    def __getitem__(self, i):
+        return np.argwhere(self.log_map >= self.heights[i])
+    
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
 
-def ConfidenceArea(log_skymap, ra_grid, dec_grid, adLevels = [0.68, 0.90]):
+def volume_weights(ra_grid, dec_grid, distance_grid):
+    """
+    Volume of each pixel of a (ra, dec, distance) grid. Pixel volumes do not depend on ra.
     
-    # create a normalized cumulative distribution
-    log_skymap_sorted = np.ascontiguousarray(np.sort(log_skymap.flatten())[::-1])
-    log_skymap_cum = fast_log_cumulative(log_skymap_sorted)
-    # find the indeces  corresponding to the given CLs
-    adLevels = np.ravel([adLevels])
-    args = [(log_skymap_sorted, log_skymap_cum, level) for level in adLevels]
-    adHeights = [FindHeights(a) for a in args]
+    Arguments:
+        :np.ndarray ra_grid:       ra grid
+        :np.ndarray dec_grid:      dec grid
+        :np.ndarray distance_grid: distance grid
+    
+    Returns:
+        :np.ndarray: pixel volumes, shape (len(dec_grid), len(distance_grid))
+    """
+    dd   = np.diff(distance_grid)[0]
+    ddec = np.diff(dec_grid)[0]
+    dra  = np.diff(ra_grid)[0]
+    return np.outer(np.cos(dec_grid)*ddec*dra, distance_grid**2*dd)
+
+def area_weights(ra_grid, dec_grid):
+    """
+    Area (in square degrees) of each pixel of a (ra, dec) grid. Pixel areas do not depend on ra.
+    
+    Arguments:
+        :np.ndarray ra_grid:  ra grid
+        :np.ndarray dec_grid: dec grid
+    
+    Returns:
+        :np.ndarray: pixel areas, shape (len(dec_grid),)
+    """
     ddec = np.diff(dec_grid)[0]
-    dra = np.diff(ra_grid)[0]
-    areas = []
-    index = []
-                
-    for height in adHeights:
-        (i_ra,i_dec,) = np.where(log_skymap>=height)
-        areas.append(np.sum([dra*np.cos(dec_grid[i_d])*ddec for i_d in i_dec])*(180.0/np.pi)**2.0)
-
-        index.append(np.array([i_ra, i_dec]).T)
-    area_confidence = np.array(areas)
-    
-    return area_confidence, index, np.array(adHeights)
+    dra  = np.diff(ra_grid)[0]
+    return dra*np.cos(dec_grid)*ddec*(180.0/np.pi)**2.0
+
+def _nearest_index(sorted_arr, values):
+    """
+    Index of the element closest to each value in a non-decreasing array (binary search)
+    """
+    idx  = np.clip(np.searchsorted(sorted_arr, values), 1, len(sorted_arr)-1)
+    left = np.abs(sorted_arr[idx-1] - values) <= np.abs(sorted_arr[idx] - values)
+    return np.where(left, idx-1, idx)
+
+def ConfidenceVolume(log_volume_map, ra_grid, dec_grid, distance_grid, adLevels = [0.68, 0.90], weights = None):
+    if weights is None:
+        weights = volume_weights(ra_grid, dec_grid, distance_grid)
+    adLevels  = np.ravel([adLevels])
+    ranked    = _ranked(log_volume_map, max_level = np.max(adLevels))
+    adHeights = ranked.heights(adLevels)
+    volumes   = ranked.measures(adHeights, weights)
+    index     = CredibleRegionIndex(ranked.log_map, adHeights)
+    return volumes, index, adHeights
+
+def ConfidenceArea(log_skymap, ra_grid, dec_grid, adLevels = [0.68, 0.90], weights = None):
+    if weights is None:
+        weights = area_weights(ra_grid, dec_grid)
+    adLevels  = np.ravel([adLevels])
+    ranked    = _ranked(log_skymap, max_level = np.max(adLevels))
+    adHeights = ranked.heights(adLevels)
+    areas     = ranked.measures(adHeights, weights)
+    index     = CredibleRegionIndex(ranked.log_map, adHeights)
+    return areas, index, adHeights
+
+def SearchedRegions(log_skymap, log_volume_map, ra_grid, dec_grid, distance_grid, hosts, area_w = None, volume_w = None):
+    """
+    Credible levels, searched areas and searched volumes for a set of hosts, in a single vectorised pass over the ranked maps.
+    The searched area (volume) is the area (volume) of the smallest credible region including the host pixel.
+    
+    Arguments:
+        :np.ndarray or RankedMap log_skymap:     log skymap, shape (n_ra, n_dec)
+        :np.ndarray or RankedMap log_volume_map: log volume map, shape (n_ra, n_dec, n_dist). If None, only sky quantities are computed
+        :np.ndarray ra_grid:                     right ascension grid
+        :np.ndarray dec_grid:                    declination grid
+        :np.ndarray distance_grid:               luminosity distance grid
+        :np.ndarray hosts:                       host positions (ra, dec, D) or (ra, dec), shape (n_hosts, 3) or (n_hosts, 2)
+        :np.ndarray area_w:                      pixel areas (see area_weights)
+        :np.ndarray volume_w:                    pixel volumes (see volume_weights)
+    
+    Returns:
+        :np.ndarray: pixel indices, shape (n_hosts, 3)
+        :np.ndarray: sky credible levels
+        :np.ndarray: volume credible levels (nan if not available)
+        :np.ndarray: searched areas [deg^2]
+        :np.ndarray: searched volumes [Mpc^3] (nan if not available)
+    """
+    hosts = np.atleast_2d(np.asarray(hosts, dtype = np.float64))
+    if hosts.shape[-1] == 2:
+        hosts          = np.c_[hosts, np.full(len(hosts), distance_grid[0])]
+        log_volume_map = None
+    if area_w is None:
+        area_w = area_weights(ra_grid, dec_grid)
+    idx         = FindNearest(ra_grid, dec_grid, distance_grid, hosts)
+    ranked_sky  = _ranked(log_skymap)
+    h_sky       = ranked_sky.log_map[idx[:,0], idx[:,1]]
+    CR          = ranked_sky.levels(h_sky)
+    areas       = ranked_sky.measures(h_sky, area_w)
+    if log_volume_map is None:
+        return idx, CR, np.full(len(hosts), np.nan), areas, np.full(len(hosts), np.nan)
+    if volume_w is None:
+        volume_w = volume_weights(ra_grid, dec_grid, distance_grid)
+    ranked_vol = _ranked(log_volume_map)
+    h_vol      = ranked_vol.log_map[idx[:,0], idx[:,1], idx[:,2]]
+    CV         = ranked_vol.levels(h_vol)
+    volumes    = ranked_vol.measures(h_vol, volume_w)
+    return idx, CR, CV, areas, volumes
 
 def ConfidenceInterval(probability, grid, adLevels = [0.68, 0.90]):
     dx = np.diff(grid)[0]
@@ -5,43 +5,167 @@
 from __future__ import division
 import numpy as np
 cimport numpy as np
-from libc.math cimport log,exp
+from cython.parallel cimport prange
+cimport openmp
+from libc.math cimport log1p, exp
 
 '''
 From https://github.com/wdpozzo/3d_volume/cumulative.pyx
+Block-parallel prefix sums: each block is accumulated independently, block totals are combined serially and added back in a second parallel pass.
+Accumulation is always carried out in double precision, whatever the input type.
 '''
 
-cdef inline double d_max(double a, double b) nogil: return a if a >= b else b
-cdef inline double log_add(double x, double y) nogil: return x+log(1+exp(y-x)) if x >= y else y+log(1+exp(x-y))
+ctypedef fused floating:
+    float
+    double
 
-def fast_log_cumulative(np.ndarray[double, ndim=1, mode="c"]  f):
-    return _fast_log_cumulative(f)
+# Below this size a single block is used: thread start-up would dominate
+cdef Py_ssize_t min_block = 65536
 
-cdef np.ndarray[double, ndim=1, mode="c"] _fast_log_cumulative(np.ndarray[double, ndim=1, mode="c"] f):
+cdef inline double log_add(double x, double y) nogil: return x+log1p(exp(y-x)) if x >= y else y+log1p(exp(x-y))
 
-    cdef unsigned int n = f.shape[0]
-    cdef np.ndarray[double, ndim=1, mode="c"] h = np.zeros(n, dtype = np.double)
+cdef Py_ssize_t _n_blocks(Py_ssize_t n):
+    # Honours OMP_NUM_THREADS (and the CPU affinity, through the OpenMP runtime)
+    cdef Py_ssize_t n_threads = openmp.omp_get_max_threads()
+    return max(1, min(n_threads, n//min_block))
 
-    h[0] = f[0]
-    for i in range(1,n):
-        h[i] = log_add(h[i-1],f[i])
-    cdef double hmax = h[n-1]
-    for i in range(n):
-        h[i] = h[i] - hmax
-        
-    return h
+def _output(f, out):
+    """
+    Checks the output array (or allocates it if None)
+    """
+    if out is None:
+        return np.empty(f.shape[0], dtype = f.dtype)
+    if out.shape[0] != f.shape[0] or out.dtype != f.dtype:
+        raise ValueError("out must have the same shape and dtype as the input array")
+    return out
 
-def fast_cumulative(np.ndarray[double, ndim=1, mode="c"]  f):
-    return _fast_cumulative(f)
+# Log cumulative
 
-cdef np.ndarray[double, ndim=1, mode="c"] _fast_cumulative(np.ndarray[double, ndim=1, mode="c"] f):
+cdef double _block_log_cumulative(const floating[:] f, floating[:] h, Py_ssize_t start, Py_ssize_t end) nogil:
+    cdef Py_ssize_t i
+    cdef double acc = f[start]
+    h[start] = acc
+    for i in range(start+1, end):
+        acc  = log_add(acc, f[i])
+        h[i] = acc
+    return acc
 
-    cdef unsigned int n = f.shape[0]
-    cdef np.ndarray[double, ndim=1, mode="c"] h = np.zeros(n, dtype = np.double)
-    h[0] = f[0]
-    for i in range(1,n):
-        h[i] = h[i-1] + f[i]
-    cdef double hmax = h[n-1]
-    for i in range(n):
-        h[i] = h[i]/hmax
-    return h
+cdef void _log_cumulative(const floating[:] f, floating[:] h, Py_ssize_t n_blocks):
+    cdef Py_ssize_t n = f.shape[0]
+    cdef Py_ssize_t b, i, start, end
+    cdef Py_ssize_t size = (n + n_blocks - 1)//n_blocks
+    cdef double[:] offsets
+    cdef double total, tmp
+    if n == 0:
+        return
+    # No empty blocks
+    n_blocks = (n + size - 1)//size
+    offsets  = np.empty(n_blocks, dtype = np.double)
+    # First pass: independent blocks
+    for b in prange(n_blocks, nogil = True, schedule = 'static'):
+        start      = b*size
+        end        = min(start+size, n)
+        offsets[b] = _block_log_cumulative(f, h, start, end)
+    # Block offsets (exclusive scan over block totals)
+    total = offsets[0]
+    for b in range(1, n_blocks):
+        tmp        = offsets[b]
+        offsets[b] = total
+        total      = log_add(total, tmp)
+    # Second pass: add the offsets and normalise
+    for i in prange(n, nogil = True, schedule = 'static'):
+        if i >= size:
+            h[i] = log_add(offsets[i//size], h[i]) - total
+        else:
+            h[i] = h[i] - total
+
+def fast_log_cumulative(const floating[:] f, out = None):
+    """
+    Normalised log cumulative sum of exp(f): h[i] = log(sum_{j<=i} exp(f[j])) - log(sum_j exp(f[j]))
+
+    Arguments:
+        :np.ndarray f:   1D array (float32 or float64, possibly strided or read-only)
+        :np.ndarray out: output array with the same shape and dtype of f. Default: new array
+
+    Returns:
+        :np.ndarray: normalised log cumulative
+    """
+    out = _output(np.asarray(f), out)
+    cdef floating[:] h = out
+    _log_cumulative(f, h, _n_blocks(f.shape[0]))
+    return out
+
+def fast_log_cumulative_inplace(floating[:] f):
+    """
+    In-place version of fast_log_cumulative: f is overwritten with its normalised log cumulative.
+
+    Arguments:
+        :np.ndarray f: 1D array (float32 or float64, possibly strided)
+
+    Returns:
+        :np.ndarray: f
+    """
+    _log_cumulative(f, f, _n_blocks(f.shape[0]))
+    return np.asarray(f)
+
+# Cumulative
+
+cdef double _block_cumulative(const floating[:] f, floating[:] h, Py_ssize_t start, Py_ssize_t end) nogil:
+    cdef Py_ssize_t i
+    cdef double acc = 0.
+    for i in range(start, end):
+        acc  = acc + f[i]
+        h[i] = acc
+    return acc
+
+cdef void _cumulative(const floating[:] f, floating[:] h, Py_ssize_t n_blocks):
+    cdef Py_ssize_t n = f.shape[0]
+    cdef Py_ssize_t b, i, start, end
+    cdef Py_ssize_t size = (n + n_blocks - 1)//n_blocks
+    cdef double[:] offsets
+    cdef double total, tmp
+    if n == 0:
+        return
+    # No empty blocks
+    n_blocks = (n + size - 1)//size
+    offsets  = np.empty(n_blocks, dtype = np.double)
+    for b in prange(n_blocks, nogil = True, schedule = 'static'):
+        start      = b*size
+        end        = min(start+size, n)
+        offsets[b] = _block_cumulative(f, h, start, end)
+    total = 0.
+    for b in range(n_blocks):
+        tmp        = offsets[b]
+        offsets[b] = total
+        total      = total + tmp
+    for i in prange(n, nogil = True, schedule = 'static'):
+        h[i] = (offsets[i//size] + h[i])/total
+
+def fast_cumulative(const floating[:] f, out = None):
+    """
+    Normalised cumulative sum: h[i] = sum_{j<=i} f[j] / sum_j f[j]
+
+    Arguments:
+        :np.ndarray f:   1D array (float32 or float64, possibly strided or read-only)
+        :np.ndarray out: output array with the same shape and dtype of f. Default: new array
+
+    Returns:
+        :np.ndarray: normalised cumulative
+    """
+    out = _output(np.asarray(f), out)
+    cdef floating[:] h = out
+    _cumulative(f, h, _n_blocks(f.shape[0]))
+    return out
+
+def fast_cumulative_inplace(floating[:] f):
+    """
+    In-place version of fast_cumulative: f is overwritten with its normalised cumulative.
+
+    Arguments:
+        :np.ndarray f: 1D array (float32 or float64, possibly strided)
+
+    Returns:
+        :np.ndarray: f
+    """
+    _cumulative(f, f, _n_blocks(f.shape[0]))
+    return np.asarray(f)
@@ -1,9 +1,13 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from numba import jit, prange
+import warnings
 from pathlib import Path
+from collections import deque
+from scipy.linalg import cholesky, solve_triangular
+from scipy.special import ndtri
+from scipy.stats.qmc import Sobol
+from multiprocessing import Pool
 from figaro.cumulative import fast_cumulative
-import ligo.skymap.plot
+from figaro.plot_settings import pyplot
 
 log2e = np.log2(np.e)
 
@@ -17,35 +21,327 @@ def compute_angular_coefficients(x, step = 500):
         a[i] = angular_coefficient(N[i:i+step], x[i:i+step])
     return a
 
-@jit
-def compute_autocorrelation(draws, mean, dx):
-    taumax          = draws.shape[0]//2
-    n_draws         = draws.shape[0]
-    autocorrelation = np.zeros(taumax, dtype = np.float64)
-    N = 0.
-    for i in prange(n_draws):
-        N += np.sum((draws[i] - mean)*(draws[i] - mean))*dx/n_draws
+class RunningSlope:
+    """
+    Least-squares slope of the last n_max values of an equally spaced series.
+    The regression sums are updated in O(1) for every new value: with x_i = i*step, sum(x) and sum(x^2) only depend on the number of values, while sum(y) and sum(i*y) are updated as the window slides.
+    
+    Arguments:
+        :int n_max:     window length
+        :double step:   spacing between consecutive values
+    
+    Returns:
+        :RunningSlope: instance of RunningSlope class
+    """
+    def __init__(self, n_max, step = 1):
+        self.n_max = int(n_max)
+        self.step  = step
+        self.initialise()
+    
+    def initialise(self):
+        self.values  = deque(maxlen = self.n_max)
+        self.S_y     = 0.
+        self.S_iy    = 0.
+        self.n_added = 0
+    
+    def add(self, y):
+        """
+        Add a value to the series
+        
+        Arguments:
+            :double y: new value
+        """
+        n = len(self.values)
+        if n == self.n_max:
+            y_out     = self.values[0]
+            self.S_iy = self.S_iy - (self.S_y - y_out) + (n-1)*y
+            self.S_y  = self.S_y - y_out + y
+        else:
+            self.S_iy += n*y
+            self.S_y  += y
+        self.values.append(y)
+        self.n_added += 1
+        # Resynchronise the running sums once per window to prevent round-off accumulation
+        if self.n_added%self.n_max == 0:
+            v         = np.array(self.values)
+            self.S_y  = v.sum()
+            self.S_iy = (np.arange(len(v))*v).sum()
+    
+    def slope(self):
+        """
+        Least-squares slope of the values in the window
+        
+        Returns:
+            :double: slope
+        """
+        n     = len(self.values)
+        S_x   = n*(n-1)/2.
+        S_xx  = (n-1)*n*(2*n-1)/6.
+        denom = n*S_xx - S_x**2
+        if denom == 0:
+            return np.nan
+        return (n*self.S_iy - S_x*self.S_y)/(denom*self.step)
+
+def _log_gaussian(x, mu, L):
+    """
+    Multivariate Normal logpdf
+    
+    Arguments:
+        :np.ndarray x:  points, shape (n, dim)
+        :np.ndarray mu: mean
+        :np.ndarray L:  lower Cholesky factor of the covariance matrix
+    
+    Returns:
+        :np.ndarray: MultivariateNormal(mu, L@L.T).logpdf(x)
+    """
+    dev  = solve_triangular(L, (x - mu).T, lower = True)
+    maha = np.sum(dev**2, axis = 0)
+    return -0.5*maha - np.log(np.diag(L)).sum() - 0.5*len(mu)*np.log(2*np.pi)
+
+class IncrementalEntropy:
+    """
+    Entropy estimator for a DPGMM that is being updated one sample at a time.
+    Each component keeps a persistent set of standard normal draws (common random numbers), mapped onto its current mean and covariance.
+    When a sample is added only the changed components are re-evaluated: their own samples under every component and every sample under them.
+    The entropy is estimated as -sum_k w_k <log p(x)>_k, stratified over components.
+    The cached cross terms take 8*K^2*n_draws bytes (K components, ~80 MB for K = 300 and n_draws = 100): above max_cached components the cache is dropped and every call re-evaluates all the K^2*n_draws terms, with memory linear in K.
+    
+    Arguments:
+        :int n_draws:    number of persistent draws per component
+        :int max_cached: maximum number of components for which the cross terms are cached
+    
+    Returns:
+        :IncrementalEntropy: instance of IncrementalEntropy class
+    """
+    def __init__(self, n_draws = 100, max_cached = 300):
+        self.n_draws    = int(n_draws)
+        self.max_cached = int(max_cached)
+        self.initialise()
+    
+    def initialise(self):
+        self.mu    = []
+        self.sigma = []
+        self.L     = []
+        self.z     = []
+        self.x     = np.zeros((0, self.n_draws, 0))
+        self.logN  = np.zeros((0, self.n_draws, 0))
+    
+    def _resize(self, K, dim):
+        """
+        Grow the storage (capacity doubling) to hold K components.
+        The cross terms are stored only up to max_cached components.
+        """
+        cap = self.x.shape[0]
+        if K <= cap:
+            return
+        new_cap = max(K, 2*cap, 8)
+        if K <= self.max_cached:
+            new_cap = min(new_cap, self.max_cached)
+        x = np.zeros((new_cap, self.n_draws, dim))
+        if cap > 0:
+            x[:cap] = self.x
+        self.x = x
+        if new_cap <= self.max_cached:
+            logN = np.zeros((new_cap, self.n_draws, new_cap))
+            if cap > 0:
+                logN[:cap, :, :cap] = self.logN
+            self.logN = logN
+        else:
+            self.logN = np.zeros((0, self.n_draws, 0))
+    
+    def compute_entropy(self, mix):
+        """
+        Update the estimator with the current state of the mixture and return the entropy
+        
+        Arguments:
+            :DPGMM mix: DPGMM instance (or child) being updated
         
-    for tau in prange(taumax):
-        sum = 0.
-        for i in prange(n_draws):
-            sum += np.sum((draws[i] - mean)*(draws[(i+tau)%n_draws] - mean))*dx/(N*n_draws)
-        autocorrelation[tau] = sum
-    return taumax, autocorrelation
-
-def compute_entropy_single_draw(mixture, n_draws = 1e3):
-    samples = mixture._sample_from_dpgmm_probit(int(n_draws))
-    logP    = mixture._evaluate_log_mixture_in_probit(samples)
-    entropy = np.sum(-logP)/(n_draws*log2e)
-    return entropy
-
-def compute_entropy(draws, n_draws = 1e3):
-    S = np.zeros(len(draws))
-    for i, d in enumerate(draws):
-        S[i] = compute_entropy_single_draw(d, int(n_draws))
-    return S
+        Returns:
+            :double: entropy
+        """
+        K   = mix.n_cl
+        dim = mix.dim
+        self._resize(K, dim)
+        changed = []
+        for k in range(K):
+            comp = mix.mixture[k]
+            if k == len(self.mu):
+                self.z.append(np.random.standard_normal((self.n_draws, dim)))
+                self.mu.append(None)
+                self.sigma.append(None)
+                self.L.append(None)
+            elif np.array_equal(comp.mu, self.mu[k]) and np.array_equal(comp.sigma, self.sigma[k]):
+                continue
+            self.mu[k]    = np.array(comp.mu)
+            self.sigma[k] = np.array(comp.sigma)
+            self.L[k]     = cholesky(self.sigma[k], lower = True)
+            self.x[k]     = self.mu[k] + self.z[k]@self.L[k].T
+            changed.append(k)
+        points = self.x[:K].reshape(-1, dim)
+        if self.logN.shape[0] < K:
+            # Cross terms not cached: running log-sum-exp over components
+            logw = np.log(mix.w)
+            logP = np.full(len(points), -np.inf)
+            for j in range(K):
+                logP = np.logaddexp(logP, logw[j] + _log_gaussian(points, self.mu[j], self.L[j]))
+            return -np.sum(mix.w*np.mean(logP.reshape(K, self.n_draws), axis = -1))/log2e
+        if len(changed) > 0:
+            # Every point under the changed components
+            for j in changed:
+                self.logN[:K, :, j] = _log_gaussian(points, self.mu[j], self.L[j]).reshape(K, self.n_draws)
+            # Points of the changed components under every other component
+            unchanged = [j for j in range(K) if j not in changed]
+            for k in changed:
+                for j in unchanged:
+                    self.logN[k, :, j] = _log_gaussian(self.x[k], self.mu[j], self.L[j])
+        logN  = self.logN[:K, :, :K] + np.log(mix.w)
+        max_N = logN.max(axis = -1)
+        logP  = max_N + np.log(np.exp(logN - max_N[..., None]).sum(axis = -1))
+        return -np.sum(mix.w*np.mean(logP, axis = -1))/log2e
+
+def compute_autocorrelation(draws, mean, dx, c = 5):
+    """
+    Autocorrelation of a chain of draws evaluated on a grid, via FFT along the draw axis (vectorised over the grid).
+    The autocorrelation is circular, C(tau) = sum_i <d_i - mean, d_{i+tau} - mean> / sum_i <d_i - mean, d_i - mean>, with indices taken modulo the number of draws.
+    The integrated autocorrelation time is estimated with Sokal's adaptive window: the smallest M such that M >= c*tau_int(M).
+    
+    Arguments:
+        :np.ndarray draws: draws evaluated on the grid, shape (n_draws, n_points)
+        :np.ndarray mean:  mean of the draws, shape (n_points)
+        :double dx:        grid spacing
+        :double c:         window constant
+    
+    Returns:
+        :int:        maximum lag
+        :np.ndarray: autocorrelation for lags 0...taumax-1
+        :double:     integrated autocorrelation time
+        :double:     effective number of draws
+    """
+    n_draws = draws.shape[0]
+    taumax  = n_draws//2
+    f       = np.fft.rfft(draws - mean, axis = 0)
+    # Wiener-Khinchin, summed over the grid (the grid spacing cancels in the normalisation)
+    acov    = np.fft.irfft(np.sum(np.abs(f)**2, axis = -1), n = n_draws)*dx
+    autocorrelation = acov[:taumax]/acov[0]
+    tau_int = integrated_autocorrelation_time(autocorrelation, c = c)
+    return taumax, autocorrelation, tau_int, n_draws/tau_int
+
+def integrated_autocorrelation_time(autocorrelation, c = 5):
+    """
+    Integrated autocorrelation time, tau_int = 1 + 2*sum_{tau >= 1} C(tau), truncated with Sokal's adaptive window.
+    
+    Arguments:
+        :np.ndarray autocorrelation: normalised autocorrelation (C(0) = 1)
+        :double c:                   window constant
+    
+    Returns:
+        :double: integrated autocorrelation time
+    """
+    taus   = 2*np.cumsum(autocorrelation) - 1
+    window = np.arange(len(taus)) >= c*taus
+    if np.any(window):
+        return max(taus[np.argmax(window)], 1.)
+    return max(taus[-1], 1.)
+
+def common_normal_draws(n_draws, dim, qmc = False, seed = None):
+    """
+    Standard normal draws shared by every mixture draw and every component (common random numbers).
+    With qmc = True, a scrambled Sobol' sequence is mapped through the normal inverse CDF.
+    
+    Arguments:
+        :int n_draws: number of points
+        :int dim:     number of dimensions
+        :bool qmc:    use quasi-Monte Carlo points
+        :int seed:    random seed
+    
+    Returns:
+        :np.ndarray: points, shape (n_draws, dim)
+    """
+    if qmc:
+        u = Sobol(dim, scramble = True, seed = seed).random(int(n_draws))
+        return ndtri(np.clip(u, 1e-12, 1-1e-12))
+    return np.random.default_rng(seed).standard_normal((int(n_draws), dim))
+
+def _mixture_components(mixture):
+    """
+    Means, covariances and weights of the components of a mixture instance or of a DPGMM instance (or child).
+    """
+    if hasattr(mixture, 'means'):
+        return mixture.means, mixture.covs, mixture.w
+    return [comp.mu for comp in mixture.mixture], [comp.sigma for comp in mixture.mixture], np.array(mixture.w)
+
+def compute_entropy_single_draw(mixture, n_draws = 1e3, z = None):
+    """
+    Entropy of a single draw, -sum_k w_k <log p(x)>_k, with samples stratified over components.
+    Each component gets its own block of the standard normal points z (number of points proportional to its weight), used as antithetic pairs (z, -z).
+    
+    Arguments:
+        :mixture mixture: mixture instance (or DPGMM instance)
+        :int n_draws:     total number of samples
+        :np.ndarray z:    standard normal points (see common_normal_draws). Default: new pseudo-random points
+    
+    Returns:
+        :double: entropy [bits]
+        :double: standard error [bits]
+    """
+    if z is None:
+        z = common_normal_draws(n_draws, mixture.dim)
+    means, covs, weights = _mixture_components(mixture)
+    # Proportional allocation: component k uses the next n_k points of z, antithetic pairs (z, -z)
+    n_comp = np.maximum(np.round(np.asarray(weights)*len(z)/2).astype(int), 2)
+    start  = np.cumsum(n_comp) - n_comp
+    S      = 0.
+    var    = 0.
+    for mean, cov, w, n, i in zip(means, covs, weights, n_comp, start):
+        L     = np.linalg.cholesky(np.atleast_2d(cov))
+        dx    = z[(i + np.arange(n))%len(z)] @ L.T
+        logP  = 0.5*(mixture._evaluate_log_mixture_in_probit(np.atleast_1d(mean) + dx) + mixture._evaluate_log_mixture_in_probit(np.atleast_1d(mean) - dx))
+        S    += -w*np.mean(logP)
+        var  += w**2*np.var(logP, ddof = 1)/n
+    return S/log2e, np.sqrt(var)/log2e
+
+def compute_entropy_rate_single_draw(mixture, n_draws = 1e3, z = None):
+    S, dS = compute_entropy_single_draw(mixture, n_draws, z)
+    return S/mixture.n_pts, dS/mixture.n_pts
+
+def _entropy_worker(args):
+    mixture, n_draws, z, rate = args
+    if rate:
+        return compute_entropy_rate_single_draw(mixture, n_draws, z)
+    return compute_entropy_single_draw(mixture, n_draws, z)
+
+def compute_entropy(draws, n_draws = 1e3, n_parallel = 1, qmc = False, seed = None, rate = False):
+    """
+    Entropy of a set of draws, with standard errors.
+    The same standard normal (or quasi-Monte Carlo) points are used for every draw: differences between draws are estimated with less noise than with independent samples.
+    
+    Arguments:
+        :iterable draws:  mixture instances
+        :int n_draws:     number of samples per draw
+        :int n_parallel:  number of processes
+        :bool qmc:        use quasi-Monte Carlo points (standard errors are then conservative)
+        :int seed:        random seed
+        :bool rate:       return entropy per sample (entropy rate)
+    
+    Returns:
+        :np.ndarray: entropy [bits]
+        :np.ndarray: standard errors [bits]
+    """
+    draws = list(draws)
+    if len(draws) == 0:
+        return np.zeros(0), np.zeros(0)
+    z     = common_normal_draws(n_draws, draws[0].dim, qmc = qmc, seed = seed)
+    tasks = [(d, int(n_draws), z, rate) for d in draws]
+    if n_parallel == 1:
+        res = [_entropy_worker(t) for t in tasks]
+    else:
+        with Pool(n_parallel) as pool:
+            res = pool.map(_entropy_worker, tasks, chunksize = max(1, len(tasks)//(4*n_parallel)))
+    res = np.array(res)
+    return res[:,0], res[:,1]
 
 def autocorrelation(draws, bounds = None, out_folder = '.', name = 'event', n_points = 1000, save = True, show = False):
+    plt = pyplot()
     # 1-d only
     
     all_bounds = np.atleast_2d([d.bounds[0] for d in draws])
@@ -67,10 +363,11 @@ def autocorrelation(draws, bounds = None, out_folder = '.', name = 'event', n_po
     functions = np.array([mix.evaluate_mixture(np.atleast_2d(x).T) for mix in draws])
     mean      = np.mean(functions, axis = 0)
     
-    taumax, ac = compute_autocorrelation(functions, mean, dx)
+    taumax, ac, tau_int, n_eff = compute_autocorrelation(functions, mean, dx)
     
     fig, ax = plt.subplots()
     ax.plot(np.arange(taumax), ac, ls = '--', marker = '', lw = 0.7)
+    ax.set_title('$\\tau_{{int}} = {0:.1f},\ N_{{eff}} = {1:.0f}$'.format(tau_int, n_eff))
     ax.set_xlabel('$\\tau$')
     ax.set_ylabel('$C(\\tau)$')
     ax.grid(visible = True)
@@ -79,11 +376,15 @@ def autocorrelation(draws, bounds = None, out_folder = '.', name = 'event', n_po
     if save:
         fig.savefig(Path(out_folder, name+'_autocorrelation.pdf'), bbox_inches = 'tight')
     plt.close()
+    return tau_int, n_eff
 
-def entropy(draws, out_folder, name = 'event', n_draws = 1e3, step = 1, dim = 1, show = False, save = True):
-    S = compute_entropy(draws, int(n_draws**dim))
+def entropy(draws, out_folder, name = 'event', n_draws = 1e3, step = 1, dim = 1, show = False, save = True, n_parallel = 1, qmc = False):
+    plt = pyplot()
+    S, dS = compute_entropy(draws, int(n_draws**dim), n_parallel = n_parallel, qmc = qmc)
+    N     = np.arange(1, len(draws)+1)*step
     fig, ax = plt.subplots()
-    ax.plot(np.arange(1, len(draws)+1)*step, S, ls = '--', marker = '', lw = 0.7)
+    ax.plot(N, S, ls = '--', marker = '', lw = 0.7)
+    ax.fill_between(N, S-dS, S+dS, alpha = 0.3, lw = 0)
     ax.set_xlabel('$N$')
     ax.set_ylabel('$S(N)\ [\mathrm{bits}]$')
     ax.grid()
@@ -94,41 +395,38 @@ def entropy(draws, out_folder, name = 'event', n_draws = 1e3, step = 1, dim = 1,
     plt.close()
 
 def plot_n_clusters_alpha(n_cl, alpha, out_folder, name = 'event'):
+    plt = pyplot()
     
     fig, ax = plt.subplots()
     ax1 = ax.twinx()
-    ax.plot(np.arange(1, len(draws)+1), n_cl, ls = '--', marker = '', lw = 0.7, color = 'k')
-    ax1.plot(np.arange(1, len(draws)+1), alpha, ls = '--', marker = '', lw = 0.7, color = 'r')
+    ax.plot(np.arange(1, len(n_cl)+1), n_cl, ls = '--', marker = '', lw = 0.7, color = 'k')
+    ax1.plot(np.arange(1, len(alpha)+1), alpha, ls = '--', marker = '', lw = 0.7, color = 'r')
     ax.set_xlabel('$t$')
     ax.set_ylabel('$N_{\mathrm{cl}}(t)$', color = 'k')
-    ax1.set_ylabel('$\alpha(t)$', color = 'r')
+    ax1.set_ylabel('$\\alpha(t)$', color = 'r')
     ax.grid()
     fig.savefig(Path(out_folder, name+'_n_cl_alpha.pdf'), bbox_inches = 'tight')
     plt.close()
 
-def compute_entropy_rate_single_draw(mixture, n_draws = 1e3):
-    samples = mixture._sample_from_dpgmm_probit(int(n_draws))
-    logP    = mixture._evaluate_log_mixture_in_probit(samples)
-    entropy = np.sum(-logP)/(n_draws*mixture.n_pts*log2e)
-    return entropy
-
-def compute_entropy_rate(draws, n_draws = 1e3):
-    S = np.zeros(len(draws))
-    for i, d in enumerate(draws):
-        S[i] = compute_entropy_rate_single_draw(d, int(n_draws))
-    return S
+def compute_entropy_rate(draws, n_draws = 1e3, n_parallel = 1, qmc = False, seed = None):
+    return compute_entropy(draws, n_draws, n_parallel = n_parallel, qmc = qmc, seed = seed, rate = True)
 
-def entropy_rate(draws, out_folder, name = 'event', n_draws = 1e3, step = 1, dim = 1):
-    S = compute_entropy(draws, int(n_draws**dim))
+def entropy_rate(draws, out_folder, name = 'event', n_draws = 1e3, step = 1, dim = 1, n_parallel = 1, qmc = False):
+    plt = pyplot()
+    S, dS = compute_entropy_rate(draws, int(n_draws**dim), n_parallel = n_parallel, qmc = qmc)
+    N     = np.arange(1, len(draws)+1)*step
     fig, ax = plt.subplots()
-    ax.plot(np.arange(1, len(draws)+1)*step, S, ls = '--', marker = '', lw = 0.7)
+    ax.plot(N, S, ls = '--', marker = '', lw = 0.7)
+    ax.fill_between(N, S-dS, S+dS, alpha = 0.3, lw = 0)
     ax.set_xlabel('$N$')
     ax.set_ylabel('$R_S(N)\ [\mathrm{bits/sample}]$')
     ax.grid()
-    fig.savefig(Path(out_folder, name+'_entropy.pdf'), bbox_inches = 'tight')
+    fig.savefig(Path(out_folder, name+'_entropy_rate.pdf'), bbox_inches = 'tight')
     plt.close()
 
 def pp_plot(draws, injection, out_folder, name = 'event'):
+    import ligo.skymap.plot # registers the pp_plot projection
+    plt = pyplot()
     median        = np.percentile(draws.T, 50, axis = 1)
     cdf_draws     = np.array([fast_cumulative(d) for d in draws])
     cdf_median    = fast_cumulative(median)
@@ -1,20 +1,231 @@
 import numpy as np
 import os
 import h5py
+import json
 import warnings
-try:
-    from figaro.cosmology import CosmologicalParameters
-except ModuleNotFoundError:
-    warnings.warn("LAL is not installed. GW posterior samples cannot be loaded.")
+import tempfile
+from itertools import islice
+from multiprocessing import Pool
 from pathlib import Path
+from functools import lru_cache
 from scipy.optimize import newton
+from scipy.interpolate import PchipInterpolator
+
+from figaro.cache import config_key
+from figaro.numba_cosmology import get_cosmology
 
 def find_redshift(omega, dl):
     def objective(z, omega, dl):
         return dl - omega.LuminosityDistance_double(z)
     return newton(objective,1.0,args=(omega,dl))
 
-def load_single_event(event, seed = 0, par = ['m1'], n_samples = -1, h = 0.674, om = 0.315, ol = 0.685):
+class RedshiftTable:
+    """
+    Monotone (PCHIP) interpolant of z(D_L) for a given cosmology, built from D_L(z) on a logarithmic grid in redshift.
+    The maximum relative error on z is estimated at the grid midpoints and stored in max_error.
+    
+    Arguments:
+        :CosmologicalParameters omega: cosmology
+        :double z_max:                 maximum redshift
+        :int n_points:                 number of grid points
+    
+    Returns:
+        :RedshiftTable: instance of RedshiftTable class
+    """
+    def __init__(self, omega, z_max = 10., n_points = 2000):
+        self.z_max     = z_max
+        z              = np.concatenate(([0.], np.logspace(-6, np.log10(z_max), int(n_points))))
+        DL             = omega.LuminosityDistance(np.ascontiguousarray(z))
+        self.DL_max    = DL[-1]
+        self.interp    = PchipInterpolator(DL, z, extrapolate = False)
+        self.dz_dDL    = self.interp.derivative()
+        z_mid          = np.sqrt(z[1:-1]*z[2:])
+        DL_mid         = omega.LuminosityDistance(np.ascontiguousarray(z_mid))
+        self.max_error = np.max(np.abs(self.interp(DL_mid) - z_mid)/z_mid)
+    
+    def __call__(self, dl):
+        return self.interp(dl)
+
+@lru_cache(maxsize = 16)
+def redshift_table(h, om, ol, w0 = -1., w1 = 0., z_max = 10.):
+    """
+    D_L-z interpolation table, built once per cosmology and maximum redshift.
+    
+    Arguments:
+        :double h:     Hubble constant H0/100 [km/(s*Mpc)]
+        :double om:    matter density parameter
+        :double ol:    cosmological constant density parameter
+        :double w0:    dark energy equation of state parameter
+        :double w1:    dark energy equation of state parameter (redshift dependence)
+        :double z_max: maximum redshift
+    
+    Returns:
+        :RedshiftTable: interpolation table
+    """
+    return RedshiftTable(get_cosmology(h, om, ol, w0, w1), z_max = z_max)
+
+def find_redshift_array(omega, dl, n_polish = 0):
+    """
+    Redshifts corresponding to an array of luminosity distances (vectorised find_redshift).
+    Redshifts are interpolated from a table cached per cosmology (relative error given by redshift_table(...).max_error, typically below 1e-9) and optionally refined with Newton iterations.
+    
+    Arguments:
+        :CosmologicalParameters omega: cosmology
+        :np.ndarray dl:                luminosity distances [Mpc]
+        :int n_polish:                 number of Newton iterations
+    
+    Returns:
+        :np.ndarray: redshifts
+    """
+    dl    = np.atleast_1d(np.asarray(dl, dtype = np.float64))
+    z_max = 10.
+    table = redshift_table(omega.h, omega.om, omega.ol, omega.w0, omega.w1, z_max)
+    while dl.max() > table.DL_max:
+        z_max = 2*z_max
+        table = redshift_table(omega.h, omega.om, omega.ol, omega.w0, omega.w1, z_max)
+    z = table(dl)
+    for _ in range(n_polish):
+        # dz/dD_L from the interpolant, D_L(z) from the cosmology
+        z = z - (omega.LuminosityDistance(np.ascontiguousarray(z)) - dl)*table.dz_dDL(dl)
+    return z
+
+cache_folder_name = '.figaro_cache'
+
+def _read_txt(event):
+    """
+    Reads a text file with samples (np.loadtxt, falling back to np.genfromtxt for files with missing values).
+    """
+    try:
+        return np.atleast_1d(np.loadtxt(event))
+    except ValueError:
+        return np.atleast_1d(np.genfromtxt(event))
+
+def _downsample(samples, n_samples, rdstate):
+    """
+    Random downsampling without replacement.
+    Indices are drawn as in rdstate.choice(samples, size, replace = False), hence the same state gives the same samples, but multidimensional arrays are supported.
+    """
+    if n_samples > -1:
+        s = int(min([n_samples, len(samples)]))
+        return samples[rdstate.choice(len(samples), size = s, replace = False)]
+    return samples
+
+def _cache_key(event, par, cosmology):
+    """
+    Key of the cached samples for a file: file size and modification time, parameters and cosmology (these two only for GW posteriors).
+    """
+    stat = Path(event).stat()
+    ext  = str(event).split('.')[-1]
+    if ext == 'txt':
+        return config_key(size = stat.st_size, mtime = stat.st_mtime_ns)
+    return config_key(size = stat.st_size, mtime = stat.st_mtime_ns, par = list(par), cosmology = list(cosmology))
+
+def _cache_files(event):
+    folder = Path(Path(event).parent, cache_folder_name)
+    return folder, Path(folder, Path(event).name + '.json'), Path(folder, Path(event).name + '.npy')
+
+def _load_cached(event, par, cosmology, mmap_mode = None):
+    """
+    Loads the cached samples for a file, if the cache entry is up to date.
+
+    Returns:
+        :np.ndarray: samples (None if not available)
+    """
+    _, meta_file, data_file = _cache_files(event)
+    if meta_file.exists() and data_file.exists():
+        try:
+            with open(meta_file, 'r') as f:
+                if json.load(f)['key'] == _cache_key(event, par, cosmology):
+                    return np.load(data_file, mmap_mode = mmap_mode)
+        except (OSError, ValueError, KeyError):
+            pass
+    return None
+
+def _store_cached(event, par, cosmology, write):
+    """
+    Stores a cache entry for a file. The samples are written by write(path) into a temporary .npy file, then moved: concurrent readers never see a partial entry.
+
+    Returns:
+        :bool: True if the entry has been stored
+    """
+    event = Path(event)
+    folder, meta_file, data_file = _cache_files(event)
+    tmp_data = Path(folder, event.name + '.{0}.npy'.format(os.getpid()))
+    tmp_meta = Path(folder, event.name + '.{0}.json'.format(os.getpid()))
+    try:
+        folder.mkdir(exist_ok = True)
+        write(tmp_data)
+        shape = np.load(tmp_data, mmap_mode = 'r').shape
+        with open(tmp_meta, 'w') as f:
+            json.dump({'key': _cache_key(event, par, cosmology), 'file': event.name, 'par': list(par), 'cosmology': list(cosmology), 'shape': list(shape)}, f)
+        os.replace(tmp_data, data_file)
+        os.replace(tmp_meta, meta_file)
+    except OSError:
+        warnings.warn("Cannot write the samples cache in {0}".format(folder))
+        return False
+    finally:
+        # Temporary files left by a failure (any exception): non-OS errors are re-raised
+        for tmp in [tmp_data, tmp_meta]:
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+    return True
+
+def _read_event(args):
+    """
+    Reads all the samples in a file, using the sidecar cache (.figaro_cache folder next to the file) if available.
+    Downsampling is left to the caller, so that cached samples do not depend on it.
+
+    Arguments:
+        :tuple args: file, parameters, cosmology (h, om, ol), use cache
+
+    Returns:
+        :np.ndarray: samples
+    """
+    event, par, cosmology, cache = args
+    event = Path(event)
+    ext   = event.name.split('.')[-1]
+    if ext == 'npy':
+        return np.load(event)
+    if cache:
+        samples = _load_cached(event, par, cosmology)
+        if samples is not None:
+            return samples
+    if ext == 'txt':
+        samples = _read_txt(event)
+    else:
+        samples = unpack_gw_posterior(event, par = par, cosmology = cosmology, rdstate = None, ext = ext)
+    if cache:
+        _store_cached(event, par, cosmology, lambda path: np.save(path, samples))
+    return samples
+
+def _read_event_rows(args):
+    """
+    Reads some rows of a HDF5 GW posterior file.
+
+    Arguments:
+        :tuple args: file, parameters, cosmology (h, om, ol), rows
+
+    Returns:
+        :np.ndarray: samples
+    """
+    event, par, cosmology, idx = args
+    return unpack_gw_posterior(event, par = par, cosmology = cosmology, rdstate = None, ext = str(event).split('.')[-1], idx = idx)
+
+def _imap(func, tasks, n_parallel):
+    """
+    Applies func to the tasks (in order), on a pool of processes if n_parallel > 1.
+    """
+    if n_parallel == 1 or len(tasks) < 2:
+        for task in tasks:
+            yield func(task)
+    else:
+        with Pool(min(n_parallel, len(tasks))) as pool:
+            for res in pool.imap(func, tasks):
+                yield res
+
+def load_single_event(event, seed = 0, par = ['m1'], n_samples = -1, h = 0.674, om = 0.315, ol = 0.685, cache = True, rdstate = None):
     '''
     Loads the data from .txt files (for simulations) or .h5/.hdf5 files (posteriors from GWTC) for a single event.
     Default cosmological parameters from Planck Collaboration (2021) in a flat Universe (https://www.aanda.org/articles/aa/pdf/2020/09/aa33910-18.pdf)
@@ -27,40 +238,46 @@ def load_single_event(event, seed = 0, par = ['m1'], n_samples = -1, h = 0.674,
         :double h:      Hubble constant H0/100 [km/(s*Mpc)]
         :double om:     matter density parameter
         :double ol:     cosmological constant density parameter
+        :bool cache:    store the parsed samples in a binary cache (.figaro_cache folder next to the file)
+        :np.random.RandomState rdstate: random state used for downsampling (overrides seed)
     
     Returns:
         :np.ndarray:    samples
         :np.ndarray:    name
     '''
-    if not seed == 0:
+    if rdstate is None and not seed == 0:
         rdstate = np.random.RandomState(seed = 1)
-    else:
+    elif rdstate is None:
         rdstate = np.random.RandomState()
     name, ext = str(event).split('/')[-1].split('.')
-    if ext == 'txt':
-        if n_samples > -1:
-            samples = np.genfromtxt(event)
-            s = int(min([n_samples, len(samples)]))
-            out = rdstate.choice(samples, size = s, replace = False)
-        else:
-            out = np.genfromtxt(event)
-    else:
-        out = unpack_gw_posterior(event, par = par, n_samples = n_samples, cosmology = (h, om, ol), rdstate = rdstate, ext = ext)
-    return out, name
+    samples   = _load_cached(event, par, (h, om, ol)) if cache else None
+    if samples is None and n_samples > -1 and _is_hdf5(event):
+        # Only the selected rows are read
+        n   = count_samples(event)
+        idx = rdstate.choice(n, size = int(min([n_samples, n])), replace = False)
+        return _read_event_rows((event, par, (h, om, ol), idx)), name
+    if samples is None:
+        samples = _read_event((event, par, (h, om, ol), cache))
+    return _downsample(samples, n_samples, rdstate), name
 
-def load_data(path, seed = 0, par = ['m1'], n_samples = -1, h = 0.674, om = 0.315, ol = 0.685):
+def load_data(path, seed = 0, par = ['m1'], n_samples = -1, h = 0.674, om = 0.315, ol = 0.685, n_parallel = 1, cache = True):
     '''
     Loads the data from .txt files (for simulations) or .h5/.hdf5 files (posteriors from GWTC).
+    Files are parsed in parallel and the parsed samples are stored in a binary cache (.figaro_cache folder in path), so that following calls skip parsing.
+    When downsampling, only the selected rows of HDF5 files that are not cached are read.
+    Downsampling indices are drawn file by file in the same order: the output does not depend on n_parallel or on the cache.
     Default cosmological parameters from Planck Collaboration (2021) in a flat Universe (https://www.aanda.org/articles/aa/pdf/2020/09/aa33910-18.pdf)
     
     Arguments:
-        :str path:      folder with data files
-        :bool seed:     fixes the seed to a default value (1) for reproducibility
-        :str par:       parameter to extract from GW posteriors (m1, m2, mc, z, chi_effective)
-        :int n_samples: number of samples for (random) downsampling. Default -1: all samples
-        :double h:      Hubble constant H0/100 [km/(s*Mpc)]
-        :double om:     matter density parameter
-        :double ol:     cosmological constant density parameter
+        :str path:       folder with data files
+        :bool seed:      fixes the seed to a default value (1) for reproducibility
+        :str par:        parameter to extract from GW posteriors (m1, m2, mc, z, chi_effective)
+        :int n_samples:  number of samples for (random) downsampling. Default -1: all samples
+        :double h:       Hubble constant H0/100 [km/(s*Mpc)]
+        :double om:      matter density parameter
+        :double ol:      cosmological constant density parameter
+        :int n_parallel: number of processes reading the files
+        :bool cache:     use the binary samples cache
     
     Returns:
         :np.ndarray:    samples
@@ -72,137 +289,359 @@ def load_data(path, seed = 0, par = ['m1'], n_samples = -1, h = 0.674, om = 0.31
         rdstate = np.random.RandomState()
         
     event_files = [Path(path,f) for f in os.listdir(path) if not (f.startswith('.') or f.startswith('empty_files'))]
-    events      = []
-    names       = []
+    names       = [str(event).split('/')[-1].split('.')[0] for event in event_files]
+    cosmology   = (h, om, ol)
     n_events    = len(event_files)
+    events      = [None for _ in event_files]
+    n_rows      = [None for _ in event_files]
+    to_parse    = []
     
+    # Cached samples are read here. When downsampling, HDF5 files are read afterwards (selected rows only), the others are parsed by the pool
     for i, event in enumerate(event_files):
-        print('\r{0}/{1} event(s)'.format(i+1, n_events), end = '')
-        name, ext = str(event).split('/')[-1].split('.')
-        names.append(name)
-
-        
-        if ext == 'txt':
-            if n_samples > -1:
-                samples = np.atleast_1d(np.genfromtxt(event))
-                s = int(min([n_samples, len(samples)]))
-                events.append(rdstate.choice(samples, size = s, replace = False))
-                    
+        if cache:
+            events[i] = _load_cached(event, par, cosmology)
+        if events[i] is None:
+            if n_samples > -1 and _is_hdf5(event):
+                n_rows[i] = count_samples(event)
             else:
-                samples = np.atleast_1d(np.genfromtxt(event))
-                events.append(samples)
-                
+                to_parse.append(i)
+    n_done = n_events - len(to_parse) - sum([n is not None for n in n_rows])
+    for i, samples in zip(to_parse, _imap(_read_event, [(event_files[i], par, cosmology, cache) for i in to_parse], n_parallel)):
+        events[i] = samples
+        n_done   += 1
+        print('\r{0}/{1} event(s)'.format(n_done, n_events), end = '')
+    
+    # Downsampling indices are drawn file by file in the same order, whatever the reading strategy
+    to_read = []
+    for i in range(n_events):
+        if n_rows[i] is not None:
+            idx = rdstate.choice(n_rows[i], size = int(min([n_samples, n_rows[i]])), replace = False)
+            to_read.append((i, idx))
         else:
-            events.append(unpack_gw_posterior(event, par = par, n_samples = n_samples, cosmology = (h, om, ol), rdstate = rdstate, ext = ext))
+            events[i] = _downsample(events[i], n_samples, rdstate)
+    for (i, _), samples in zip(to_read, _imap(_read_event_rows, [(event_files[i], par, cosmology, idx) for i, idx in to_read], n_parallel)):
+        events[i] = samples
+        n_done   += 1
+        print('\r{0}/{1} event(s)'.format(n_done, n_events), end = '')
 
     return (events, np.array(names))
 
-def unpack_gw_posterior(event, par, cosmology, rdstate, ext, n_samples = -1):
+def _is_data_line(line):
+    line = line.strip()
+    return len(line) > 0 and not line.startswith('#')
+
+def _txt_to_npy(event, path, chunk_size = 100000):
+    """
+    Converts a text file with samples into a .npy file, parsing chunk_size rows at a time: the file is never loaded in memory as a whole.
+    The array has the same shape as the one returned by _read_txt (one-dimensional for single-column files).
+
+    Arguments:
+        :str event:      text file
+        :str path:       .npy file
+        :int chunk_size: number of rows parsed at a time
+    """
+    n_rows = 0
+    n_cols = None
+    with open(event, 'r') as f:
+        for line in f:
+            if _is_data_line(line):
+                if n_cols is None:
+                    n_cols = len(line.split())
+                n_rows += 1
+    shape = (n_rows,) if n_cols == 1 else (n_rows, n_cols)
+    out   = np.lib.format.open_memmap(path, mode = 'w+', dtype = np.float64, shape = shape)
+    with open(event, 'r') as f:
+        lines = (line for line in f if _is_data_line(line))
+        i     = 0
+        while i < n_rows:
+            block = list(islice(lines, chunk_size))
+            try:
+                rows = np.loadtxt(block)
+            except ValueError:
+                rows = np.genfromtxt(block)
+            out[i:i+len(block)] = np.reshape(rows, (len(block),) + shape[1:])
+            i += len(block)
+    out.flush()
+    del out
+
+def memmap_samples(event, par = ['m1'], h = 0.674, om = 0.315, ol = 0.685, cache = True, chunk_size = 100000):
+    """
+    Samples of a file as a read-only memory-mapped array.
+    .npy files are mapped directly. Text files are converted chunk by chunk into the binary samples cache (.figaro_cache folder next to the file, shared with load_single_event and load_data) and mapped from there.
+    GW posteriors are read as in load_single_event and cached.
+    
+    Arguments:
+        :str event:      file with samples
+        :str par:        parameter to extract from GW posteriors (m1, m2, mc, z, chi_effective)
+        :double h:       Hubble constant H0/100 [km/(s*Mpc)]
+        :double om:      matter density parameter
+        :double ol:      cosmological constant density parameter
+        :bool cache:     use the binary samples cache. If False (or if the cache cannot be written), text files are converted into a temporary file
+        :int chunk_size: number of rows parsed at a time (text files)
+    
+    Returns:
+        :np.memmap: samples
+    """
+    event     = Path(event)
+    ext       = event.name.split('.')[-1]
+    cosmology = (h, om, ol)
+    if ext == 'npy':
+        return np.load(event, mmap_mode = 'r')
+    if cache:
+        samples = _load_cached(event, par, cosmology, mmap_mode = 'r')
+        if samples is not None:
+            return samples
+    if ext != 'txt':
+        samples = _read_event((event, par, cosmology, cache))
+        if cache:
+            cached = _load_cached(event, par, cosmology, mmap_mode = 'r')
+            if cached is not None:
+                return cached
+        return samples
+    if cache and _store_cached(event, par, cosmology, lambda path: _txt_to_npy(event, path, chunk_size)):
+        return _load_cached(event, par, cosmology, mmap_mode = 'r')
+    fd, path = tempfile.mkstemp(suffix = '.npy')
+    os.close(fd)
+    try:
+        _txt_to_npy(event, path, chunk_size)
+        samples = np.load(path, mmap_mode = 'r')
+    finally:
+        try:
+            # The mapping outlives the file name (POSIX)
+            os.remove(path)
+        except OSError:
+            pass
+    return samples
+
+class SampleStream:
+    """
+    Iterable over shuffled chunks of the samples stored in a (possibly very large) file, to feed a DPGMM batch by batch:
+    
+        for chunk in stream:
+            mix.density_from_samples(chunk)
+    
+    Samples are memory-mapped (see memmap_samples). Every pass over the stream draws a new random permutation of the rows and yields it chunk by chunk: the rows of each chunk are read in increasing order and returned in the permuted order, hence the full array is never loaded nor shuffled in memory.
+    When downsampling, the subset of rows is drawn once, as in load_single_event, and permuted at every pass.
+    
+    Arguments:
+        :str event:      file with samples (.npy, .txt or GW posterior)
+        :int chunk_size: number of samples per chunk
+        :bool seed:      fixes the seed to a default value (1) for reproducibility
+        :str par:        parameter to extract from GW posteriors (m1, m2, mc, z, chi_effective)
+        :int n_samples:  number of samples for (random) downsampling. Default -1: all samples
+        :double h:       Hubble constant H0/100 [km/(s*Mpc)]
+        :double om:      matter density parameter
+        :double ol:      cosmological constant density parameter
+        :bool cache:     use the binary samples cache
+        :np.random.RandomState rdstate: random state used for downsampling and permutations (overrides seed)
+    
+    Returns:
+        :SampleStream: instance of SampleStream class
+    """
+    def __init__(self, event, chunk_size = 10000, seed = 0, par = ['m1'], n_samples = -1, h = 0.674, om = 0.315, ol = 0.685, cache = True, rdstate = None):
+        if rdstate is not None:
+            self.rdstate = rdstate
+        elif not seed == 0:
+            self.rdstate = np.random.RandomState(seed = 1)
+        else:
+            self.rdstate = np.random.RandomState()
+        self.name       = str(event).split('/')[-1].split('.')[0]
+        self.chunk_size = int(chunk_size)
+        self.data       = memmap_samples(event, par = par, h = h, om = om, ol = ol, cache = cache)
+        self.dim        = self.data.shape[-1] if self.data.ndim > 1 else 1
+        self.rows       = None
+        if n_samples > -1:
+            self.rows = self.rdstate.choice(len(self.data), size = int(min([n_samples, len(self.data)])), replace = False)
+    
+    def __len__(self):
+        if self.rows is not None:
+            return len(self.rows)
+        return len(self.data)
+    
+    def _read(self, idx):
+        """
+        Rows of the memory-mapped samples, read in increasing order and returned in the order of idx.
+        """
+        order        = np.argsort(idx)
+        chunk        = np.empty((len(idx),) + self.data.shape[1:], dtype = self.data.dtype)
+        chunk[order] = self.data[idx[order]]
+        return chunk
+    
+    def __iter__(self):
+        if self.rows is not None:
+            perm = self.rows[self.rdstate.permutation(len(self.rows))]
+        else:
+            perm = self.rdstate.permutation(len(self.data))
+        for i in range(0, len(perm), self.chunk_size):
+            yield self._read(perm[i:i+self.chunk_size])
+    
+    def subsample(self, n_samples):
+        """
+        Random subset of the samples (e.g. for plotting).
+        
+        Arguments:
+            :int n_samples: number of samples
+        
+        Returns:
+            :np.ndarray: samples
+        """
+        if self.rows is not None:
+            idx = self.rows[self.rdstate.choice(len(self.rows), size = int(min([n_samples, len(self.rows)])), replace = False)]
+        else:
+            idx = self.rdstate.choice(len(self.data), size = int(min([n_samples, len(self.data)])), replace = False)
+        return self._read(idx)
+
+# Columns of the GWTC (PublicationSamples) posteriors, in the order in which they are stacked
+gwtc_columns = {'m1':                  'mass_1_source',
+                'm2':                  'mass_2_source',
+                'mc':                  'chirp_mass',
+                'z':                   'redshift',
+                'chi_eff':             'chi_eff',
+                'ra':                  'ra',
+                'dec':                 'dec',
+                'luminosity_distance': 'luminosity_distance',
+                }
+
+def _is_hdf5(event):
+    return str(event).split('.')[-1] in ['h5', 'hdf5']
+
+def _posterior_dataset(f):
+    """
+    Posterior samples in a HDF5 file: PublicationSamples (GWTC) or Overall_posterior (O1/O2) layout.
+    """
+    if 'PublicationSamples' in f:
+        return f['PublicationSamples']['posterior_samples']
+    return f['Overall_posterior']
+
+def _n_rows(data):
+    if isinstance(data, h5py.Group):
+        return len(data[list(data.keys())[0]])
+    return data.shape[0]
+
+def count_samples(event):
+    """
+    Number of samples in a HDF5 GW posterior file, without reading them.
+    
+    Arguments:
+        :str event: file
+    
+    Returns:
+        :int: number of samples
+    """
+    with h5py.File(Path(event), 'r') as f:
+        return _n_rows(_posterior_dataset(f))
+
+def _read_columns(data, names, idx = None):
+    """
+    Reads some columns (fields of a compound dataset or datasets of a group) of a HDF5 posterior, optionally only some rows.
+    Rows are read in increasing order (as required by h5py) and returned in the order of idx. If more than a tenth of the rows is requested, columns are read completely and indexed in memory, which is faster than a point selection.
+    
+    Arguments:
+        :h5py.Dataset or h5py.Group data: posterior samples
+        :list names:                      columns
+        :np.ndarray idx:                  rows. Default: all
+    
+    Returns:
+        :dict: columns
+    """
+    sparse = idx is not None and len(idx) <= 0.1*_n_rows(data)
+    rows   = ()
+    if sparse:
+        idx   = np.asarray(idx)
+        order = np.argsort(idx)
+        rows  = idx[order]
+    if isinstance(data, h5py.Group):
+        cols = {name: np.asarray(data[name][rows]) for name in names}
+    else:
+        rec  = data.fields(names)[rows]
+        cols = {name: np.asarray(rec[name]) for name in names}
+    if sparse:
+        inverse        = np.empty_like(order)
+        inverse[order] = np.arange(len(order))
+        cols = {name: c[inverse] for name, c in cols.items()}
+    elif idx is not None:
+        cols = {name: c[idx] for name, c in cols.items()}
+    return cols
+
+def unpack_gw_posterior(event, par, cosmology, rdstate, ext, n_samples = -1, idx = None):
     '''
     Reads data from .h5/.hdf5 GW posterior files.
     Implemented 'm1', 'm2', 'mc', 'z', 'chi_eff'.
+    Only the columns needed for the requested parameters are read. When downsampling, rows are drawn first and only those are read (HDF5) and used to compute derived quantities.
     
     Arguments:
         :str event:       file to read
         :str par:         parameter to extract
         :tuple cosmology: cosmological parameters (h, om, ol)
         :int n_samples:   number of samples for (random) downsampling. Default -1: all samples
+        :np.ndarray idx:  rows to read (overrides n_samples). Default: all
     
     Returns:
         :np.ndarray:    samples
     '''
     h, om, ol = cosmology
-    omega = CosmologicalParameters(h, om, ol, -1, 0)
+    need_z    = any([p in par for p in ['z', 'm1', 'm2', 'mc', 'chi_eff']])
+    need_m    = any([p in par for p in ['m1', 'm2', 'mc', 'chi_eff']])
+    samples   = []
     if ext == 'h5' or ext == 'hdf5':
         with h5py.File(Path(event), 'r') as f:
-            samples = []
-            try:
-                data = f['PublicationSamples']['posterior_samples']
-                if 'm1' in par:
-                    samples.append(data['mass_1_source'])
-                if 'm2' in par:
-                    samples.append(data['mass_2_source'])
-                if 'mc' in par:
-                    samples.append(data['chirp_mass'])
-                if 'z' in par:
-                    samples.append(data['redshift'])
+            data = _posterior_dataset(f)
+            if idx is None and n_samples > -1:
+                n   = _n_rows(data)
+                idx = rdstate.choice(n, size = int(min([n_samples, n])), replace = False)
+            if 'PublicationSamples' in f:
+                names = [gwtc_columns[p] for p in gwtc_columns.keys() if p in par]
+                cols  = _read_columns(data, names, idx)
+                samples = [cols[name] for name in names]
+            else:
+                names = []
+                if need_z or 'luminosity_distance' in par:
+                    names.append('luminosity_distance_Mpc')
+                if need_m:
+                    names += ['m1_detector_frame_Msun', 'm2_detector_frame_Msun']
                 if 'chi_eff' in par:
-                    samples.append(data['chi_eff'])
+                    names += ['spin1', 'spin2', 'costilt1', 'costilt2']
                 if 'ra' in par:
-                    samples.append(data['ra'])
+                    names.append('right_ascension')
                 if 'dec' in par:
-                    samples.append(data['dec'])
-                if 'luminosity_distance' in par:
-                    samples.append(data['luminosity_distance'])
-                
-                if len(par) == 1:
-                    samples = np.array(samples)
-                    samples = samples.flatten()
-                else:
-                    samples = np.array(samples).T
-
-                if n_samples > -1:
-                    s = int(min([n_samples, len(samples)]))
-                    return rdstate.choice(samples, size = s, replace = False)
-                else:
-                    return samples
-            except:
-                data = f['Overall_posterior']
-                ra        = data['right_ascension']
-                dec       = data['declination']
-                LD        = data['luminosity_distance_Mpc']
-                z         = np.array([find_redshift(omega, l) for l in LD])
-                m1_detect = data['m1_detector_frame_Msun']
-                m2_detect = data['m2_detector_frame_Msun']
-                m1        = m1_detect/(1+z)
-                m2        = m2_detect/(1+z)
+                    names.append('declination')
+                cols = _read_columns(data, names, idx)
+                if need_z:
+                    omega = get_cosmology(h, om, ol, -1, 0)
+                    z     = find_redshift_array(omega, cols['luminosity_distance_Mpc'])
+                if need_m:
+                    m1 = cols['m1_detector_frame_Msun']/(1+z)
+                    m2 = cols['m2_detector_frame_Msun']/(1+z)
                 
                 if 'z' in par:
                     samples.append(z)
                 if 'm1' in par:
-                     samples.append(m1)
+                    samples.append(m1)
                 if 'm2' in par:
                     samples.append(m2)
                 if 'mc' in par:
                     samples.append((m1*m2)**(3./5.)/(m1+m2)**(1./5.))
                 if 'chi_eff' in par:
-                    s1   = data['spin1']
-                    s2   = data['spin2']
-                    cos1 = data['costilt1']
-                    cos2 = data['costilt2']
-                    q    = m2/m1
-                    samples.append((s1*cos1 + q*s2*cos2)/(1+q))
+                    q = m2/m1
+                    samples.append((cols['spin1']*cols['costilt1'] + q*cols['spin2']*cols['costilt2'])/(1+q))
                 if 'ra' in par:
-                    samples.append(ra)
+                    samples.append(cols['right_ascension'])
                 if 'dec' in par:
-                    samples.append(dec)
+                    samples.append(cols['declination'])
                 if 'luminosity_distance' in par:
-                    samples.append(LD)
-                
-                if len(par) == 1:
-                    samples = np.array(samples)
-                    samples = samples.flatten()
-                else:
-                    samples = np.array(samples).T
-
-                if n_samples > -1:
-                    s = int(min([n_samples, len(samples)]))
-                    return rdstate.choice(samples, size = s, replace = False)
-                else:
-                    return samples
+                    samples.append(cols['luminosity_distance_Mpc'])
     else:
         data = np.genfromtxt(Path(event), names = True)
+        if idx is None and n_samples > -1:
+            idx = rdstate.choice(len(data), size = int(min([n_samples, len(data)])), replace = False)
+        if idx is not None:
+            data = data[idx]
         
-        samples = []
-        
-        ra        = data['ra']
-        dec       = data['dec']
-        LD        = data['luminosity_distance']
-        z         = np.array([find_redshift(omega, l) for l in LD])
-        m1_detect = data['mass_1']
-        m2_detect = data['mass_2']
-        m1        = m1_detect/(1+z)
-        m2        = m2_detect/(1+z)
+        if need_z:
+            omega = get_cosmology(h, om, ol, -1, 0)
+            z     = find_redshift_array(omega, data['luminosity_distance'])
+            m1    = data['mass_1']/(1+z)
+            m2    = data['mass_2']/(1+z)
         
         if 'z' in par:
             samples.append(z)
@@ -213,20 +652,15 @@ def unpack_gw_posterior(event, par, cosmology, rdstate, ext, n_samples = -1):
         if 'mc' in par:
             samples.append((m1*m2)**(3./5.)/(m1+m2)**(1./5.))
         if 'ra' in par:
-            samples.append(ra)
+            samples.append(data['ra'])
         if 'dec' in par:
-            samples.append(dec)
+            samples.append(data['dec'])
         if 'luminosity_distance' in par:
-            samples.append(LD)
-        
-        if len(par) == 1:
-            samples = np.array(samples)
-            samples = samples.flatten()
-        else:
-            samples = np.array(samples).T
-        
-        if n_samples > -1:
-            s = int(min([n_samples, len(samples)]))
-            return rdstate.choice(samples, size = s, replace = False)
-        else:
-            return samples
+            samples.append(data['luminosity_distance'])
+    
+    if len(par) == 1:
+        samples = np.array(samples)
+        samples = samples.flatten()
+    else:
+        samples = np.array(samples).T
+    return samples
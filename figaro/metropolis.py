@@ -1,25 +1,15 @@
 import numpy as np
+import math
 from numba import jit, njit, prange
-from numba.extending import get_cython_function_address
-import ctypes
-from scipy.stats import invgamma, invwishart
 from scipy.special import logsumexp
 
 LOGSQRT2 = np.log(2*np.pi)
 
-_PTR = ctypes.POINTER
-_dble = ctypes.c_double
-_ptr_dble = _PTR(_dble)
-
-addr = get_cython_function_address("scipy.special.cython_special", "gammaln")
-functype = ctypes.CFUNCTYPE(_dble, _dble)
-gammaln_float64 = functype(addr)
-
 #-----------#
 # Functions #
 #-----------#
 
-@jit
+@jit(cache = True)
 def log_add(x, y):
     """
     Compute log(np.exp(x) + np.exp(y))
@@ -36,7 +26,7 @@ def log_add(x, y):
     else:
         return y+np.log1p(np.exp(x-y))
 
-@jit
+@jit(cache = True)
 def log_add_array(x,y):
     """
     Compute log(np.exp(x) + np.exp(y)) element-wise
@@ -53,11 +43,11 @@ def log_add_array(x,y):
         res[i] = log_add(x[i],y[i])
     return res
     
-@njit
+@njit(cache = True)
 def numba_gammaln(x):
-    return gammaln_float64(x)
+    return math.lgamma(x)
 
-@jit
+@jit(cache = True)
 def log_invgamma(var, a, b):
     """
     Inverse Gamma logpdf
@@ -72,7 +62,7 @@ def log_invgamma(var, a, b):
     """
     return a*np.log(b) - (a+1)*np.log(var**2) - b/var**2 - numba_gammaln(a)
 
-@jit
+@jit(cache = True)
 def log_norm_1d(x, m, s):
     """
     1D Normal logpdf
@@ -87,15 +77,15 @@ def log_norm_1d(x, m, s):
     """
     return -(x-m)**2/(2*s) - 0.5*np.log(2*np.pi) - 0.5*np.log(s)
 
-@njit
+@njit(cache = True)
 def inv_jit(M):
   return np.linalg.inv(M)
 
-@njit
+@njit(cache = True)
 def logdet_jit(M):
     return np.log(np.linalg.det(M))
 
-@njit
+@njit(cache = True)
 def triple_product(v, M, n):
     """
     Triple product: v*M*v^T
@@ -114,7 +104,7 @@ def triple_product(v, M, n):
             res = res + M[i,j]*v[i]*v[j]
     return res
 
-@jit
+@jit(cache = True)
 def log_norm(x, mu, cov):
     """
     Multivariate Normal logpdf
@@ -132,7 +122,7 @@ def log_norm(x, mu, cov):
     lognorm  = LOGSQRT2-0.5*logdet_jit(inv_cov)
     return -lognorm+exponent
 
-@jit
+@jit(cache = True)
 def log_norm_array(x, mu, cov):
     """
     Multivariate Normal logpdf element-wise wrt mu and cov
@@ -174,7 +164,7 @@ def build_mean_cov(x, dim):
 # 1D methods #
 #------------#
 
-@jit
+@jit(cache = True)
 def propose_point_1d(old_point, dm, ds):
     """
     Propose a new point uniformly drawn in an interval [x-dx, x+dx]
@@ -241,7 +231,7 @@ def log_integrand_1d(mu, sigma, means, covs, log_w, a, b):
         logP += log_prob_mixture_1d(mu, sigma, log_w[i], means[i], covs[i])
     return logP + log_invgamma(sigma, a, b)
 
-@jit
+@jit(cache = True)
 def log_prob_mixture_1d(mu, sigma, log_w, means, covs):
     """
     Single term of productory in Eq. (46) - Single event.
@@ -277,6 +267,7 @@ def MC_predictive_1d(events, n_samps = 1000, m_min = -7, m_max = 7, a = 2, b = 0
         :double: MC estimate of integral
     """
     means = np.random.uniform(m_min, m_max, size = n_samps)
+    from scipy.stats import invgamma
     variances = np.sqrt(invgamma(a, b).rvs(size = n_samps))
     logP = np.zeros(n_samps, dtype = np.float64)
     for ev in events:
@@ -284,7 +275,7 @@ def MC_predictive_1d(events, n_samps = 1000, m_min = -7, m_max = 7, a = 2, b = 0
     logP = logsumexp(logP)
     return logP - np.log(n_samps)
 
-@jit
+@jit(cache = True)
 def log_prob_mixture_1d_MC(mu, sigma, log_w, means, covs):
     """
     Log probability for a single event - 1D
@@ -308,7 +299,7 @@ def log_prob_mixture_1d_MC(mu, sigma, log_w, means, covs):
 # ND methods #
 #------------#
 
-@jit
+@jit(cache = True)
 def propose_point(old_point, dm, ds, dr, dim):
     """
     Propose a new point uniformly drawn in an interval [x-dx, x+dx]
@@ -352,6 +343,7 @@ def sample_point(means, covs, log_w, dim, burnin = 1000, dm = 1, ds = 0.05, dr =
         cov = np.identity(dim)*b
     else:
         cov = b
+    from scipy.stats import invwishart
     prior = invwishart(a, cov)
     old_point = np.concatenate((mu, [cov[i,i] for i in range(dim)], np.zeros(int(dim*(dim-1)/2.))))
     log_old = log_integrand(mu, cov, means, covs, log_w) + prior.logpdf(cov)
@@ -385,7 +377,7 @@ def log_integrand(mu, sigma, means, covs, log_w):
         logP += log_prob_mixture(mu, sigma, means[i], covs[i], log_w[i])
     return logP
 
-@jit
+@jit(cache = True)
 def log_prob_mixture(mu, cov, means, sigmas, log_w):
     """
     Single term of productory in Eq. (46) - Single event, multidimensional.
@@ -424,6 +416,7 @@ def MC_predictive(events, dim, n_samps = 1000, m_min = -7, m_max = 7, a = 2, b =
     means = np.random.uniform(m_min, m_max, size = (n_samps, dim))
     if len(b) == 1:
         b = np.identity(dim)*b
+    from scipy.stats import invwishart
     variances = np.array(invwishart(a, b).rvs(size = n_samps))
     logP = np.zeros(n_samps, dtype = np.float64)
     for ev in events:
@@ -431,7 +424,7 @@ def MC_predictive(events, dim, n_samps = 1000, m_min = -7, m_max = 7, a = 2, b =
     logP = logsumexp(logP)
     return logP - np.log(n_samps)
 
-@jit
+@jit(cache = True)
 def log_prob_mixture_MC(mu, cov, log_w, means, covs):
     """
     Log probability for a single event - multidimensional
@@ -1,46 +1,27 @@
 import numpy as np
-import sys
+import math
 import dill
 
 from collections import Counter
+from contextlib import nullcontext
 from pathlib import Path
-
-from scipy.special import gammaln, logsumexp
-from scipy.stats import multivariate_normal as mn
-from scipy.stats import invwishart
+from time import perf_counter
 
 from figaro.decorators import *
 from figaro.transform import *
 from figaro.metropolis import sample_point, sample_point_1d, MC_predictive_1d, MC_predictive
-from figaro.exceptions import except_hook
 
 from numba import jit, njit, prange
-from numba.extending import get_cython_function_address
-import ctypes
-
-#-----------#
-# Utilities #
-#-----------#
-
-sys.excepthook = except_hook
-
-_PTR = ctypes.POINTER
-_dble = ctypes.c_double
-_ptr_dble = _PTR(_dble)
-
-addr = get_cython_function_address("scipy.special.cython_special", "gammaln")
-functype = ctypes.CFUNCTYPE(_dble, _dble)
-gammaln_float64 = functype(addr)
 
 #-----------#
 # Functions #
 #-----------#
 
-@njit
+@njit(cache = True)
 def numba_gammaln(x):
-    return gammaln_float64(x)
+    return math.lgamma(x)
 
-@jit
+@jit(cache = True)
 def student_t(df, t, mu, sigma, dim):
     """
     Multivariate student-t pdf.
@@ -72,7 +53,7 @@ def student_t(df, t, mu, sigma, dim):
 
     return (A - B - C - D + E)[0]
 
-@jit
+@jit(cache = True)
 def update_alpha(alpha, n, K, burnin = 1000):
     """
     Update concentration parameter using a Metropolis-Hastings sampling scheme.
@@ -96,7 +77,7 @@ def update_alpha(alpha, n, K, burnin = 1000):
                 a_old = a_new
     return a_old
 
-@jit
+@jit(cache = True)
 def compute_t_pars(k, mu, nu, L, mean, S, N, dim):
     """
     Compute parameters for student-t distribution.
@@ -123,7 +104,7 @@ def compute_t_pars(k, mu, nu, L, mean, S, N, dim):
     t_shape = L_n*(k_n+1)/(k_n*t_df)
     return t_df, t_shape, mu_n
 
-@jit
+@jit(cache = True)
 def compute_hyperpars(k, mu, nu, L, mean, S, N):
     """
     Update hyperparameters for Normal Inverse Gamma/Wishart (NIG/NIW).
@@ -150,7 +131,7 @@ def compute_hyperpars(k, mu, nu, L, mean, S, N):
     L_n  = L*k + S*N + k*N*((mean - mu).T@(mean - mu))/k_n
     return k_n, mu_n, nu_n, L_n
 
-@jit
+@jit(cache = True)
 def compute_component_suffstats(x, mean, cov, N, p_mu, p_k, p_nu, p_L):
     """
     Update mean, covariance, number of samples and maximum a posteriori for mean and covariance.
@@ -200,6 +181,69 @@ def build_mean_cov(x, dim):
     cov_mat = np.multiply(corr, np.outer(sigma, sigma))
     return mean, cov_mat
 
+@njit(cache = True, nogil = True)
+def _gaussian_mixture(x, means, inv_L, log_c, zero, log_output, out):
+    """
+    Log (or linear) density of a gaussian mixture at each point.
+    Mahalanobis distances and exponentials are computed in the precision of the inputs (float32 or float64), sums over components in double precision.
+    """
+    n_cl = len(means)
+    dim  = x.shape[1]
+    logp = np.empty(n_cl, dtype = x.dtype)
+    for i in range(len(x)):
+        m = -np.inf
+        for j in range(n_cl):
+            s = zero
+            for a in range(dim):
+                v = zero
+                for b in range(a+1):
+                    v += inv_L[j,a,b]*(x[i,b] - means[j,b])
+                s += v*v
+            logp[j] = log_c[j] - 0.5*s
+            if logp[j] > m:
+                m = logp[j]
+        if log_output:
+            if m > -np.inf:
+                t = 0.
+                for j in range(n_cl):
+                    t += math.exp(logp[j] - m)
+                m += math.log(t)
+            out[i] = m
+        else:
+            t = 0.
+            for j in range(n_cl):
+                t += math.exp(logp[j])
+            out[i] = t
+
+def evaluate_gaussian_mixture(x, means, covs, log_w, dtype = np.float64, log = False):
+    """
+    Evaluates a gaussian mixture (or its logarithm) in a single compiled pass over the points, without per-component temporaries.
+    
+    Arguments:
+        :np.ndarray x:     point(s), shape (n, dim) or (dim,)
+        :np.ndarray means: component means, shape (n_cl, dim)
+        :np.ndarray covs:  component covariances, shape (n_cl, dim, dim)
+        :np.ndarray log_w: component log weights
+        :type dtype:       precision of the evaluation and of the output (np.float64 or np.float32). Sums over components are accumulated in double precision
+        :bool log:         return the log density
+    
+    Returns:
+        :np.ndarray: (log) density. A float for a single point, as scipy.stats.multivariate_normal
+    """
+    log_w = np.atleast_1d(np.asarray(log_w, dtype = np.float64))
+    n_cl  = len(log_w)
+    means = np.asarray(means, dtype = np.float64).reshape(n_cl, -1)
+    dim   = means.shape[1]
+    L     = np.linalg.cholesky(np.asarray(covs, dtype = np.float64).reshape(n_cl, dim, dim))
+    inv_L = np.linalg.inv(L)
+    log_c = log_w - 0.5*dim*log2PI - np.log(np.diagonal(L, axis1 = 1, axis2 = 2)).sum(axis = -1)
+    x     = np.ascontiguousarray(x, dtype = dtype).reshape(-1, dim)
+    out   = np.empty(len(x), dtype = dtype)
+    _gaussian_mixture(x, means.astype(dtype), inv_L.astype(dtype), log_c, dtype(0), log, out)
+    if len(out) == 1:
+        return out[0]
+    return out
+
 #-------------------#
 # Auxiliary classes #
 #-------------------#
@@ -284,15 +328,20 @@ class mixture:
         :int n_cl:          number of clusters in the mixture
         :int n_draws:       number of MC draws for normalisation constant estimate
         :bool hier_flag:    flag for hierarchical mixture (needed to fix an issue with means)
+        :type dtype:        precision of the evaluations (np.float64 or np.float32)
     
     Returns:
         :mixture: instance of mixture class
     """
-    def __init__(self, means, covs, w, bounds, dim, n_cl, n_pts, n_draws = 1000, hier_flag = False):
+    # Default for mixtures saved before the dtype option
+    dtype = np.float64
+    
+    def __init__(self, means, covs, w, bounds, dim, n_cl, n_pts, n_draws = 1000, hier_flag = False, dtype = np.float64):
         if dim > 1 and hier_flag:
             self.means = np.array([m[0] for m in means])
         else:
             self.means = means
+        self.dtype    = dtype
         self.covs     = covs
         self.w        = w
         self.log_w    = np.log(w)
@@ -319,7 +368,7 @@ class mixture:
         max_vals = np.atleast_1d(p_ss.max(axis = 0))
         volume   = np.prod(np.diff(np.array([min_vals, max_vals]).T))
         ss       = np.random.uniform(min_vals, max_vals, size = (n_draws, self.dim))
-        return self.evaluate_mixture(np.atleast_2d(ss)).sum()*volume/n_draws
+        return np.sum(self.evaluate_mixture(np.atleast_2d(ss)), dtype = np.float64)*volume/n_draws
         
     @probit
     def evaluate_mixture(self, x):
@@ -332,7 +381,8 @@ class mixture:
         Returns:
             :np.ndarray: mixture.pdf(x)
         """
-        p = np.sum(np.array([w*mn(mean, cov).pdf(x)/self.norm for mean, cov, w in zip(self.means, self.covs, self.w)]), axis = 0)
+        x = np.asarray(x, dtype = self.dtype)
+        p = evaluate_gaussian_mixture(x, self.means, self.covs, self.log_w, dtype = self.dtype)/self.dtype(self.norm)
         return p * np.exp(-probit_logJ(x, self.bounds))
 
     @probit
@@ -346,7 +396,8 @@ class mixture:
         Returns:
             :np.ndarray: mixture.logpdf(x)
         """
-        p = logsumexp(np.array([w + mn(mean, cov).logpdf(x) - self.log_norm for mean, cov, w in zip(self.means, self.covs, self.log_w)]), axis = 0)
+        x = np.asarray(x, dtype = self.dtype)
+        p = evaluate_gaussian_mixture(x, self.means, self.covs, self.log_w, dtype = self.dtype, log = True) - self.dtype(self.log_norm)
         return p - probit_logJ(x, self.bounds)
         
     def _evaluate_mixture_in_probit(self, x):
@@ -359,8 +410,7 @@ class mixture:
         Returns:
             :np.ndarray: mixture.pdf(x)
         """
-        p = np.sum(np.array([w*mn(mean, cov).pdf(x) for mean, cov, w in zip(self.means, self.covs, self.w)]), axis = 0)
-        return p
+        return evaluate_gaussian_mixture(x, self.means, self.covs, self.log_w, dtype = self.dtype)
 
     def _evaluate_log_mixture_in_probit(self, x):
         """
@@ -372,8 +422,7 @@ class mixture:
         Returns:
             :np.ndarray: mixture.logpdf(x)
         """
-        p = logsumexp(np.array([w + mn(mean, cov).logpdf(x) for mean, cov, w in zip(self.means, self.covs, self.log_w)]), axis = 0)
-        return p
+        return evaluate_gaussian_mixture(x, self.means, self.covs, self.log_w, dtype = self.dtype, log = True)
 
     @from_probit
     def sample_from_dpgmm(self, n_samps):
@@ -386,6 +435,7 @@ class mixture:
         Returns:
             :np.ndarray: samples
         """
+        from scipy.stats import multivariate_normal as mn
         idx = np.random.choice(np.arange(self.n_cl), p = self.w, size = int(n_samps))
         ctr = Counter(idx)
         if self.dim > 1:
@@ -408,6 +458,7 @@ class mixture:
         Returns:
             :np.ndarray: samples in probit space
         """
+        from scipy.stats import multivariate_normal as mn
         idx = np.random.choice(np.arange(self.n_cl), p = self.w, size = n_samps)
         ctr = Counter(idx)
         if self.dim > 1:
@@ -434,6 +485,8 @@ class DPGMM:
         :double alpha0:          initial guess for concentration parameter
         :str or Path out_folder: folder for outputs
         :int n_draws_norm:       number of MC draws to estimate normalisation constant while instancing mixture class
+        :Telemetry telemetry:    instance of figaro.telemetry.Telemetry recording counters and timings. If None, nothing is recorded
+        :type dtype:             precision of the mixture evaluations (np.float64 or np.float32). Inference is always carried out in double precision
     
     Returns:
         :DPGMM: instance of DPGMM class
@@ -443,6 +496,8 @@ class DPGMM:
                        alpha0     = 1.,
                        out_folder = '.',
                        n_draws_norm = 1000,
+                       telemetry  = None,
+                       dtype      = np.float64,
                        ):
         self.bounds   = np.array(bounds)
         self.dim      = len(self.bounds)
@@ -457,6 +512,8 @@ class DPGMM:
         self.n_cl       = 0
         self.n_pts      = 0
         self.n_draws_norm = n_draws_norm
+        self.telemetry  = telemetry
+        self.dtype      = dtype
     
     def initialise(self, prior_pars = None):
         """
@@ -542,13 +599,19 @@ class DPGMM:
         Arguments:
             :np.ndarray x: sample
         """
+        if self.telemetry is not None:
+            t0 = perf_counter()
         scores = self._cluster_assignment_distribution(x).items()
+        if self.telemetry is not None:
+            self.telemetry.record('scoring', perf_counter() - t0, n_cl = self.n_cl)
         labels, scores = zip(*scores)
         cid = np.random.choice(labels, p=scores)
         if cid == "new":
             self.mixture.append(component(x, prior = self.prior))
             self.N_list.append(1.)
             self.n_cl += 1
+            if self.telemetry is not None:
+                self.telemetry.count('new_cluster')
         else:
             self.mixture[int(cid)] = self._add_datapoint_to_component(x, self.mixture[int(cid)])
             self.N_list[int(cid)] += 1
@@ -576,9 +639,31 @@ class DPGMM:
         Arguments:
             :np.ndarray x: sample
         """
+        self._add_point(np.atleast_2d(x))
+    
+    def _add_point(self, x):
+        """
+        Assigns a new point to a cluster and updates the concentration parameter (timed if telemetry is available)
+        
+        Arguments:
+            :np.ndarray x: point (sample in probit space or single-event draw)
+        """
         self.n_pts += 1
-        self._assign_to_cluster(np.atleast_2d(x))
+        t0 = perf_counter()
+        self._assign_to_cluster(x)
+        t1 = perf_counter()
         self.alpha = update_alpha(self.alpha, self.n_pts, self.n_cl)
+        if self.telemetry is not None:
+            t2 = perf_counter()
+            self.telemetry.record('add_new_point', t2 - t0, n_pts = self.n_pts, n_cl = self.n_cl, alpha = self.alpha, assign = t1 - t0, update_alpha = t2 - t1)
+    
+    def _timer(self, stage, **fields):
+        """
+        Telemetry timer for a stage (no-op context if telemetry is not available)
+        """
+        if self.telemetry is None:
+            return nullcontext()
+        return self.telemetry.timer(stage, **fields)
     
     def sample_from_dpgmm(self, n_samps):
         """
@@ -590,6 +675,7 @@ class DPGMM:
         Returns:
             :np.ndarray: samples
         """
+        from scipy.stats import multivariate_normal as mn
         idx = np.random.choice(np.arange(self.n_cl), p = self.w, size = n_samps)
         ctr = Counter(idx)
         if self.dim > 1:
@@ -612,6 +698,7 @@ class DPGMM:
         Returns:
             :np.ndarray: samples in probit space
         """
+        from scipy.stats import multivariate_normal as mn
         idx = np.random.choice(np.arange(self.n_cl), p = self.w, size = n_samps)
         ctr = Counter(idx)
         if self.dim > 1:
@@ -624,6 +711,19 @@ class DPGMM:
                 samples = np.concatenate((samples, np.atleast_2d(mn(self.mixture[i].mu, self.mixture[i].sigma).rvs(size = n)).T))
         return samples[1:]
 
+    def _evaluate_components(self, x, log = False):
+        """
+        Evaluate the current mixture (or its logarithm) at point(s) x in probit space, with the precision set by dtype
+        
+        Arguments:
+            :np.ndarray x: point(s) to evaluate the mixture at (in probit space)
+            :bool log:     return the log density
+        
+        Returns:
+            :np.ndarray: mixture.pdf(x) or mixture.logpdf(x)
+        """
+        return evaluate_gaussian_mixture(x, [comp.mu for comp in self.mixture], [comp.sigma for comp in self.mixture], self.log_w, dtype = self.dtype, log = log)
+
     def _evaluate_mixture_in_probit(self, x):
         """
         Evaluate mixture at point(s) x in probit space
@@ -634,7 +734,7 @@ class DPGMM:
         Returns:
             :np.ndarray: mixture.pdf(x)
         """
-        p = np.sum(np.array([w*mn(comp.mu, comp.sigma).pdf(x) for comp, w in zip(self.mixture, self.w)]), axis = 0)
+        p = self._evaluate_components(x)
         return p
 
     @probit
@@ -648,7 +748,7 @@ class DPGMM:
         Returns:
             :np.ndarray: mixture.pdf(x)
         """
-        p = np.sum(np.array([w*mn(comp.mu, comp.sigma).pdf(x) for comp, w in zip(self.mixture, self.w)]), axis = 0)
+        p = self._evaluate_components(x)
         return p
     
     @probit
@@ -662,7 +762,8 @@ class DPGMM:
         Returns:
             :np.ndarray: mixture.pdf(x)
         """
-        p = np.sum(np.array([w*mn(comp.mu, comp.sigma).pdf(x) for comp, w in zip(self.mixture, self.w)]), axis = 0)
+        x = np.asarray(x, dtype = self.dtype)
+        p = self._evaluate_components(x)
         return p * np.exp(-probit_logJ(x, self.bounds))
 
     def _evaluate_log_mixture_in_probit(self, x):
@@ -675,7 +776,7 @@ class DPGMM:
         Returns:
             :np.ndarray: mixture.logpdf(x)
         """
-        p = logsumexp(np.array([w + mn(comp.mu, comp.sigma).logpdf(x) for comp, w in zip(self.mixture, self.log_w)]), axis = 0)
+        p = self._evaluate_components(x, log = True)
         return p
 
     @probit
@@ -689,7 +790,7 @@ class DPGMM:
         Returns:
             :np.ndarray: mixture.logpdf(x)
         """
-        p = logsumexp(np.array([w + mn(comp.mu, comp.sigma).logpdf(x) for comp, w in zip(self.mixture, self.log_w)]), axis = 0)
+        p = self._evaluate_components(x, log = True)
         return p
         
     @probit
@@ -703,7 +804,8 @@ class DPGMM:
         Returns:
             :np.ndarray: mixture.pdf(x)
         """
-        p = logsumexp(np.array([w + mn(comp.mu, comp.sigma).logpdf(x) for comp, w in zip(self.mixture, self.log_w)]), axis = 0)
+        x = np.asarray(x, dtype = self.dtype)
+        p = self._evaluate_components(x, log = True)
         return p - probit_logJ(x, self.bounds)
 
     def save_density(self):
@@ -721,7 +823,8 @@ class DPGMM:
         Returns:
             :mixture: the inferred distribution
         """
-        return mixture(np.array([comp.mu for comp in self.mixture]), np.array([comp.sigma for comp in self.mixture]), np.array(self.w), self.bounds, self.dim, self.n_cl, self.n_pts, n_draws = self.n_draws_norm)
+        with self._timer('build_mixture', n_pts = self.n_pts, n_cl = self.n_cl):
+            return mixture(np.array([comp.mu for comp in self.mixture]), np.array([comp.sigma for comp in self.mixture]), np.array(self.w), self.bounds, self.dim, self.n_cl, self.n_pts, n_draws = self.n_draws_norm, dtype = self.dtype)
 
 
 class HDPGMM(DPGMM):
@@ -735,6 +838,8 @@ class HDPGMM(DPGMM):
         :double alpha0:          initial guess for concentration parameter
         :str or Path out_folder: folder for outputs
         :int n_draws_norm:       number of MC draws to estimate normalisation constant while instancing mixture class
+        :Telemetry telemetry:    instance of figaro.telemetry.Telemetry recording counters and timings. If None, nothing is recorded
+        :type dtype:             precision of the mixture evaluations (np.float64 or np.float32)
     
     Returns:
         :HDPGMM: instance of HDPGMM class
@@ -744,12 +849,14 @@ class HDPGMM(DPGMM):
                        out_folder = '.',
                        prior_pars = None,
                        MC_draws   = 1e3,
-                       n_draws_norm = 1000
+                       n_draws_norm = 1000,
+                       telemetry  = None,
+                       dtype      = np.float64,
                        ):
         dim = len(bounds)
         if prior_pars == None:
             prior_pars = (1e-1, np.identity(dim)*0.2**2, dim, np.zeros(dim))
-        super().__init__(bounds = bounds, prior_pars = prior_pars, alpha0 = alpha0, out_folder = out_folder, n_draws_norm = n_draws_norm)
+        super().__init__(bounds = bounds, prior_pars = prior_pars, alpha0 = alpha0, out_folder = out_folder, n_draws_norm = n_draws_norm, telemetry = telemetry, dtype = dtype)
         self.MC_draws = int(MC_draws)
     
     def add_new_point(self, ev):
@@ -759,10 +866,7 @@ class HDPGMM(DPGMM):
         Arguments:
             :iterable x: set of single-event draws from a DPGMM inference
         """
-        self.n_pts += 1
-        x = np.random.choice(ev)
-        self._assign_to_cluster(x)
-        self.alpha = update_alpha(self.alpha, self.n_pts, self.n_cl)
+        self._add_point(np.random.choice(ev))
 
     def _cluster_assignment_distribution(self, x):
         """
@@ -798,7 +902,12 @@ class HDPGMM(DPGMM):
         Arguments:
             :np.ndarray x: sample
         """
+        if self.telemetry is not None:
+            t0 = perf_counter()
         scores, logL_N = self._cluster_assignment_distribution(x)
+        if self.telemetry is not None:
+            # Dominated by the MC predictive integrals (one per cluster, plus the new cluster)
+            self.telemetry.record('scoring', perf_counter() - t0, n_cl = self.n_cl, MC_draws = self.MC_draws)
         scores = scores.items()
         labels, scores = zip(*scores)
         cid = np.random.choice(labels, p=scores)
@@ -806,6 +915,8 @@ class HDPGMM(DPGMM):
             self.mixture.append(component_h(x, self.dim, self.prior, logL_N[cid]))
             self.N_list.append(1.)
             self.n_cl += 1
+            if self.telemetry is not None:
+                self.telemetry.count('new_cluster')
         else:
             self.mixture[int(cid)] = self._add_datapoint_to_component(x, self.mixture[int(cid)], logL_N[int(cid)])
             self.N_list[int(cid)] += 1
@@ -888,4 +999,5 @@ class HDPGMM(DPGMM):
         Returns:
             :mixture: the inferred distribution
         """
-        return mixture(np.array([comp.mu for comp in self.mixture]), np.array([comp.sigma for comp in self.mixture]), np.array(self.w), self.bounds, self.dim, self.n_cl, self.n_pts, n_draws = self.n_draws_norm, hier_flag = True)
+        with self._timer('build_mixture', n_pts = self.n_pts, n_cl = self.n_cl):
+            return mixture(np.array([comp.mu for comp in self.mixture]), np.array([comp.sigma for comp in self.mixture]), np.array(self.w), self.bounds, self.dim, self.n_cl, self.n_pts, n_draws = self.n_draws_norm, hier_flag = True, dtype = self.dtype)
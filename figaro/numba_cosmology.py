@@ -0,0 +1,259 @@
+import numpy as np
+import os
+from functools import lru_cache
+from numba import njit, prange
+
+"""
+Vectorised cosmology without LAL.
+Distances are integrated once per cosmology on a redshift grid (Gauss-Legendre quadrature on each interval) and evaluated with cubic Hermite interpolation, using the exact integrand as derivative (relative error below 1e-12).
+CosmologicalParameters mirrors the API of figaro.cosmology.CosmologicalParameters (LAL wrapper), with methods accepting both scalars and arrays.
+The backend used by FIGARO is chosen with get_cosmology (default: numba, 'lal' for the LAL reference implementation, also selectable with the FIGARO_COSMOLOGY_BACKEND environment variable).
+"""
+
+C_KMS = 299792.458 # km/s
+
+_GL_x, _GL_w = np.polynomial.legendre.leggauss(8)
+
+@njit(cache = True, nogil = True)
+def _inv_E(z, om, ol, ok, w0, w1):
+    """
+    1/E(z) = H0/H(z), with the dark energy parametrisation used by LAL.
+    """
+    x = 1. + z
+    return 1./np.sqrt(om*x**3 + ok*x**2 + ol*x**(3.*(1.+w0+w1))*np.exp(-3.*w1*z/x))
+
+@njit(cache = True, nogil = True)
+def _cumulative_integral(z, om, ol, ok, w0, w1, GL_x, GL_w):
+    """
+    Cumulative integral of 1/E(z) on a grid, 8-point Gauss-Legendre on each interval.
+    """
+    n = len(z)
+    I = np.zeros(n)
+    for i in range(1, n):
+        a = z[i-1]
+        b = z[i]
+        s = 0.
+        for k in range(len(GL_x)):
+            s += GL_w[k]*_inv_E(0.5*(a+b) + 0.5*(b-a)*GL_x[k], om, ol, ok, w0, w1)
+        I[i] = I[i-1] + 0.5*(b-a)*s
+    return I
+
+@njit(parallel = True, cache = True, nogil = True)
+def _hermite(z, z_tab, I_tab, dI_tab):
+    """
+    Cubic Hermite interpolation of a tabulated function with known derivative.
+    """
+    n   = len(z_tab)
+    out = np.empty(len(z))
+    for i in prange(len(z)):
+        j = np.searchsorted(z_tab, z[i]) - 1
+        if j < 0:
+            j = 0
+        if j > n-2:
+            j = n-2
+        h = z_tab[j+1] - z_tab[j]
+        t = (z[i] - z_tab[j])/h
+        out[i] = (1.+2.*t)*(1.-t)**2*I_tab[j] + t*(1.-t)**2*h*dI_tab[j] + t**2*(3.-2.*t)*I_tab[j+1] + t**2*(t-1.)*h*dI_tab[j+1]
+    return out
+
+class _Table:
+    """
+    Comoving distance (in units of D_H) on a redshift grid, uniform in log(1+z).
+    """
+    def __init__(self, om, ol, ok, w0, w1, z_max, n_points = 4096):
+        self.pars  = (om, ol, ok, w0, w1)
+        self.z_max = z_max
+        self.z     = np.expm1(np.linspace(0., np.log1p(z_max), int(n_points)))
+        self.DC    = _cumulative_integral(self.z, om, ol, ok, w0, w1, _GL_x, _GL_w)
+        self.dDC   = _inv_E(self.z, om, ol, ok, w0, w1)
+        self._volume_density = None
+
+@lru_cache(maxsize = 32)
+def _table(om, ol, ok, w0, w1, z_max):
+    return _Table(om, ol, ok, w0, w1, z_max)
+
+class CosmologicalParameters:
+    """
+    Cosmology (LAL conventions), vectorised and without LAL.
+    Every method accepts scalars or arrays and returns a float or an array accordingly.
+
+    Arguments:
+        :double h:  Hubble constant H0/100 [km/(s*Mpc)]
+        :double om: matter density parameter
+        :double ol: cosmological constant density parameter
+        :double w0: dark energy equation of state parameter
+        :double w1: dark energy equation of state parameter (redshift dependence)
+
+    Returns:
+        :CosmologicalParameters: instance of CosmologicalParameters class
+    """
+    def __init__(self, h, om, ol, w0 = -1., w1 = 0.):
+        self.h   = float(h)
+        self.om  = float(om)
+        self.ol  = float(ol)
+        self.w0  = float(w0)
+        self.w1  = float(w1)
+        self.ok  = 1. - self.om - self.ol
+        self.D_H = C_KMS/(100.*self.h)
+
+    def __reduce__(self):
+        return (CosmologicalParameters, (self.h, self.om, self.ol, self.w0, self.w1))
+
+    def _table(self, z_max):
+        """
+        Distance table covering z_max (the maximum redshift is doubled until it does).
+        """
+        z_table = 20.
+        while z_max > z_table:
+            z_table = 2*z_table
+        return _table(self.om, self.ol, self.ok, self.w0, self.w1, z_table)
+
+    def _apply(self, func, z):
+        z   = np.asarray(z, dtype = np.float64)
+        out = func(np.ascontiguousarray(z.ravel()))
+        if z.ndim == 0:
+            return float(out[0])
+        return out.reshape(z.shape)
+
+    def _comoving_LOS(self, z):
+        if len(z) == 0:
+            return np.zeros(0)
+        table = self._table(np.max(z))
+        return self.D_H*_hermite(z, table.z, table.DC, table.dDC)
+
+    def _comoving_transverse(self, z):
+        DC = self._comoving_LOS(z)
+        if self.ok > 1e-14:
+            return self.D_H/np.sqrt(self.ok)*np.sinh(np.sqrt(self.ok)*DC/self.D_H)
+        if self.ok < -1e-14:
+            return self.D_H/np.sqrt(-self.ok)*np.sin(np.sqrt(-self.ok)*DC/self.D_H)
+        return DC
+
+    def HubbleDistance(self):
+        """
+        Returns:
+            :double: Hubble distance c/H0 [Mpc]
+        """
+        return self.D_H
+
+    def HubbleParameter(self, z):
+        """
+        Returns:
+            :double or np.ndarray: H0/H(z) (as in LAL)
+        """
+        return self._apply(lambda x: _inv_E(x, self.om, self.ol, self.ok, self.w0, self.w1), z)
+
+    def ComovingLOSDistance(self, z):
+        """
+        Returns:
+            :double or np.ndarray: comoving line-of-sight distance [Mpc]
+        """
+        return self._apply(self._comoving_LOS, z)
+
+    def ComovingTransverseDistance(self, z):
+        """
+        Returns:
+            :double or np.ndarray: comoving transverse distance [Mpc]
+        """
+        return self._apply(self._comoving_transverse, z)
+
+    def LuminosityDistance(self, z):
+        """
+        Returns:
+            :double or np.ndarray: luminosity distance [Mpc]
+        """
+        return self._apply(lambda x: (1.+x)*self._comoving_transverse(x), z)
+
+    def LuminosityDistance_double(self, z):
+        return float(self.LuminosityDistance(float(z)))
+
+    def ComovingVolumeElement(self, z):
+        """
+        Returns:
+            :double or np.ndarray: dV_c/dz [Mpc^3]
+        """
+        return self._apply(lambda x: 4.*np.pi*self.D_H*self._comoving_transverse(x)**2*_inv_E(x, self.om, self.ol, self.ok, self.w0, self.w1), z)
+
+    def ComovingVolume(self, z):
+        """
+        Returns:
+            :double or np.ndarray: comoving volume within redshift z [Mpc^3]
+        """
+        def volume(x):
+            DM = self._comoving_transverse(x)
+            if abs(self.ok) < 1e-14:
+                return 4.*np.pi/3.*DM**3
+            r  = DM/self.D_H
+            sk = np.sqrt(abs(self.ok))
+            if self.ok > 0:
+                return 2.*np.pi*self.D_H**3/self.ok*(r*np.sqrt(1.+self.ok*r**2) - np.arcsinh(sk*r)/sk)
+            return 2.*np.pi*self.D_H**3/self.ok*(r*np.sqrt(1.+self.ok*r**2) - np.arcsin(sk*r)/sk)
+        return self._apply(volume, z)
+
+    def IntegrateComovingVolume(self, zmax):
+        return self.ComovingVolume(zmax)
+
+    def UniformComovingVolumeDensity(self, z):
+        """
+        Returns:
+            :double or np.ndarray: dV_c/dz/(1+z) [Mpc^3]
+        """
+        return self._apply(lambda x: self.ComovingVolumeElement(x)/(1.+x), z)
+
+    def IntegrateComovingVolumeDensity(self, zmax):
+        """
+        Returns:
+            :double or np.ndarray: integral of UniformComovingVolumeDensity between 0 and zmax [Mpc^3]
+        """
+        def integral(x):
+            if len(x) == 0:
+                return np.zeros(0)
+            table = self._table(np.max(x))
+            if table._volume_density is None:
+                # Gauss-Legendre quadrature on each interval of the table
+                a     = table.z[:-1, None]
+                b     = table.z[1:, None]
+                nodes = 0.5*(a+b) + 0.5*(b-a)*_GL_x
+                f     = self.UniformComovingVolumeDensity(nodes)
+                V     = np.concatenate(([0.], np.cumsum(0.5*(b-a)[:,0]*(f*_GL_w).sum(axis = -1))))
+                table._volume_density = V
+            # Tabulated integral up to the previous grid point, quadrature for the rest
+            j  = np.clip(np.searchsorted(table.z, x) - 1, 0, len(table.z)-2)
+            a  = table.z[j]
+            f  = self.UniformComovingVolumeDensity(a[:,None] + 0.5*(x-a)[:,None]*(1.+_GL_x))
+            return table._volume_density[j] + 0.5*(x-a)*(f*_GL_w).sum(axis = -1)
+        return self._apply(integral, zmax)
+
+    def UniformComovingVolumeDistribution(self, z, zmax):
+        """
+        Returns:
+            :double or np.ndarray: probability density of z for sources uniformly distributed in comoving volume and source-frame time, up to zmax
+        """
+        return self.UniformComovingVolumeDensity(z)/self.IntegrateComovingVolumeDensity(zmax)
+
+    def DestroyCosmologicalParameters(self):
+        return
+
+def get_cosmology(h, om, ol, w0 = -1., w1 = 0., backend = None):
+    """
+    Instance of CosmologicalParameters from the selected backend.
+
+    Arguments:
+        :double h:    Hubble constant H0/100 [km/(s*Mpc)]
+        :double om:   matter density parameter
+        :double ol:   cosmological constant density parameter
+        :double w0:   dark energy equation of state parameter
+        :double w1:   dark energy equation of state parameter (redshift dependence)
+        :str backend: 'numba' or 'lal'. Default: FIGARO_COSMOLOGY_BACKEND environment variable if set, otherwise 'numba'
+
+    Returns:
+        :CosmologicalParameters: cosmology
+    """
+    if backend is None:
+        backend = os.environ.get('FIGARO_COSMOLOGY_BACKEND', 'numba')
+    if backend == 'lal':
+        from figaro.cosmology import CosmologicalParameters as LALCosmologicalParameters
+        return LALCosmologicalParameters(h, om, ol, w0, w1)
+    if backend == 'numba':
+        return CosmologicalParameters(h, om, ol, w0, w1)
+    raise ValueError("Unknown cosmology backend: {0}. Available backends: numba, lal".format(backend))
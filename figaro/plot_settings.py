@@ -0,0 +1,47 @@
+import shutil
+from functools import lru_cache
+
+"""
+Lazy access to matplotlib: pyplot is imported, and the FIGARO plot style applied, when the first plot is drawn rather than when figaro is imported.
+"""
+
+style = {"xtick.labelsize":  14,
+         "ytick.labelsize":  14,
+         "xtick.direction":  "in",
+         "ytick.direction":  "in",
+         "legend.fontsize":  12,
+         "axes.labelsize":   16,
+         "axes.grid":        True,
+         "grid.alpha":       0.6,
+         }
+
+_style_applied = False
+
+@lru_cache(maxsize = None)
+def latex_available():
+    """
+    Checks (once per process) whether a LaTeX installation is available.
+
+    Returns:
+        :bool: True if latex is found
+    """
+    return shutil.which('latex') is not None
+
+def pyplot(rc = None):
+    """
+    Returns matplotlib.pyplot, importing it and applying the FIGARO style on first use.
+
+    Arguments:
+        :dict rc: additional rcParams, applied at every call
+
+    Returns:
+        :module: matplotlib.pyplot
+    """
+    global _style_applied
+    import matplotlib.pyplot as plt
+    if not _style_applied:
+        plt.rcParams.update(style)
+        _style_applied = True
+    if rc is not None:
+        plt.rcParams.update(rc)
+    return plt
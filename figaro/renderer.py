@@ -0,0 +1,111 @@
+import multiprocessing as mp
+import queue
+import traceback
+import warnings
+from time import sleep
+
+"""
+Producer/consumer renderer: plots are drawn in a separate process while the inference keeps running.
+The producer submits a module-level plotting function together with a snapshot of the arrays it needs.
+"""
+
+def _render_loop(tasks, n_done):
+    """
+    Consumer loop, running in the rendering process.
+
+    Arguments:
+        :mp.Queue tasks:  queue of (function, args) tuples. None stops the loop.
+        :mp.Value n_done: number of completed tasks
+    """
+    import matplotlib.pyplot as plt
+    plt.switch_backend('Agg')
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        func, args = task
+        try:
+            func(*args)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            plt.close('all')
+            with n_done.get_lock():
+                n_done.value += 1
+
+class BackgroundRenderer:
+    """
+    Class to draw plots in a background process.
+    Tasks are stored in a bounded queue: if the queue is full, non-blocking submissions are skipped so that the producer never waits on matplotlib.
+    Waits (flush, close) check periodically that the rendering process is still alive, so that the producer does not hang if it dies.
+
+    Arguments:
+        :int max_queue:    maximum number of pending tasks
+        :double poll_time: interval between checks while waiting [s]
+
+    Returns:
+        :BackgroundRenderer: instance of BackgroundRenderer class
+    """
+    def __init__(self, max_queue = 4, poll_time = 0.1):
+        self.max_queue   = int(max_queue)
+        self.poll_time   = poll_time
+        self.n_skipped   = 0
+        self.n_submitted = 0
+        self.n_done      = mp.Value('l', 0)
+        self.tasks       = mp.Queue(maxsize = self.max_queue)
+        self.process     = mp.Process(target = _render_loop, args = (self.tasks, self.n_done), daemon = True)
+        self.process.start()
+
+    def submit(self, func, *args, block = True):
+        """
+        Queue a plotting task.
+
+        Arguments:
+            :callable func: module-level function (must be picklable)
+            :iterable args: arguments for func (snapshot of the arrays to plot)
+            :bool block:    wait for a free slot if the queue is full. If False, the task is skipped instead.
+
+        Returns:
+            :bool: True if the task has been queued
+        """
+        if not self.process.is_alive():
+            raise RuntimeError("The rendering process is not running")
+        while True:
+            try:
+                self.tasks.put((func, args), block = block, timeout = self.poll_time)
+                break
+            except queue.Full:
+                if not block:
+                    self.n_skipped += 1
+                    warnings.warn("Rendering queue is full: skipping {0}".format(func.__name__))
+                    return False
+                # Wait for a free slot, as long as the rendering process is running
+                if not self.process.is_alive():
+                    raise RuntimeError("The rendering process is not running")
+        self.n_submitted += 1
+        return True
+
+    def flush(self):
+        """
+        Wait until every queued task has been rendered. Returns without waiting further if the rendering process dies.
+
+        Returns:
+            :bool: True if every task has been rendered
+        """
+        while self.n_done.value < self.n_submitted:
+            if not self.process.is_alive():
+                warnings.warn("The rendering process stopped with {0} pending task(s)".format(self.n_submitted - self.n_done.value))
+                return False
+            sleep(self.poll_time)
+        return True
+
+    def close(self):
+        """
+        Render pending tasks and stop the rendering process.
+        """
+        if self.flush() and self.process.is_alive():
+            self.tasks.put(None)
+            while self.process.is_alive():
+                self.process.join(timeout = self.poll_time)
+        elif self.process.is_alive():
+            self.process.terminate()
@@ -0,0 +1,398 @@
+import numpy as np
+import base64
+import json
+import os
+import socket
+import socketserver
+import threading
+import traceback
+import warnings
+from collections import OrderedDict
+from pathlib import Path
+from time import perf_counter
+
+from figaro.cache import config_key
+from figaro.telemetry import Telemetry
+
+"""
+Long-running inference service for low-latency skymaps.
+The service keeps numba kernels compiled, evaluation grids built and the galaxy catalog loaded across jobs: VolumeReconstruction instances are created once per configuration and re-initialised for every job.
+Clients connect to a local UNIX socket and exchange newline-delimited JSON messages. Arrays are sent as base64-encoded raw buffers (see encode_array).
+
+Requests:
+    {"command": "ping"}
+    {"command": "status"}
+    {"command": "shutdown"}
+    {"command": "submit", "samples": <array>, "max_dist": <float>, "options": {...}, "return_maps": <bool>}
+
+Replies to submit are streamed: an "accepted" message, a "snapshot" message every time a skymap is evaluated (credible areas and, if return_maps, the skymap itself), and a final "done" (or "error") message.
+"""
+
+# Options that change for every job. Every other option is passed to VolumeReconstruction and identifies the instance to be reused.
+job_options = ['name', 'out_folder', 'true_host', 'host_name']
+
+def encode_array(x):
+    """
+    Encodes an array as a JSON-serialisable dictionary.
+
+    Arguments:
+        :np.ndarray x: array
+
+    Returns:
+        :dict: dtype, shape and base64-encoded data
+    """
+    x = np.ascontiguousarray(x)
+    return {'dtype': x.dtype.str, 'shape': list(x.shape), 'data': base64.b64encode(x.tobytes()).decode('ascii')}
+
+def decode_array(d):
+    """
+    Decodes an array encoded with encode_array. Lists are converted to arrays.
+
+    Arguments:
+        :dict d: encoded array (or list)
+
+    Returns:
+        :np.ndarray: array
+    """
+    if not isinstance(d, dict):
+        return np.array(d, dtype = np.float64)
+    return np.frombuffer(base64.b64decode(d['data']), dtype = np.dtype(d['dtype'])).reshape(d['shape'])
+
+def _send(sock_file, message):
+    sock_file.write((json.dumps(message, default = _to_builtin) + '\n').encode())
+    sock_file.flush()
+
+def _to_builtin(x):
+    # Large arrays (skymaps) are encoded explicitly, the others are sent as lists
+    if isinstance(x, np.ndarray):
+        return x.tolist()
+    if isinstance(x, np.generic):
+        return x.item()
+    return str(x)
+
+class InferenceService:
+    """
+    Holds warm VolumeReconstruction instances and runs jobs on them, one at a time.
+
+    Arguments:
+        :str or Path out_folder:         root output folder. Each job writes in out_folder/name unless a different out_folder is requested
+        :dict defaults:                  default VolumeReconstruction options (overridden by job options)
+        :int max_instances:              maximum number of instances (configurations) kept in memory. The least recently used one is dropped first
+        :str or Path grid_cache_folder:  folder with memory-mapped grids (see figaro.cache)
+        :bool background_plots:          draw plots in a background process, so that sampling never waits on matplotlib
+
+    Returns:
+        :InferenceService: instance of InferenceService class
+    """
+    def __init__(self, out_folder = '.',
+                       defaults          = None,
+                       max_instances     = 4,
+                       grid_cache_folder = None,
+                       background_plots  = True,
+                       ):
+        self.out_folder    = Path(out_folder).resolve()
+        self.defaults      = dict(defaults) if defaults is not None else {}
+        self.defaults.setdefault('incr_plot', True)
+        self.defaults.setdefault('background_plots', background_plots)
+        if grid_cache_folder is not None:
+            self.defaults.setdefault('grid_cache_folder', str(grid_cache_folder))
+        self.max_instances = int(max_instances)
+        self.instances     = OrderedDict()
+        self.lock          = threading.Lock()
+        self.n_jobs        = 0
+        self.n_waiting     = 0
+        # Protects n_waiting only: it is updated by handler threads waiting for self.lock
+        self.waiting_lock  = threading.Lock()
+        self._job          = None
+        if not self.out_folder.exists():
+            self.out_folder.mkdir(parents = True)
+
+    def _split_options(self, max_dist, options):
+        """
+        Separates per-job options from the ones identifying the instance.
+
+        Returns:
+            :str: instance key
+            :dict: VolumeReconstruction options
+            :dict: job options
+        """
+        options  = dict(options) if options is not None else {}
+        job      = {k: options.pop(k) for k in job_options if k in options}
+        settings = dict(self.defaults)
+        settings.update(options)
+        settings.pop('telemetry', None)
+        key = config_key(max_dist = float(max_dist), **settings)
+        return key, settings, job
+
+    def get_instance(self, max_dist, options = None):
+        """
+        Returns the VolumeReconstruction instance for a configuration, creating it if needed.
+
+        Arguments:
+            :double max_dist: maximum luminosity distance
+            :dict options:    VolumeReconstruction options
+
+        Returns:
+            :VolumeReconstruction: instance
+        """
+        from figaro.threeDvolume import VolumeReconstruction
+        key, settings, _ = self._split_options(max_dist, options)
+        if key in self.instances:
+            self.instances.move_to_end(key)
+            return self.instances[key]
+        telemetry = Telemetry(capacity = 1000, callbacks = [self._on_event], stages = ['evaluate_skymap', 'evaluate_volume_map'])
+        vol = VolumeReconstruction(float(max_dist), out_folder = self.out_folder, telemetry = telemetry, **settings)
+        self.instances[key] = vol
+        while len(self.instances) > self.max_instances:
+            _, old = self.instances.popitem(last = False)
+            old.close()
+        return vol
+
+    def preload(self, max_dists, options = None, warmup = True):
+        """
+        Builds the instances for a set of distances (grids and catalog) and compiles the numba functions.
+
+        Arguments:
+            :iterable max_dists: maximum luminosity distances
+            :dict options:       VolumeReconstruction options
+            :bool warmup:        run a small reconstruction on each instance
+        """
+        from figaro.coordinates import celestial_to_cartesian
+        rng = np.random.default_rng(0)
+        for max_dist in max_dists:
+            vol = self.get_instance(max_dist, options)
+            if warmup:
+                samples = np.array([rng.uniform(0, 2*np.pi, 30), rng.uniform(-1, 1, 30), rng.uniform(0.2, 0.8, 30)*max_dist]).T
+                # add_new_point rather than add_sample: no plots are drawn
+                for x in celestial_to_cartesian(samples):
+                    vol.add_new_point(x)
+                vol.volume_already_evaluated = False
+                vol.evaluate_skymap()
+                vol.evaluate_volume_map()
+                vol.initialise()
+
+    def _on_event(self, event):
+        """
+        Telemetry callback: forwards skymap evaluations of the running job to its client.
+        """
+        job = self._job
+        if job is None or event['stage'] != 'evaluate_skymap':
+            return
+        vol     = job['instance']
+        message = {'type':    'snapshot',
+                   'n_pts':   event['n_pts'],
+                   'n_cl':    vol.n_cl,
+                   'levels':  vol.levels,
+                   'areas':   event['areas'],
+                   'elapsed': perf_counter() - job['t0'],
+                   }
+        if job['return_maps']:
+            message['skymap'] = encode_array((vol.p_skymap*vol.dra*vol.ddec).astype(np.float32))
+        job['send'](message)
+
+    def run_job(self, request, send):
+        """
+        Reconstructs the volume for a set of samples, streaming snapshots as the skymaps are evaluated.
+
+        Arguments:
+            :dict request:    submit request (samples, max_dist, options, return_maps)
+            :callable send:   function sending a message (dict) to the client
+        """
+        t0 = perf_counter()
+        with self.waiting_lock:
+            self.n_waiting += 1
+        with self.lock:
+            with self.waiting_lock:
+                self.n_waiting -= 1
+            samples     = decode_array(request['samples'])
+            max_dist    = float(request['max_dist'])
+            return_maps = bool(request.get('return_maps', False))
+            _, _, job   = self._split_options(max_dist, request.get('options'))
+            vol         = self.get_instance(max_dist, request.get('options'))
+            self.n_jobs += 1
+            name        = job.get('name', 'job_{0}'.format(self.n_jobs))
+            send({'type': 'accepted', 'name': name, 'n_samples': len(samples), 'wait': perf_counter() - t0})
+            # Re-initialise the warm instance for this job
+            vol.name       = name
+            vol.out_folder = Path(job.get('out_folder', Path(self.out_folder, name))).resolve()
+            vol.out_folder.mkdir(parents = True, exist_ok = True)
+            vol.make_folders()
+            vol.host_name  = job.get('host_name', 'Host')
+            true_host      = job.get('true_host')
+            vol.initialise(true_host = np.array(true_host, dtype = np.float64) if true_host is not None else None)
+            self._job = {'instance': vol, 'send': send, 't0': t0, 'return_maps': return_maps}
+            try:
+                vol.density_from_samples(samples)
+            finally:
+                self._job = None
+            result = {'type':       'done',
+                      'name':       name,
+                      'n_pts':      vol.n_pts,
+                      'n_cl':       vol.n_cl,
+                      'levels':     vol.levels,
+                      'areas':      vol.areas,
+                      'volumes':    vol.volumes,
+                      'out_folder': vol.out_folder,
+                      'density':    Path(vol.density_folder, vol.name + '_density.pkl'),
+                      'elapsed':    perf_counter() - t0,
+                      }
+            if vol.true_host is not None:
+                result.update({'searched_area': vol.searched_area, 'searched_volume': vol.searched_volume, 'CR_host': vol.CR_host, 'CV_host': vol.CV_host})
+            if return_maps:
+                result['skymap'] = encode_array((vol.p_skymap*vol.dra*vol.ddec).astype(np.float32))
+            send(result)
+
+    def status(self):
+        """
+        Service status.
+
+        Returns:
+            :dict: number of jobs run and waiting, instances in memory (max_dist and number of grid points)
+        """
+        return {'type':      'status',
+                'pid':       os.getpid(),
+                'n_jobs':    self.n_jobs,
+                'n_waiting': self.n_waiting,
+                'busy':      self._job is not None,
+                'instances': [{'max_dist': vol.max_dist, 'n_gridpoints': list(vol.n_gridpoints), 'catalog': vol.catalog is not None} for vol in self.instances.values()],
+                }
+
+    def close(self):
+        """
+        Stops the rendering processes.
+        """
+        for vol in self.instances.values():
+            vol.close()
+        self.instances.clear()
+
+class _Handler(socketserver.StreamRequestHandler):
+    """
+    Reads requests (one JSON object per line) and writes the replies on the same connection.
+    """
+    def handle(self):
+        service = self.server.service
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            send = lambda message: _send(self.wfile, message)
+            try:
+                request = json.loads(line)
+                command = request.get('command')
+                if command == 'ping':
+                    send({'type': 'pong'})
+                elif command == 'status':
+                    send(service.status())
+                elif command == 'submit':
+                    service.run_job(request, send)
+                elif command == 'shutdown':
+                    send({'type': 'bye'})
+                    threading.Thread(target = self.server.shutdown, daemon = True).start()
+                    return
+                else:
+                    send({'type': 'error', 'message': 'Unknown command: {0}'.format(command)})
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            except Exception as e:
+                traceback.print_exc()
+                try:
+                    send({'type': 'error', 'message': '{0}: {1}'.format(type(e).__name__, e)})
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve(socket_path, service):
+    """
+    Runs the service on a UNIX socket until a shutdown request is received.
+
+    Arguments:
+        :str or Path socket_path: socket file
+        :InferenceService service: service
+    """
+    socket_path = Path(socket_path)
+    if socket_path.exists():
+        socket_path.unlink()
+    server         = _Server(str(socket_path), _Handler)
+    server.service = service
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        service.close()
+        if socket_path.exists():
+            socket_path.unlink()
+
+class ServiceClient:
+    """
+    Client for the inference service.
+
+    Arguments:
+        :str or Path socket_path: socket file
+        :double timeout:          connection timeout [s]. Default: none
+
+    Returns:
+        :ServiceClient: instance of ServiceClient class
+    """
+    def __init__(self, socket_path, timeout = None):
+        self.socket_path = str(socket_path)
+        self.timeout     = timeout
+
+    def _request(self, request, last = ('pong', 'status', 'done', 'error', 'bye')):
+        """
+        Sends a request and yields the replies until the last one.
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            with sock.makefile('rwb') as f:
+                _send(f, request)
+                for line in f:
+                    message = json.loads(line)
+                    if 'skymap' in message:
+                        message['skymap'] = decode_array(message['skymap'])
+                    yield message
+                    if message['type'] in last:
+                        return
+
+    def ping(self):
+        """
+        Returns:
+            :bool: True if the service is answering
+        """
+        try:
+            return next(self._request({'command': 'ping'}))['type'] == 'pong'
+        except (FileNotFoundError, ConnectionRefusedError):
+            return False
+
+    def status(self):
+        """
+        Returns:
+            :dict: service status (see InferenceService.status)
+        """
+        return next(self._request({'command': 'status'}))
+
+    def shutdown(self):
+        """
+        Stops the service.
+        """
+        return next(self._request({'command': 'shutdown'}))
+
+    def submit(self, samples, max_dist, return_maps = False, **options):
+        """
+        Submits a job and yields the replies as they are produced: accepted, snapshot (one per skymap), done (or error).
+
+        Arguments:
+            :np.ndarray samples:  samples (ra, dec, D_L), shape (n_samples, 3)
+            :double max_dist:     maximum luminosity distance
+            :bool return_maps:    include the skymaps (probability per pixel, float32) in snapshot and done messages
+            :dict options:        VolumeReconstruction options (name, out_folder, true_host, host_name are per-job settings)
+
+        Returns:
+            :generator: replies (dict)
+        """
+        request = {'command': 'submit', 'samples': encode_array(np.asarray(samples, dtype = np.float64)), 'max_dist': float(max_dist), 'options': options, 'return_maps': return_maps}
+        for message in self._request(request):
+            if message['type'] == 'error':
+                warnings.warn('Inference service error: {0}'.format(message['message']))
+            yield message
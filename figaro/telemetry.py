@@ -0,0 +1,176 @@
+import numpy as np
+import json
+import csv
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from time import perf_counter, time
+
+"""
+Inference telemetry: counters, timings and a bounded record of events, filled by DPGMM, HDPGMM and VolumeReconstruction when a Telemetry instance is attached to them (telemetry = Telemetry()).
+If no instance is attached, the instrumented methods only pay for an `is None` check.
+"""
+
+class Telemetry:
+    """
+    Recorder for inference telemetry.
+    Each event is a dictionary with the stage name, the wall-clock time, the duration (if timed) and stage-specific fields (e.g. n_pts, n_cl, alpha).
+    Events are stored in a ring buffer (the oldest ones are dropped once capacity is reached), while counters and timing totals cover the whole run.
+
+    Arguments:
+        :int capacity:       maximum number of events stored
+        :iterable callbacks: functions called with each event (dict) as it is recorded
+        :iterable stages:    stages to be stored in the ring buffer. Default: all. Counters and timings are always updated
+
+    Returns:
+        :Telemetry: instance of Telemetry class
+    """
+    def __init__(self, capacity = 10000, callbacks = None, stages = None):
+        self.capacity  = int(capacity)
+        self.callbacks = list(callbacks) if callbacks is not None else []
+        self.stages    = set(stages) if stages is not None else None
+        self.reset()
+
+    def reset(self):
+        """
+        Drop every event, counter and timing.
+        """
+        self.events   = deque(maxlen = self.capacity)
+        self.counters = {}
+        self.timings  = {}
+        self.t0       = time()
+
+    def add_callback(self, callback):
+        """
+        Register a function to be called with each event.
+
+        Arguments:
+            :callable callback: function accepting a dictionary
+        """
+        self.callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        """
+        Unregister a callback.
+
+        Arguments:
+            :callable callback: function to be removed
+        """
+        if callback in self.callbacks:
+            self.callbacks.remove(callback)
+
+    def count(self, name, n = 1):
+        """
+        Increment a counter.
+
+        Arguments:
+            :str name: counter name
+            :int n:    increment
+        """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def record(self, stage, duration = None, **fields):
+        """
+        Record an event.
+
+        Arguments:
+            :str stage:       stage name
+            :double duration: duration of the stage [s]
+            :dict fields:     additional fields (numbers or strings)
+        """
+        self.counters[stage] = self.counters.get(stage, 0) + 1
+        if duration is not None:
+            t = self.timings.get(stage)
+            if t is None:
+                self.timings[stage] = [1, duration, duration]
+            else:
+                t[0] += 1
+                t[1] += duration
+                if duration > t[2]:
+                    t[2] = duration
+        if self.stages is not None and stage not in self.stages and not self.callbacks:
+            return
+        event = {'stage': stage, 'time': time() - self.t0, 'duration': duration}
+        event.update(fields)
+        if self.stages is None or stage in self.stages:
+            self.events.append(event)
+        for callback in self.callbacks:
+            callback(event)
+
+    @contextmanager
+    def timer(self, stage, **fields):
+        """
+        Context manager recording the duration of the enclosed block.
+
+        Arguments:
+            :str stage:   stage name
+            :dict fields: additional fields
+        """
+        t0 = perf_counter()
+        yield
+        self.record(stage, perf_counter() - t0, **fields)
+
+    def series(self, stage, field):
+        """
+        Values of a field for the stored events of a given stage (e.g. series('add_new_point', 'alpha')).
+
+        Arguments:
+            :str stage: stage name
+            :str field: field name
+
+        Returns:
+            :np.ndarray: values
+        """
+        return np.array([e[field] for e in self.events if e['stage'] == stage and field in e])
+
+    def summary(self):
+        """
+        Counters and timing statistics for every stage.
+
+        Returns:
+            :dict: counters and timings (count, total, mean and max duration, in seconds)
+        """
+        timings = {stage: {'count': n, 'total': tot, 'mean': tot/n, 'max': tmax} for stage, (n, tot, tmax) in self.timings.items()}
+        return {'elapsed': time() - self.t0, 'counters': dict(self.counters), 'timings': timings}
+
+    def to_json(self, file, events = True):
+        """
+        Export summary and (optionally) stored events to JSON.
+
+        Arguments:
+            :str or Path file: output file
+            :bool events:      include stored events
+        """
+        out = self.summary()
+        if events:
+            out['events'] = list(self.events)
+        with open(Path(file), 'w') as f:
+            json.dump(out, f, indent = 1, default = _to_builtin)
+
+    def to_csv(self, file):
+        """
+        Export stored events to CSV (one row per event, one column per field).
+
+        Arguments:
+            :str or Path file: output file
+        """
+        fields = ['stage', 'time', 'duration']
+        for e in self.events:
+            for key in e.keys():
+                if key not in fields:
+                    fields.append(key)
+        with open(Path(file), 'w', newline = '') as f:
+            writer = csv.DictWriter(f, fieldnames = fields, restval = '')
+            writer.writeheader()
+            for e in self.events:
+                writer.writerow({k: _to_builtin(v) for k, v in e.items()})
+
+def _to_builtin(x):
+    """
+    Converts numpy scalars and arrays to builtin types
+    """
+    if isinstance(x, np.generic):
+        return x.item()
+    if isinstance(x, np.ndarray):
+        return x.tolist()
+    return x
@@ -1,66 +1,30 @@
 import numpy as np
-from itertools import product
 import h5py
 import re
-import warnings
 
-import matplotlib.pyplot as plt
-from matplotlib import rcParams
-import matplotlib.patches as mpatches
-from matplotlib.lines import Line2D
-from corner import corner
-import imageio
-
-from astropy.coordinates import SkyCoord
-from astropy.units import Quantity
-from astropy.io import fits
-from astropy.wcs import WCS
-import pyvo as vo
-import socket
+from types import SimpleNamespace
+from functools import lru_cache
+from time import perf_counter
+from multiprocessing import Pool
 
 from scipy.special import logsumexp
-from scipy.stats import multivariate_normal as mn
-from numba import jit, prange
 import dill
 
 from figaro.mixture import DPGMM
 from figaro.transform import *
-from figaro.coordinates import celestial_to_cartesian, cartesian_to_celestial, inv_Jacobian
-from figaro.credible_regions import ConfidenceArea, ConfidenceVolume, FindNearest, FindLevelForHeight
-from figaro.diagnostic import compute_entropy_single_draw, angular_coefficient
-try:
-    from figaro.cosmology import CosmologicalParameters
-    lal_flag = True
-except ModuleNotFoundError:
-    warnings.warn("LAL is not installed. If provided, galaxy catalog will not be loaded")
-    lal_flag = False
+from figaro.coordinates import celestial_to_cartesian, cartesian_to_celestial, celestial_to_probit
+from figaro.credible_regions import ConfidenceArea, ConfidenceVolume, FindNearest, FindLevelForHeight, RankedMap, SearchedRegions, volume_weights, area_weights
+from figaro.diagnostic import IncrementalEntropy, RunningSlope
+from figaro.catalog import load_glade_cache
+from figaro.renderer import BackgroundRenderer
+from figaro.cache import config_key, load_cached_arrays
+from figaro.plot_settings import pyplot, latex_available
+from figaro.numba_cosmology import get_cosmology
 
 from pathlib import Path
-from distutils.spawn import find_executable
 from tqdm import tqdm
 
-rcParams["xtick.labelsize"]=14
-rcParams["ytick.labelsize"]=14
-rcParams["xtick.direction"]="in"
-rcParams["ytick.direction"]="in"
-rcParams["legend.fontsize"]=15
-rcParams["axes.labelsize"]=16
-rcParams["axes.grid"] = True
-rcParams["grid.alpha"] = 0.6
-
-@jit
-def log_add(x, y):
-     if x >= y:
-        return x+np.log1p(np.exp(y-x))
-     else:
-        return y+np.log1p(np.exp(x-y))
-
-@jit
-def log_add_array(x,y):
-    res = np.zeros(len(x), dtype = np.float64)
-    for i in prange(len(x)):
-        res[i] = log_add(x[i],y[i])
-    return res
+# Plotting (matplotlib, corner, imageio) and Virtual Observatory (astropy, pyvo) modules are imported when the first plot is drawn
 
 # natural sorting.
 # list.sort(key = natural_keys)
@@ -76,6 +40,267 @@ def natural_keys(text):
     '''
     return [ atoi(c) for c in re.split(r'(\d+)', text) ]
 
+def render_skymap(snap):
+    """
+    Draws the skymap from a snapshot (see VolumeReconstruction.make_skymap).
+    
+    Arguments:
+        :SimpleNamespace snap: arrays and settings to plot
+    """
+    import matplotlib.patches as mpatches
+    plt = pyplot({'legend.fontsize': 15, 'text.usetex': snap.usetex})
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    c = ax.contourf(snap.ra_2d, snap.dec_2d, snap.p_skymap.T, 500, cmap = 'Reds')
+    ax.set_rasterization_zorder(-10)
+    c1 = ax.contour(snap.ra_2d, snap.dec_2d, snap.log_p_skymap.T, np.sort(snap.skymap_heights), colors = 'black', linewidths = 0.5, linestyles = 'dashed')
+    if snap.latex:
+        ax.clabel(c1, fmt = {l:'{0:.0f}\\%'.format(100*s) for l,s in zip(c1.levels, snap.levels[::-1])}, fontsize = 5)
+    else:
+        ax.clabel(c1, fmt = {l:'{0:.0f}%'.format(100*s) for l,s in zip(c1.levels, snap.levels[::-1])}, fontsize = 5)
+    for i in range(len(snap.areas)):
+        c1.collections[i].set_label('${0:.0f}\\%'.format(100*snap.levels[-i])+ '\ \mathrm{CR}:'+'{0:.1f}'.format(snap.areas[-i]) + '\ \mathrm{deg}^2$')
+    handles, labels = ax.get_legend_handles_labels()
+    patch = mpatches.Patch(color='grey', label='${0}'.format(snap.n_pts)+'\ \mathrm{samples}$', alpha = 0)
+    handles.append(patch)
+    ax.set_xlabel('$\\alpha$')
+    ax.set_ylabel('$\\delta$')
+    ax.legend(handles = handles, loc = 0, frameon = False, fontsize = 10, handlelength=0, handletextpad=0, markerscale=0)
+    for file in snap.files:
+        fig.savefig(file, bbox_inches = 'tight')
+    plt.close()
+
+def render_volume_map(snap):
+    """
+    Draws the 3D volume maps and the galaxy map from a snapshot (see VolumeReconstruction.make_volume_map).
+    
+    Arguments:
+        :SimpleNamespace snap: arrays and settings to plot
+    """
+    import matplotlib.patches as mpatches
+    plt = pyplot({'legend.fontsize': 15, 'text.usetex': snap.usetex})
+    n_gals = snap.n_gals
+    
+    # Cartesian plot
+    fig = plt.figure()
+    ax = fig.add_subplot(111, projection = '3d')
+    ax.scatter(snap.cat_to_plot_cartesian[:,0], snap.cat_to_plot_cartesian[:,1], snap.cat_to_plot_cartesian[:,2], c = snap.p_cat_to_plot, marker = '.', alpha = 0.7, s = 0.5, cmap = 'Reds')
+    vol_str = ['${0:.0f}\\%'.format(100*snap.levels[-i])+ '\ \mathrm{CR}:'+'{0:.0f}'.format(snap.volumes[-i]) + '\ \mathrm{Mpc}^3$' for i in range(len(snap.volumes))]
+    vol_str = '\n'.join(vol_str + ['$N_{\mathrm{gal}}\ \mathrm{in}\ '+'{0:.0f}\\%'.format(100*snap.levels[np.where(snap.levels == snap.region)][0])+ '\ \mathrm{CR}:'+'{0}$'.format(len(snap.cat_to_plot_cartesian))])
+    ax.text2D(0.05, 0.95, vol_str, transform=ax.transAxes)
+    ax.set_xlabel('$x$')
+    ax.set_ylabel('$y$')
+    ax.set_zlabel('$z$')
+    fig.savefig(snap.cartesian_file, bbox_inches = 'tight')
+    plt.close()
+    
+    # Celestial plot
+    fig = plt.figure()
+    ax = fig.add_subplot(111, projection = '3d')
+    ax.scatter(snap.cat_to_plot_celestial[:,0], snap.cat_to_plot_celestial[:,1], snap.cat_to_plot_celestial[:,2], c = snap.p_cat_to_plot, marker = '.', alpha = 0.7, s = 0.5, cmap = 'Reds')
+    vol_str = ['${0:.0f}\\%'.format(100*snap.levels[-i])+ '\ \mathrm{CR}:'+'{0:.0f}'.format(snap.volumes[-i]) + '\ \mathrm{Mpc}^3$' for i in range(len(snap.volumes))]
+    vol_str = '\n'.join(vol_str + ['$\mathrm{Galaxies}\ \mathrm{in}\ '+'{0:.0f}\\%'.format(100*snap.levels[np.where(snap.levels == snap.region)][0])+ '\ \mathrm{CR}:'+'{0}$'.format(len(snap.cat_to_plot_celestial))])
+    ax.text2D(0.05, 0.95, vol_str, transform=ax.transAxes)
+    ax.set_xlabel('$\\alpha$')
+    ax.set_ylabel('$\\delta$')
+    for file in snap.celestial_files:
+        fig.savefig(file, bbox_inches = 'tight')
+    plt.close()
+    
+    # 2D galaxy plot
+    # Limits for VO image
+    fig_b = plt.figure()
+    ax_b  = fig_b.add_subplot(111)
+    c = ax_b.scatter(snap.sorted_cat[:,0][:-int(n_gals):-1]*180./np.pi, snap.sorted_cat[:,1][:-int(n_gals):-1]*180./np.pi, c = snap.sorted_p_cat_to_plot[:-int(n_gals):-1], marker = '+', cmap = 'coolwarm', linewidths = 1)
+    x_lim = ax_b.get_xlim()
+    y_lim = ax_b.get_ylim()
+    fig = plt.figure()
+    if snap.virtual_observatory:
+        # Download background
+        import socket
+        import pyvo as vo
+        from astropy.coordinates import SkyCoord
+        from astropy.units import Quantity
+        from astropy.io import fits
+        from astropy.wcs import WCS
+        if snap.true_host is not None:
+            pos = SkyCoord(snap.true_host[0]*180./np.pi, snap.true_host[1]*180./np.pi, unit = 'deg')
+        else:
+            pos = SkyCoord((x_lim[1]+x_lim[0])/2., (y_lim[1]+y_lim[0])/2., unit = 'deg')
+        size = (Quantity(4, unit = 'deg'), Quantity(6, unit = 'deg'))
+        ss = vo.regsearch(servicetype='image',waveband='optical', keywords=['SkyView'])[0]
+        sia_results = ss.search(pos=pos, size=size, intersect='overlaps', format='image/fits')
+        urls = [r.getdataurl() for r in sia_results]
+        for attempt in range(10):
+            # Download timeout
+            try:
+                hdu = [fits.open(ff)[0] for ff in urls][0]
+            except socket.timeout:
+                continue
+            else:
+                break
+        wcs = WCS(hdu.header)
+        ax = fig.add_subplot(111, projection=wcs)
+        ax.imshow(hdu.data,cmap = 'gray')
+        ax.set_autoscale_on(False)
+        c = ax.scatter(snap.sorted_cat[:,0][:-int(n_gals):-1]*180./np.pi, snap.sorted_cat[:,1][:-int(n_gals):-1]*180./np.pi, c = snap.sorted_p_cat_to_plot[:-int(n_gals):-1], marker = '+', cmap = 'coolwarm', linewidths = 0.5, transform=ax.get_transform('world'), zorder = 100)
+        c1 = ax.contourf(snap.ra_2d*180./np.pi, snap.dec_2d*180./np.pi, snap.log_p_skymap.T, np.sort(snap.skymap_heights), colors = 'white', linewidths = 0.5, linestyles = 'solid', transform=ax.get_transform('world'), zorder = 99, alpha = 0)
+        if snap.true_host is not None:
+            ax.scatter([snap.true_host[0]*180./np.pi], [snap.true_host[1]*180./np.pi], s=80, facecolors='none', edgecolors='g', label = '$\mathrm{' + snap.host_name + '}$', transform=ax.get_transform('world'), zorder = 101)
+        leg_col = 'white'
+    else:
+        ax = fig.add_subplot(111)
+        c = ax.scatter(snap.sorted_cat[:,0][:-int(n_gals):-1], snap.sorted_cat[:,1][:-int(n_gals):-1], c = snap.sorted_p_cat_to_plot[:-int(n_gals):-1], marker = '+', cmap = 'coolwarm', linewidths = 1)
+        c1 = ax.contour(snap.ra_2d, snap.dec_2d, snap.log_p_skymap.T, np.sort(snap.skymap_heights), colors = 'black', linewidths = 0.5, linestyles = 'solid')
+        if snap.true_host is not None:
+            ax.scatter([snap.true_host[0]], [snap.true_host[1]], s=80, facecolors='none', edgecolors='g', label = '$\mathrm{' + snap.host_name + '}$')
+        leg_col = 'black'
+    for i in range(len(snap.areas)):
+        c1.collections[i].set_label('${0:.0f}\\%'.format(100*snap.levels[-i])+ '\ \mathrm{CR}:'+'{0:.1f}'.format(snap.areas[-i]) + '\ \mathrm{deg}^2$')
+    handles, labels = ax.get_legend_handles_labels()
+    patch = mpatches.Patch(color='grey', label='${0}'.format(len(snap.cat_to_plot_celestial))+'\ \mathrm{galaxies}$', alpha = 0)
+    handles.append(patch)
+    plt.colorbar(c, label = '$p_{host}$')
+    ax.set_xlabel('$\\alpha$')
+    ax.set_ylabel('$\\delta$')
+    ax.legend(handles = handles, loc = 2, frameon = False, fontsize = 10, handlelength=0, labelcolor = leg_col)
+    fig.savefig(snap.galaxies_file, bbox_inches = 'tight')
+    plt.close()
+
+def distance_moments(p_vol, dist, dD):
+    """
+    Marginal sky density and conditional mean and standard deviation of the luminosity distance for each sky pixel.
+    Streaming reduction over the distance axis: one pass over the volume map, no 3D temporaries.
+    
+    Arguments:
+        :np.ndarray p_vol: volume map, shape (n_ra, n_dec, n_dist)
+        :np.ndarray dist:  distance grid
+        :double dD:        distance grid spacing
+    
+    Returns:
+        :np.ndarray: sky density (p_vol marginalised over distance)
+        :np.ndarray: conditional mean of D_L
+        :np.ndarray: conditional standard deviation of D_L
+    """
+    S0 = np.zeros(p_vol.shape[:2], dtype = np.float64)
+    S1 = np.zeros(p_vol.shape[:2], dtype = np.float64)
+    S2 = np.zeros(p_vol.shape[:2], dtype = np.float64)
+    for k, d in enumerate(dist):
+        slab = p_vol[:,:,k]*dD
+        S0  += slab
+        S1  += slab*d
+        S2  += slab*d*d
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        mean = S1/S0
+        std  = np.sqrt(np.maximum(S2/S0 - mean**2, 0.))
+    return S0, mean, std
+
+def grid_axes(max_dist, n_gridpoints):
+    """
+    Right ascension, declination and luminosity distance axes of the evaluation grid.
+    
+    Arguments:
+        :double max_dist:       maximum luminosity distance
+        :iterable n_gridpoints: number of points along each axis (RA, dec, DL)
+    
+    Returns:
+        :np.ndarray: right ascension
+        :np.ndarray: declination
+        :np.ndarray: luminosity distance
+    """
+    ra   = np.linspace(0,2*np.pi, n_gridpoints[0])
+    dec  = np.linspace(-np.pi/2*0.99, np.pi/2.*0.99, n_gridpoints[1])
+    dist = np.linspace(max_dist*0.01, max_dist*0.99, n_gridpoints[2])
+    return ra, dec, dist
+
+def build_grid(max_dist, n_gridpoints, dtype = np.float64):
+    """
+    Builds the evaluation grid in celestial, cartesian and probit coordinates and the corresponding Jacobian.
+    
+    Arguments:
+        :double max_dist:       maximum luminosity distance
+        :iterable n_gridpoints: number of points along each axis (RA, dec, DL)
+        :type dtype:            dtype of the cartesian and probit grids and of the Jacobians (np.float64 or np.float32)
+    
+    Returns:
+        :dict: grid, cartesian_grid, probit_grid, log_inv_J, inv_J
+    """
+    ra, dec, dist  = grid_axes(max_dist, n_gridpoints)
+    bounds         = np.array([[-max_dist, max_dist] for _ in range(3)])
+    # Same ordering as itertools.product(ra, dec, dist)
+    grid           = np.stack(np.meshgrid(ra, dec, dist, indexing = 'ij'), axis = -1).reshape(-1, 3)
+    cartesian_grid, probit_grid, log_inv_J = celestial_to_probit(grid, bounds, dtype = dtype)
+    return {'grid': grid, 'cartesian_grid': cartesian_grid, 'probit_grid': probit_grid, 'log_inv_J': log_inv_J, 'inv_J': np.exp(log_inv_J)}
+
+def grid_cache_key(max_dist, n_gridpoints, dtype = np.float64):
+    return config_key(product = 'grid', max_dist = max_dist, n_gridpoints = list(n_gridpoints), dtype = np.dtype(dtype).name)
+
+@lru_cache(maxsize = 2)
+def _load_grid(max_dist, n_gridpoints, grid_cache_folder = None, dtype = np.float64):
+    """
+    Grid for a density file, kept in memory for the following files with the same configuration.
+    """
+    if grid_cache_folder is None:
+        return build_grid(max_dist, n_gridpoints, dtype)
+    return load_cached_arrays(grid_cache_folder, grid_cache_key(max_dist, n_gridpoints, dtype), lambda: build_grid(max_dist, n_gridpoints, dtype))
+
+def searched_regions_from_density(density_file, hosts, n_gridpoints = [720, 360, 100], grid_cache_folder = None, dtype = np.float64):
+    """
+    Credible levels, searched areas and searched volumes of a set of hosts for a density saved by VolumeReconstruction.save_density.
+    The maps are evaluated and ranked once, then every host is processed in a single vectorised pass (see figaro.credible_regions.SearchedRegions).
+    
+    Arguments:
+        :str or Path density_file:     dill file with the reconstructed density (mixture instance)
+        :np.ndarray hosts:             host positions (ra, dec, D), shape (n_hosts, 3)
+        :iterable n_gridpoints:        number of points along each axis (RA, dec, DL)
+        :str or Path grid_cache_folder: folder with memory-mapped grids (see figaro.cache). Default: grid built in memory
+        :type dtype:                    precision of the grid and of the maps (np.float64 or np.float32)
+    
+    Returns:
+        :dict: pixel indices, CR, CV, searched_area, searched_volume
+    """
+    with open(density_file, 'rb') as f:
+        mix = dill.load(f)
+    mix.dtype     = dtype
+    max_dist      = mix.bounds[0][1]
+    ra, dec, dist = grid_axes(max_dist, n_gridpoints)
+    dD, dra, ddec = np.diff(dist)[0], np.diff(ra)[0], np.diff(dec)[0]
+    grid          = _load_grid(max_dist, tuple(n_gridpoints), grid_cache_folder, dtype)
+    
+    p_vol  = mix._evaluate_mixture_in_probit(grid['probit_grid']) * grid['inv_J']
+    p_vol  = (p_vol/float(np.sum(p_vol, dtype = np.float64)*dD*dra*ddec)).reshape(len(ra), len(dec), len(dist))
+    with np.errstate(divide = 'ignore'):
+        log_p_vol    = np.log(p_vol)
+        log_p_skymap = np.log(np.sum(p_vol, axis = -1, dtype = np.float64)*dD)
+    
+    idx, CR, CV, areas, volumes = SearchedRegions(log_p_skymap, log_p_vol, ra, dec, dist, hosts)
+    return {'pixel_idx': idx, 'CR': CR, 'CV': CV, 'searched_area': areas, 'searched_volume': volumes}
+
+def _searched_regions_worker(args):
+    return searched_regions_from_density(*args)
+
+def batch_searched_regions(density_files, hosts, n_gridpoints = [720, 360, 100], grid_cache_folder = None, n_parallel = 1, dtype = np.float64):
+    """
+    Searched areas and volumes for many saved densities (e.g. injection campaigns), one density per process.
+    When a grid cache folder is given, the grid is built once and memory-mapped by every worker.
+    
+    Arguments:
+        :iterable density_files:        dill files with the reconstructed densities
+        :iterable hosts:                host positions for each density file, each with shape (n_hosts, 3)
+        :iterable n_gridpoints:         number of points along each axis (RA, dec, DL)
+        :str or Path grid_cache_folder: folder with memory-mapped grids (see figaro.cache)
+        :int n_parallel:                number of processes
+        :type dtype:                    precision of the grid and of the maps (np.float64 or np.float32)
+    
+    Returns:
+        :list: dictionaries returned by searched_regions_from_density, in the same order as density_files
+    """
+    tasks = [(f, h, list(n_gridpoints), grid_cache_folder, dtype) for f, h in zip(density_files, hosts)]
+    if n_parallel == 1:
+        return [_searched_regions_worker(t) for t in tasks]
+    with Pool(n_parallel) as pool:
+        return pool.map(_searched_regions_worker, tasks, chunksize = 1)
+
 class VolumeReconstruction(DPGMM):
     def __init__(self, max_dist,
                        out_folder          = '.',
@@ -99,40 +324,52 @@ class VolumeReconstruction(DPGMM):
                        entropy_ac_step     = 500,
                        n_sign_changes      = 5,
                        virtual_observatory = False,
+                       glade_cache_folder  = None,
+                       background_plots    = False,
+                       render_queue_size   = 4,
+                       grid_cache_folder   = None,
+                       distance_summary    = False,
+                       telemetry           = None,
+                       dtype               = np.float64,
                        ):
                 
         self.max_dist = max_dist
         bounds = np.array([[-max_dist, max_dist] for _ in range(3)])
         self.volume_already_evaluated = False
         
-        super().__init__(bounds, prior_pars, alpha0)
+        super().__init__(bounds, prior_pars, alpha0, telemetry = telemetry, dtype = dtype)
         
+        self.incr_plot = incr_plot
         if incr_plot:
             self.next_plot = 20
         else:
             self.next_plot = np.inf
             
-        if latex:
-            if find_executable('latex'):
-                rcParams["text.usetex"] = True
-        self.latex = latex
+        self.latex  = latex
+        self.usetex = latex and latex_available()
         
         # Grid
-        self.ra   = np.linspace(0,2*np.pi, n_gridpoints[0])
-        self.dec  = np.linspace(-np.pi/2*0.99, np.pi/2.*0.99, n_gridpoints[1])
-        self.dist = np.linspace(max_dist*0.01, max_dist*0.99, n_gridpoints[2])
+        self.n_gridpoints = n_gridpoints
+        self.ra, self.dec, self.dist = grid_axes(max_dist, n_gridpoints)
         self.dD   = np.diff(self.dist)[0]
         self.dra  = np.diff(self.ra)[0]
         self.ddec = np.diff(self.dec)[0]
-        self.grid = np.array([np.array(v) for v in product(*(self.ra,self.dec,self.dist))])
-        self.grid2d = np.array([np.array(v) for v in product(*(self.ra,self.dec))])
+        self.grid2d = np.stack(np.meshgrid(self.ra, self.dec, indexing = 'ij'), axis = -1).reshape(-1, 2)
         self.ra_2d, self.dec_2d = np.meshgrid(self.ra, self.dec)
-        self.cartesian_grid = celestial_to_cartesian(self.grid)
-        self.probit_grid = transform_to_probit(self.cartesian_grid, self.bounds)
-
-        # Jacobians
-        self.log_inv_J = -np.log(inv_Jacobian(self.grid)) - probit_logJ(self.probit_grid, self.bounds)
-        self.inv_J = np.exp(self.log_inv_J)
+        # Pixel measures for credible regions
+        self.volume_weights = volume_weights(self.ra, self.dec, self.dist)
+        self.area_weights   = area_weights(self.ra, self.dec)
+        # Grid and Jacobians are shared (memory-mapped) among instances with the same configuration
+        self.grid_cache_folder = grid_cache_folder
+        if self.grid_cache_folder is None:
+            grid = self._build_grid()
+        else:
+            grid = load_cached_arrays(self.grid_cache_folder, grid_cache_key(self.max_dist, n_gridpoints, self.dtype), self._build_grid)
+        self.grid           = grid['grid']
+        self.cartesian_grid = grid['cartesian_grid']
+        self.probit_grid    = grid['probit_grid']
+        self.log_inv_J      = grid['log_inv_J']
+        self.inv_J          = grid['inv_J']
         
         # True host
         if true_host is not None:
@@ -159,27 +396,35 @@ class VolumeReconstruction(DPGMM):
         # Catalog
         self.catalog   = None
         self.cat_bound = cat_bound
-        if lal_flag and glade_file is not None and self.max_dist < self.cat_bound:
-            self.cosmology = CosmologicalParameters(cosmology['h'], cosmology['om'], cosmology['ol'], 1, 0)
+        self.glade_cache_folder = glade_cache_folder
+        if glade_file is not None and self.max_dist < self.cat_bound:
+            self.cosmology = get_cosmology(cosmology['h'], cosmology['om'], cosmology['ol'], 1, 0)
             self.load_glade(glade_file)
-            self.cartesian_catalog = celestial_to_cartesian(self.catalog)
-            self.probit_catalog    = transform_to_probit(self.cartesian_catalog, self.bounds)
-            self.log_inv_J_cat     = -np.log(inv_Jacobian(self.catalog)) - probit_logJ(self.probit_catalog, self.bounds)
-            self.inv_J_cat         = np.exp(self.log_inv_J)
+            if self.grid_cache_folder is None:
+                cat = self._build_catalog_transforms()
+            else:
+                key = config_key(product = 'catalog', glade_cache = self.glade_cache.folder.name, max_dist = self.max_dist, n_gal = self.n_gal, dtype = np.dtype(self.dtype).name)
+                cat = load_cached_arrays(self.grid_cache_folder, key, self._build_catalog_transforms)
+            self.cartesian_catalog = cat['cartesian_catalog']
+            self.probit_catalog    = cat['probit_catalog']
+            self.log_inv_J_cat     = cat['log_inv_J_cat']
+            self.inv_J_cat         = cat['inv_J_cat']
         self.n_gal_to_plot = n_gal_to_plot
         if region_to_plot in self.levels:
             self.region = region_to_plot
         else:
             self.region = self.levels[0]
         self.virtual_observatory = virtual_observatory
+        self.distance_summary    = distance_summary
         
-        # Entropy
+        # Entropy: the incremental estimator caches 8*K^2*100 bytes of cross terms (K clusters) up to 300 clusters, ~80 MB at most
         self.entropy         = entropy
         self.entropy_step    = entropy_step
         self.entropy_ac_step = entropy_ac_step
-        self.N_for_ac        = np.arange(self.entropy_ac_step)*self.entropy_step
         self.R_S             = []
         self.ac              = []
+        self.entropy_estimator = IncrementalEntropy()
+        self.entropy_slope     = RunningSlope(self.entropy_ac_step, step = self.entropy_step)
         self.n_sign_changes  = n_sign_changes
         
         # Output
@@ -187,6 +432,45 @@ class VolumeReconstruction(DPGMM):
         self.labels     = labels
         self.out_folder = Path(out_folder).resolve()
         self.make_folders()
+        
+        # Plots are drawn in a separate process while sampling continues
+        if background_plots:
+            self.renderer = BackgroundRenderer(max_queue = render_queue_size)
+        else:
+            self.renderer = None
+    
+    def close(self):
+        """
+        Renders pending plots and stops the rendering process (if any).
+        """
+        if self.renderer is not None:
+            self.renderer.close()
+            self.renderer = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+    
+    def _build_grid(self):
+        """
+        Builds the evaluation grid in celestial, cartesian and probit coordinates and the corresponding Jacobian.
+        
+        Returns:
+            :dict: grid, cartesian_grid, probit_grid, log_inv_J, inv_J
+        """
+        return build_grid(self.max_dist, self.n_gridpoints, self.dtype)
+    
+    def _build_catalog_transforms(self):
+        """
+        Transforms the catalog in cartesian and probit coordinates and computes the corresponding Jacobian.
+        
+        Returns:
+            :dict: cartesian_catalog, probit_catalog, log_inv_J_cat, inv_J_cat
+        """
+        cartesian_catalog, probit_catalog, log_inv_J_cat = celestial_to_probit(self.catalog, self.bounds, dtype = self.dtype)
+        return {'cartesian_catalog': cartesian_catalog, 'probit_catalog': probit_catalog, 'log_inv_J_cat': log_inv_J_cat, 'inv_J_cat': np.exp(log_inv_J_cat)}
     
     def initialise(self, true_host = None):
         self.volume_already_evaluated = False
@@ -194,12 +478,16 @@ class VolumeReconstruction(DPGMM):
         self.true_host   = true_host
         self.R_S         = []
         self.ac          = []
+        self.entropy_estimator.initialise()
+        self.entropy_slope.initialise()
         self.areas_N     = {cr:[] for cr in self.levels}
         self.volumes_N   = {cr:[] for cr in self.levels}
         self.N           = []
         self.flag_skymap = True
         if self.entropy == True:
             self.flag_skymap = False
+        if self.incr_plot:
+            self.next_plot = 20
         if self.true_host is not None:
             self.pixel_idx  = FindNearest(self.ra, self.dec, self.dist, self.true_host)
             self.true_pixel = np.array([self.ra[self.pixel_idx[0]], self.dec[self.pixel_idx[1]], self.dist[self.pixel_idx[2]]])
@@ -207,21 +495,28 @@ class VolumeReconstruction(DPGMM):
     def load_glade(self, glade_file):
         """
         This is tailored to GLADE+ available on March 28th at http://glade.elte.hu - compatibility with more recent versions is not ensured.
+        The catalog is read from a distance-sorted cache (built on first use, see figaro.catalog): only galaxies within max_dist are loaded.
         """
         self.glade_header =  ' '.join(['ra', 'dec', 'z', 'm_B', 'm_K', 'm_W1', 'm_bJ', 'logp'])
-        with h5py.File(glade_file, 'r') as f:
-            ra  = np.array(f['ra'])
-            dec = np.array(f['dec'])
-            z   = np.array(f['z'])
-            B   = np.array(f['m_B'])
-            K   = np.array(f['m_K'])
-            W1  = np.array(f['m_W1'])
-            bJ  = np.array(f['m_bJ'])
-        DL = self.cosmology.LuminosityDistance(z)
-        catalog = np.array([ra, dec, DL]).T
-        self.catalog = catalog[catalog[:,2] < self.max_dist]
-        catalog_with_mag = np.array([ra, dec, z, B, K, W1, bJ]).T
-        self.catalog_with_mag = catalog_with_mag[catalog[:,2] < self.max_dist]
+        self.glade_cache  = load_glade_cache(glade_file, self.cosmology, cache_folder = self.glade_cache_folder)
+        self.n_gal        = self.glade_cache.n_within(self.max_dist)
+        self.catalog      = self.glade_cache.load(['ra', 'dec', 'DL'], self.n_gal)
+
+    def _catalog_with_mag(self, idx = None):
+        """
+        Reads redshift and magnitudes of the selected galaxies from the catalog cache.
+
+        Arguments:
+            :np.ndarray idx: indices of the galaxies in self.catalog. Default: all
+
+        Returns:
+            :np.ndarray: ra, dec, z, m_B, m_K, m_W1, m_bJ
+        """
+        return self.glade_cache.load(['ra', 'dec', 'z', 'm_B', 'm_K', 'm_W1', 'm_bJ'], self.n_gal, idx = idx)
+
+    @property
+    def catalog_with_mag(self):
+        return self._catalog_with_mag()
 
     def make_folders(self):
         if not Path(self.out_folder, 'skymaps').exists():
@@ -255,20 +550,6 @@ class VolumeReconstruction(DPGMM):
         if not self.entropy_folder.exists():
             self.entropy_folder.mkdir()
 
-    # Overwrites parent method to avoid memory issues in 3D grid or catalog evaluation
-    def _evaluate_mixture_in_probit(self, x):
-        p = np.zeros(len(x))
-        for comp, wi in zip(self.mixture, self.w):
-            p += wi*mn(comp.mu, comp.sigma).pdf(x)
-        return p
-    
-    # Overwrites parent method to avoid memory issues in 3D grid or catalog evaluation
-    def _evaluate_log_mixture_in_probit(self, x):
-        p = -np.ones(len(x))*np.inf
-        for comp, wi in zip(self.mixture, self.log_w):
-            p = log_add_array(p, wi + mn(comp.mu, comp.sigma).logpdf(x))
-        return p
-
     def add_sample(self, x):
         self.volume_already_evaluated = False
         cart_x = celestial_to_cartesian(x)
@@ -284,6 +565,8 @@ class VolumeReconstruction(DPGMM):
         return cartesian_to_celestial(samples)
     
     def plot_samples(self, n_samps, initial_samples = None):
+        from corner import corner
+        plt = pyplot({'legend.fontsize': 15, 'text.usetex': self.usetex})
         mix_samples = self.sample_from_volume(n_samps)
         if initial_samples is not None:
             if self.true_host is not None:
@@ -297,25 +580,42 @@ class VolumeReconstruction(DPGMM):
         plt.savefig(Path(self.skymap_folder, 'corner_'+self.name+'.pdf'), bbox_inches = 'tight')
         plt.close()
     
+    def _evaluate_volume(self):
+        """
+        Evaluates the mixture on the grid (volume map), unless already done for the current number of samples.
+        """
+        if self.volume_already_evaluated:
+            return
+        if self.telemetry is not None:
+            t0 = perf_counter()
+        p_vol               = self._evaluate_mixture_in_probit(self.probit_grid) * self.inv_J
+        # Normalisation accumulated in double precision
+        self.norm_p_vol     = np.sum(p_vol, dtype = np.float64)*self.dD*self.dra*self.ddec
+        self.log_norm_p_vol = np.log(self.norm_p_vol)
+        # Python floats keep the precision of the map
+        self.p_vol          = p_vol/float(self.norm_p_vol)
+        
+        # By default computes log(p_vol). If -infs are present, computes log_p_vol
+        with np.errstate(divide='raise'):
+            try:
+                self.log_p_vol = np.log(self.p_vol)
+            except FloatingPointError:
+                self.log_p_vol = self._evaluate_log_mixture_in_probit(self.probit_grid) + self.log_inv_J - float(self.log_norm_p_vol)
+                
+        self.p_vol     = self.p_vol.reshape(len(self.ra), len(self.dec), len(self.dist))
+        self.log_p_vol = self.log_p_vol.reshape(len(self.ra), len(self.dec), len(self.dist))
+        self.volume_already_evaluated = True
+        if self.telemetry is not None:
+            self.telemetry.record('evaluate_volume', perf_counter() - t0, n_pts = self.n_pts, n_cl = self.n_cl, n_grid = len(self.probit_grid))
+    
     def evaluate_skymap(self):
-        if not self.volume_already_evaluated:
-            p_vol               = self._evaluate_mixture_in_probit(self.probit_grid) * self.inv_J
-            self.norm_p_vol     = (p_vol*self.dD*self.dra*self.ddec).sum()
-            self.log_norm_p_vol = np.log(self.norm_p_vol)
-            self.p_vol          = p_vol/self.norm_p_vol
-            
-            # By default computes log(p_vol). If -infs are present, computes log_p_vol
-            with np.errstate(divide='raise'):
-                try:
-                    self.log_p_vol = np.log(self.p_vol)
-                except FloatingPointError:
-                    self.log_p_vol = self._evaluate_log_mixture_in_probit(self.probit_grid) + self.log_inv_J - self.log_norm_p_vol
-                    
-            self.p_vol     = self.p_vol.reshape(len(self.ra), len(self.dec), len(self.dist))
-            self.log_p_vol = self.log_p_vol.reshape(len(self.ra), len(self.dec), len(self.dist))
-            self.volume_already_evaluated = True
-
-        self.p_skymap = (self.p_vol*self.dD).sum(axis = -1)
+        self._evaluate_volume()
+        if self.telemetry is not None:
+            t0 = perf_counter()
+        if self.distance_summary:
+            self.p_skymap, self.distmean, self.diststd = distance_moments(self.p_vol, self.dist, self.dD)
+        else:
+            self.p_skymap = np.sum(self.p_vol, axis = -1, dtype = np.float64)*self.dD
         
         # By default computes log(p_skymap). If -infs are present, computes log_p_skymap
         with np.errstate(divide='raise'):
@@ -324,42 +624,40 @@ class VolumeReconstruction(DPGMM):
             except FloatingPointError:
                 self.log_p_skymap = logsumexp(self.log_p_vol + np.log(self.dD), axis = -1)
 
-        self.areas, self.skymap_idx_CR, self.skymap_heights = ConfidenceArea(self.log_p_skymap, self.ra, self.dec, adLevels = self.levels)
+        # Ranked once, shared by credible areas and host credible level
+        self.ranked_skymap = RankedMap(self.log_p_skymap, max_level = np.max(self.levels))
+        self.areas, self.skymap_idx_CR, self.skymap_heights = ConfidenceArea(self.ranked_skymap, self.ra, self.dec, adLevels = self.levels, weights = self.area_weights)
         for cr, area in zip(self.levels, self.areas):
             self.areas_N[cr].append(area)
+        if self.telemetry is not None:
+            self.telemetry.record('evaluate_skymap', perf_counter() - t0, n_pts = self.n_pts, areas = self.areas.tolist())
     
     def evaluate_volume_map(self):
-        if not self.volume_already_evaluated:
-            p_vol               = self._evaluate_mixture_in_probit(self.probit_grid) * self.inv_J
-            self.norm_p_vol     = (p_vol*self.dD*self.dra*self.ddec).sum()
-            self.log_norm_p_vol = np.log(self.norm_p_vol)
-            self.p_vol          = p_vol/self.norm_p_vol
-            
-            # By default, just uses log(p_vol). If -infs are present, computes log_p_vol
-            with np.errstate(divide='raise'):
-                try:
-                    self.log_p_vol = np.log(self.p_vol)
-                except FloatingPointError:
-                    self.log_p_vol = self._evaluate_log_mixture_in_probit(self.probit_grid) + self.log_inv_J - self.log_norm_p_vol
-
-            self.p_vol     = self.p_vol.reshape(len(self.ra), len(self.dec), len(self.dist))
-            self.log_p_vol = self.log_p_vol.reshape(len(self.ra), len(self.dec), len(self.dist))
-            self.volume_already_evaluated = True
-            
-        self.volumes, self.idx_CR, self.volume_heights = ConfidenceVolume(self.log_p_vol, self.ra, self.dec, self.dist, adLevels = self.levels)
+        self._evaluate_volume()
+        if self.telemetry is not None:
+            t0 = perf_counter()
+        self.ranked_volume = RankedMap(self.log_p_vol, max_level = np.max(self.levels))
+        self.volumes, self.idx_CR, self.volume_heights = ConfidenceVolume(self.ranked_volume, self.ra, self.dec, self.dist, adLevels = self.levels, weights = self.volume_weights)
         
         for cr, vol in zip(self.levels, self.volumes):
             self.volumes_N[cr].append(vol)
+        if self.telemetry is not None:
+            self.telemetry.record('evaluate_volume_map', perf_counter() - t0, n_pts = self.n_pts, volumes = self.volumes.tolist())
     
     def compute_credible_regions(self):
         self.log_p_vol_host    = self.log_p_vol[self.pixel_idx[0],self.pixel_idx[1],self.pixel_idx[2]]
         self.log_p_skymap_host = self.log_p_skymap[self.pixel_idx[0], self.pixel_idx[1]]
         
-        self.CR_host           = FindLevelForHeight(self.log_p_skymap, self.log_p_skymap_host)
-        self.CV_host           = FindLevelForHeight(self.log_p_vol, self.log_p_vol_host)
+        _, CR, CV, areas, volumes = SearchedRegions(self.ranked_skymap, self.ranked_volume, self.ra, self.dec, self.dist, self.true_host, area_w = self.area_weights, volume_w = self.volume_weights)
+        self.CR_host              = CR[0]
+        self.CV_host              = CV[0]
+        self.searched_area        = areas[0]
+        self.searched_volume      = volumes[0]
         
     
     def evaluate_catalog(self, final_map = False):
+        if self.telemetry is not None:
+            t0 = perf_counter()
         log_p_cat                  = self._evaluate_log_mixture_in_probit(self.probit_catalog) + self.log_inv_J_cat - self.log_norm_p_vol
         self.log_p_cat_to_plot     = log_p_cat[np.where(log_p_cat > self.volume_heights[np.where(self.levels == self.region)])]
         self.p_cat_to_plot         = np.exp(self.log_p_cat_to_plot)
@@ -367,38 +665,67 @@ class VolumeReconstruction(DPGMM):
         self.cat_to_plot_cartesian = self.cartesian_catalog[np.where(log_p_cat > self.volume_heights[np.where(self.levels == self.region)])]
         
         self.sorted_cat = np.c_[self.cat_to_plot_celestial[np.argsort(self.log_p_cat_to_plot)], np.sort(self.log_p_cat_to_plot)][::-1]
-        self.sorted_cat_to_txt = np.c_[self.catalog_with_mag[np.where(log_p_cat > self.volume_heights[np.where(self.levels == self.region)])][np.argsort(self.log_p_cat_to_plot)], np.sort(self.log_p_cat_to_plot)][::-1]
+        self.sorted_cat_to_txt = np.c_[self._catalog_with_mag(np.where(log_p_cat > self.volume_heights[np.where(self.levels == self.region)])[0])[np.argsort(self.log_p_cat_to_plot)], np.sort(self.log_p_cat_to_plot)][::-1]
         self.sorted_p_cat_to_plot = np.sort(self.p_cat_to_plot)[::-1]
         np.savetxt(Path(self.catalog_folder, self.name+'_{0}'.format(self.n_pts)+'.txt'), self.sorted_cat_to_txt, header = self.glade_header)
         if final_map:
             np.savetxt(Path(self.catalog_folder, 'CR_'+self.name+'.txt'), np.array([self.areas[np.where(self.levels == self.region)], self.volumes[np.where(self.levels == self.region)]]).T, header = 'area volume')
+        if self.telemetry is not None:
+            self.telemetry.record('evaluate_catalog', perf_counter() - t0, n_pts = self.n_pts, n_gal = len(self.probit_catalog), n_gal_in_region = len(self.log_p_cat_to_plot))
     
+    def _render(self, func, snapshot, final_map = False):
+        """
+        Draws a plot, either directly or in the background rendering process.
+        Intermediate snapshots are skipped if the rendering queue is full, final maps are always drawn.
+
+        Arguments:
+            :callable func:           plotting function
+            :SimpleNamespace snapshot: arrays and settings needed by func
+            :bool final_map:          final map flag
+        """
+        if self.renderer is None:
+            func(snapshot)
+        else:
+            self.renderer.submit(func, snapshot, block = final_map)
+
     def make_skymap(self, final_map = False):
         self.evaluate_skymap()
-        fig = plt.figure()
-        ax = fig.add_subplot(111)
-        c = ax.contourf(self.ra_2d, self.dec_2d, self.p_skymap.T, 500, cmap = 'Reds')
-        ax.set_rasterization_zorder(-10)
-        c1 = ax.contour(self.ra_2d, self.dec_2d, self.log_p_skymap.T, np.sort(self.skymap_heights), colors = 'black', linewidths = 0.5, linestyles = 'dashed')
-        if self.latex:
-            ax.clabel(c1, fmt = {l:'{0:.0f}\\%'.format(100*s) for l,s in zip(c1.levels, self.levels[::-1])}, fontsize = 5)
-        else:
-            ax.clabel(c1, fmt = {l:'{0:.0f}%'.format(100*s) for l,s in zip(c1.levels, self.levels[::-1])}, fontsize = 5)
-        for i in range(len(self.areas)):
-            c1.collections[i].set_label('${0:.0f}\\%'.format(100*self.levels[-i])+ '\ \mathrm{CR}:'+'{0:.1f}'.format(self.areas[-i]) + '\ \mathrm{deg}^2$')
-        handles, labels = ax.get_legend_handles_labels()
-        patch = mpatches.Patch(color='grey', label='${0}'.format(self.n_pts)+'\ \mathrm{samples}$', alpha = 0)
-        handles.append(patch)
-        ax.set_xlabel('$\\alpha$')
-        ax.set_ylabel('$\\delta$')
-        ax.legend(handles = handles, loc = 0, frameon = False, fontsize = 10, handlelength=0, handletextpad=0, markerscale=0)
         if final_map:
-            fig.savefig(Path(self.skymap_folder, self.name+'_all.pdf'), bbox_inches = 'tight')
-            fig.savefig(Path(self.gif_folder, self.name+'_all.png'), bbox_inches = 'tight')
+            label = 'all'
         else:
-            fig.savefig(Path(self.skymap_folder, self.name+'_{0}'.format(self.n_pts)+'.pdf'), bbox_inches = 'tight')
-            fig.savefig(Path(self.gif_folder, self.name+'_{0}'.format(self.n_pts)+'.png'), bbox_inches = 'tight')
-        plt.close()
+            label = '{0}'.format(self.n_pts)
+        snapshot = SimpleNamespace(ra_2d          = self.ra_2d,
+                                   dec_2d         = self.dec_2d,
+                                   p_skymap       = np.array(self.p_skymap),
+                                   log_p_skymap   = np.array(self.log_p_skymap),
+                                   skymap_heights = np.array(self.skymap_heights),
+                                   levels         = self.levels,
+                                   areas          = np.array(self.areas),
+                                   n_pts          = self.n_pts,
+                                   latex          = self.latex,
+                                   usetex         = self.usetex,
+                                   files          = [Path(self.skymap_folder, self.name+'_'+label+'.pdf'), Path(self.gif_folder, self.name+'_'+label+'.png')],
+                                   )
+        self._render(render_skymap, snapshot, final_map)
+        if self.distance_summary:
+            self.save_distance_summary(Path(self.skymap_folder, self.name+'_'+label+'_distance.h5'))
+    
+    def save_distance_summary(self, file):
+        """
+        Saves the per-pixel distance summary (probability, conditional mean and standard deviation of D_L) in a HDF5 file (float32).
+        Requires evaluate_skymap to be called with distance_summary = True.
+        
+        Arguments:
+            :str or Path file: output file
+        """
+        with h5py.File(file, 'w') as f:
+            f.create_dataset('ra', data = self.ra.astype(np.float32))
+            f.create_dataset('dec', data = self.dec.astype(np.float32))
+            f.create_dataset('prob', data = (self.p_skymap*self.dra*self.ddec).astype(np.float32))
+            f.create_dataset('distmean', data = self.distmean.astype(np.float32))
+            f.create_dataset('diststd', data = self.diststd.astype(np.float32))
+            f.attrs['n_pts']    = self.n_pts
+            f.attrs['max_dist'] = self.max_dist
     
     def make_volume_map(self, final_map = False, n_gals = 100):
         self.evaluate_volume_map()
@@ -406,98 +733,36 @@ class VolumeReconstruction(DPGMM):
             return
             
         self.evaluate_catalog(final_map)
-        
-        # Cartesian plot
-        fig = plt.figure()
-        ax = fig.add_subplot(111, projection = '3d')
-        ax.scatter(self.cat_to_plot_cartesian[:,0], self.cat_to_plot_cartesian[:,1], self.cat_to_plot_cartesian[:,2], c = self.p_cat_to_plot, marker = '.', alpha = 0.7, s = 0.5, cmap = 'Reds')
-        vol_str = ['${0:.0f}\\%'.format(100*self.levels[-i])+ '\ \mathrm{CR}:'+'{0:.0f}'.format(self.volumes[-i]) + '\ \mathrm{Mpc}^3$' for i in range(len(self.volumes))]
-        vol_str = '\n'.join(vol_str + ['$N_{\mathrm{gal}}\ \mathrm{in}\ '+'{0:.0f}\\%'.format(100*self.levels[np.where(self.levels == self.region)][0])+ '\ \mathrm{CR}:'+'{0}$'.format(len(self.cat_to_plot_cartesian))])
-        ax.text2D(0.05, 0.95, vol_str, transform=ax.transAxes)
-        ax.set_xlabel('$x$')
-        ax.set_ylabel('$y$')
-        ax.set_zlabel('$z$')
         if final_map:
-            fig.savefig(Path(self.volume_folder, self.name+'_cartesian_all.pdf'), bbox_inches = 'tight')
+            label = 'all'
         else:
-            fig.savefig(Path(self.volume_folder, self.name+'_cartesian_{0}'.format(self.n_pts)+'.pdf'), bbox_inches = 'tight')
-        plt.close()
-        
-        # Celestial plot
-        fig = plt.figure()
-        ax = fig.add_subplot(111, projection = '3d')
-        ax.scatter(self.cat_to_plot_celestial[:,0], self.cat_to_plot_celestial[:,1], self.cat_to_plot_celestial[:,2], c = self.p_cat_to_plot, marker = '.', alpha = 0.7, s = 0.5, cmap = 'Reds')
-        vol_str = ['${0:.0f}\\%'.format(100*self.levels[-i])+ '\ \mathrm{CR}:'+'{0:.0f}'.format(self.volumes[-i]) + '\ \mathrm{Mpc}^3$' for i in range(len(self.volumes))]
-        vol_str = '\n'.join(vol_str + ['$\mathrm{Galaxies}\ \mathrm{in}\ '+'{0:.0f}\\%'.format(100*self.levels[np.where(self.levels == self.region)][0])+ '\ \mathrm{CR}:'+'{0}$'.format(len(self.cat_to_plot_celestial))])
-        ax.text2D(0.05, 0.95, vol_str, transform=ax.transAxes)
-        ax.set_xlabel('$\\alpha$')
-        ax.set_ylabel('$\\delta$')
-        if final_map:
-            fig.savefig(Path(self.volume_folder, self.name+'_all.pdf'), bbox_inches = 'tight')
-            fig.savefig(Path(self.gif_folder, '3d_'+self.name+'_all.png'), bbox_inches = 'tight')
-        else:
-            fig.savefig(Path(self.volume_folder, self.name+'_{0}'.format(self.n_pts)+'.pdf'), bbox_inches = 'tight')
-            fig.savefig(Path(self.gif_folder, '3d_'+self.name+'_{0}'.format(self.n_pts)+'.png'), bbox_inches = 'tight')
-        plt.close()
-        
-        # 2D galaxy plot
-        # Limits for VO image
-        fig_b = plt.figure()
-        ax_b  = fig_b.add_subplot(111)
-        c = ax_b.scatter(self.sorted_cat[:,0][:-int(n_gals):-1]*180./np.pi, self.sorted_cat[:,1][:-int(n_gals):-1]*180./np.pi, c = self.sorted_p_cat_to_plot[:-int(n_gals):-1], marker = '+', cmap = 'coolwarm', linewidths = 1)
-        x_lim = ax_b.get_xlim()
-        y_lim = ax_b.get_ylim()
-        fig = plt.figure()
-        if self.virtual_observatory:
-            # Download background
-            if self.true_host is not None:
-                pos = SkyCoord(self.true_host[0]*180./np.pi, self.true_host[1]*180./np.pi, unit = 'deg')
-            else:
-                pos = SkyCoord((x_lim[1]+x_lim[0])/2., (y_lim[1]+y_lim[0])/2., unit = 'deg')
-            size = (Quantity(4, unit = 'deg'), Quantity(6, unit = 'deg'))
-            ss = vo.regsearch(servicetype='image',waveband='optical', keywords=['SkyView'])[0]
-            sia_results = ss.search(pos=pos, size=size, intersect='overlaps', format='image/fits')
-            urls = [r.getdataurl() for r in sia_results]
-            for attempt in range(10):
-                # Download timeout
-                try:
-                    hdu = [fits.open(ff)[0] for ff in urls][0]
-                except socket.timeout:
-                    continue
-                else:
-                    break
-            wcs = WCS(hdu.header)
-            ax = fig.add_subplot(111, projection=wcs)
-            ax.imshow(hdu.data,cmap = 'gray')
-            ax.set_autoscale_on(False)
-            c = ax.scatter(self.sorted_cat[:,0][:-int(n_gals):-1]*180./np.pi, self.sorted_cat[:,1][:-int(n_gals):-1]*180./np.pi, c = self.sorted_p_cat_to_plot[:-int(n_gals):-1], marker = '+', cmap = 'coolwarm', linewidths = 0.5, transform=ax.get_transform('world'), zorder = 100)
-            c1 = ax.contourf(self.ra_2d*180./np.pi, self.dec_2d*180./np.pi, self.log_p_skymap.T, np.sort(self.skymap_heights), colors = 'white', linewidths = 0.5, linestyles = 'solid', transform=ax.get_transform('world'), zorder = 99, alpha = 0)
-            if self.true_host is not None:
-                ax.scatter([self.true_host[0]*180./np.pi], [self.true_host[1]*180./np.pi], s=80, facecolors='none', edgecolors='g', label = '$\mathrm{' + self.host_name + '}$', transform=ax.get_transform('world'), zorder = 101)
-            leg_col = 'white'
-        else:
-            ax = fig.add_subplot(111)
-            c = ax.scatter(self.sorted_cat[:,0][:-int(n_gals):-1], self.sorted_cat[:,1][:-int(n_gals):-1], c = self.sorted_p_cat_to_plot[:-int(n_gals):-1], marker = '+', cmap = 'coolwarm', linewidths = 1)
-            c1 = ax.contour(self.ra_2d, self.dec_2d, self.log_p_skymap.T, np.sort(self.skymap_heights), colors = 'black', linewidths = 0.5, linestyles = 'solid')
-            if self.true_host is not None:
-                ax.scatter([self.true_host[0]], [self.true_host[1]], s=80, facecolors='none', edgecolors='g', label = '$\mathrm{' + self.host_name + '}$')
-            leg_col = 'black'
-        for i in range(len(self.areas)):
-            c1.collections[i].set_label('${0:.0f}\\%'.format(100*self.levels[-i])+ '\ \mathrm{CR}:'+'{0:.1f}'.format(self.areas[-i]) + '\ \mathrm{deg}^2$')
-        handles, labels = ax.get_legend_handles_labels()
-        patch = mpatches.Patch(color='grey', label='${0}'.format(len(self.cat_to_plot_celestial))+'\ \mathrm{galaxies}$', alpha = 0)
-        handles.append(patch)
-        plt.colorbar(c, label = '$p_{host}$')
-        ax.set_xlabel('$\\alpha$')
-        ax.set_ylabel('$\\delta$')
-        ax.legend(handles = handles, loc = 2, frameon = False, fontsize = 10, handlelength=0, labelcolor = leg_col)
-        if final_map:
-            fig.savefig(Path(self.skymap_folder, 'galaxies_'+self.name+'_all.pdf'), bbox_inches = 'tight')
-        else:
-            fig.savefig(Path(self.skymap_folder, 'galaxies_'+self.name+'_{0}'.format(self.n_pts)+'.pdf'), bbox_inches = 'tight')
-        plt.close()
+            label = '{0}'.format(self.n_pts)
+        snapshot = SimpleNamespace(cat_to_plot_cartesian = self.cat_to_plot_cartesian,
+                                   cat_to_plot_celestial = self.cat_to_plot_celestial,
+                                   p_cat_to_plot         = self.p_cat_to_plot,
+                                   sorted_cat            = self.sorted_cat,
+                                   sorted_p_cat_to_plot  = self.sorted_p_cat_to_plot,
+                                   volumes               = np.array(self.volumes),
+                                   areas                 = np.array(self.areas),
+                                   levels                = self.levels,
+                                   region                = self.region,
+                                   n_gals                = n_gals,
+                                   ra_2d                 = self.ra_2d,
+                                   dec_2d                = self.dec_2d,
+                                   log_p_skymap          = np.array(self.log_p_skymap),
+                                   skymap_heights        = np.array(self.skymap_heights),
+                                   true_host             = self.true_host,
+                                   host_name             = self.host_name,
+                                   virtual_observatory   = self.virtual_observatory,
+                                   usetex                = self.usetex,
+                                   cartesian_file        = Path(self.volume_folder, self.name+'_cartesian_'+label+'.pdf'),
+                                   celestial_files       = [Path(self.volume_folder, self.name+'_'+label+'.pdf'), Path(self.gif_folder, '3d_'+self.name+'_'+label+'.png')],
+                                   galaxies_file         = Path(self.skymap_folder, 'galaxies_'+self.name+'_'+label+'.pdf'),
+                                   )
+        self._render(render_volume_map, snapshot, final_map)
         
     def make_gif(self):
+        import imageio
         files = [f for f in self.gif_folder.glob('3d_'+self.name + '*' + '.png')]
         if len(files) > 1:
             path_files = [str(f) for f in files]
@@ -518,6 +783,7 @@ class VolumeReconstruction(DPGMM):
         [f.unlink() for f in files]
     
     def make_entropy_plot(self):
+        plt = pyplot({'legend.fontsize': 15, 'text.usetex': self.usetex})
         fig, ax = plt.subplots()
         ax.plot(np.arange(len(self.R_S))*self.entropy_step, np.abs(self.R_S), color = 'steelblue', lw = 0.7)
         ax.set_ylabel('$S(N)\ [\mathrm{bits}]$')
@@ -541,6 +807,7 @@ class VolumeReconstruction(DPGMM):
             dill.dump(density, dill_file)
     
     def volume_N_plot(self):
+        plt = pyplot({'legend.fontsize': 15, 'text.usetex': self.usetex})
         
         output = [self.N]
         header = 'N '
@@ -576,10 +843,15 @@ class VolumeReconstruction(DPGMM):
             self.add_sample(samples[i])
             if self.entropy:
                 if i%self.entropy_step == 0:
-                    R_S = compute_entropy_single_draw(self)
+                    if self.telemetry is not None:
+                        t0 = perf_counter()
+                    R_S = self.entropy_estimator.compute_entropy(self)
+                    if self.telemetry is not None:
+                        self.telemetry.record('entropy', perf_counter() - t0, n_pts = self.n_pts, n_cl = self.n_cl, entropy = R_S)
                     self.R_S.append(R_S)
+                    self.entropy_slope.add(R_S)
                     if self.n_pts//self.entropy_ac_step >= 1:
-                        ac = angular_coefficient(self.N_for_ac + self.n_pts, self.R_S[-self.entropy_ac_step:])
+                        ac = self.entropy_slope.slope()
                         if self.flag_skymap == False:
                             try:
                                 if ac*self.ac[-1] < 0:
@@ -602,6 +874,8 @@ class VolumeReconstruction(DPGMM):
         self.plot_samples(self.n_pts, initial_samples = samples)
         self.make_skymap(final_map = True)
         self.make_volume_map(final_map = True, n_gals = self.n_gal_to_plot)
+        if self.renderer is not None:
+            self.renderer.flush()
         self.make_gif()
         self.volume_N_plot()
         if self.entropy:
@@ -1,50 +1,285 @@
 from __future__ import division
 import numpy as np
-from scipy.special import erfinv, erf
+import math
+from functools import lru_cache
+from numba import njit
 
 log2PI = np.log(2.0*np.pi)
 
 """
-Scipy's implementation of ERF: https://docs.scipy.org/doc/scipy/reference/generated/scipy.special.erf.html
-See notes there for cumulative of the unit normal distribution.
+Probit transformation: t(x) = cdf^-1_normal((x-x_min)/(x_max - x_min)), with cdf_normal the cumulative distribution function of the unit normal distribution.
+Transforms are instances of ProbitTransform, built once per set of bounds (probit_transform) and evaluated with compiled kernels that read and write each array once.
+The inverse normal cdf (ndtri) uses algorithm AS241 (Wichura, 1988, https://www.jstor.org/stable/2347330), accurate to double precision, and the cdf uses math.erfc.
+The transform functions below (transform_to_probit, transform_from_probit, probit_logJ) are kept for backward compatibility.
 """
 
+SQRT2 = math.sqrt(2.0)
+
+@njit(cache = True, nogil = True)
+def ndtri(p):
+    """
+    Inverse of the cumulative distribution function of the unit normal distribution (algorithm AS241, PPND16).
+    Returns -inf (inf) for p = 0 (1) and nan outside [0,1], as scipy.special.ndtri.
+
+    Arguments:
+        :double p: probability
+
+    Returns:
+        :double: quantile
+    """
+    if not (p >= 0.0 and p <= 1.0):
+        return np.nan
+    if p == 0.0:
+        return -np.inf
+    if p == 1.0:
+        return np.inf
+    q = p - 0.5
+    if abs(q) <= 0.425:
+        r = 0.180625 - q*q
+        return q*(((((((r*2509.0809287301226727 + 33430.575583588128105)*r + 67265.770927008700853)*r + 45921.953931549871457)*r + 13731.693765509461125)*r + 1971.5909503065514427)*r + 133.14166789178437745)*r + 3.387132872796366608)/ \
+                 (((((((r*5226.495278852545925 + 28729.085735721942674)*r + 39307.89580009271061)*r + 21213.794301586595867)*r + 5394.1960214247511077)*r + 687.1870074920579083)*r + 42.313330701600911252)*r + 1.0)
+    r = math.sqrt(-math.log(min(p, 1.0 - p)))
+    if r <= 5.0:
+        r -= 1.6
+        x = (((((((r*7.7454501427834140764e-4 + 0.0227238449892691845833)*r + 0.24178072517745061177)*r + 1.27045825245236838258)*r + 3.64784832476320460504)*r + 5.7694972214606914055)*r + 4.6303378461565452959)*r + 1.42343711074968357734)/ \
+            (((((((r*1.05075007164441684324e-9 + 5.475938084995344946e-4)*r + 0.0151986665636164571966)*r + 0.14810397642748007459)*r + 0.68976733498510000455)*r + 1.6763848301838038494)*r + 2.05319162663775882187)*r + 1.0)
+    else:
+        r -= 5.0
+        x = (((((((r*2.01033439929228813265e-7 + 2.71155556874348757815e-5)*r + 0.0012426609473880784386)*r + 0.026532189526576123093)*r + 0.29656057182850489123)*r + 1.7848265399172913358)*r + 5.4637849111641143699)*r + 6.6579046435011037772)/ \
+            (((((((r*2.04426310338993978564e-15 + 1.4215117583164458887e-7)*r + 1.8463183175100546818e-5)*r + 7.868691311456132591e-4)*r + 0.0148753612908506148525)*r + 0.13692988092273580531)*r + 0.59983220655588793769)*r + 1.0)
+    if q < 0.0:
+        return -x
+    return x
+
+@njit(cache = True, nogil = True)
+def ndtr(x):
+    """
+    Cumulative distribution function of the unit normal distribution.
+
+    Arguments:
+        :double x: quantile
+
+    Returns:
+        :double: probability
+    """
+    return 0.5*math.erfc(-x/SQRT2)
+
+# Kernels on flattened arrays: the i-th element belongs to dimension i % d
+
+@njit(cache = True, nogil = True)
+def _to_probit(x, lo, scale, out):
+    d = len(lo)
+    for i in range(len(x)):
+        out[i] = ndtri((x[i] - lo[i % d])/scale[i % d])
+
+@njit(cache = True, nogil = True)
+def _from_probit(t, lo, scale, out):
+    d = len(lo)
+    for i in range(len(t)):
+        out[i] = lo[i % d] + scale[i % d]*ndtr(t[i])
+
+@njit(cache = True, nogil = True)
+def _logJ(t, k, const, out):
+    for i in range(len(out)):
+        s = 0.0
+        for j in range(k):
+            s += t[i*k+j]**2
+        out[i] = const - 0.5*s
+
+@njit(cache = True, nogil = True)
+def _to_probit_logJ(x, lo, scale, k, const, out, logJ):
+    d = len(lo)
+    for i in range(len(logJ)):
+        s = 0.0
+        for j in range(k):
+            n      = i*k+j
+            t      = ndtri((x[n] - lo[n % d])/scale[n % d])
+            out[n] = t
+            s     += t*t
+        logJ[i] = const - 0.5*s
+
+class ProbitTransform:
+    """
+    Probit transformation for a given set of bounds, with offsets, scales and log-volume computed once.
+    Methods accept arrays of shape (..., dim) (or any shape if dim = 1) and an optional out array.
+    Computations are in double precision. Outputs are single precision if the input is, double precision otherwise (unless out is given).
+
+    Arguments:
+        :np.ndarray bounds: boundaries of the rectangle over which the distribution is defined. It should be in the format [[xmin, xmax],[ymin, ymax],...]
+
+    Returns:
+        :ProbitTransform: instance of ProbitTransform class
+    """
+    def __init__(self, bounds):
+        self.bounds     = np.array(bounds, dtype = np.float64).reshape(-1, 2)
+        self.dim        = len(self.bounds)
+        self.lo         = np.ascontiguousarray(self.bounds[:,0])
+        self.scale      = np.ascontiguousarray(self.bounds[:,1] - self.bounds[:,0])
+        self.log_scale  = np.log(self.scale)
+        self.log_volume = np.sum(self.log_scale)
+
+    def _flatten(self, x):
+        """
+        Broadcasts x against the bounds and flattens it (single or double precision).
+
+        Returns:
+            :np.ndarray: flattened array
+            :tuple:      broadcast shape
+        """
+        if not (isinstance(x, np.ndarray) and x.ndim > 0 and (x.shape[-1] == self.dim or self.dim == 1)):
+            x = np.asarray(x)
+            x = np.broadcast_to(x, np.broadcast_shapes(x.shape, (self.dim,)))
+        if x.dtype != np.float32:
+            x = np.ascontiguousarray(x, dtype = np.float64)
+        else:
+            x = np.ascontiguousarray(x)
+        return x.reshape(-1), x.shape
+
+    @staticmethod
+    def _output(shape, dtype, out):
+        """
+        Output array (out, if given) and its flattened view.
+        """
+        if out is None:
+            out = np.empty(shape, dtype = dtype)
+        elif out.shape != tuple(shape) or not out.flags.c_contiguous:
+            raise ValueError("out must be a C-contiguous array of shape {0}".format(tuple(shape)))
+        return out.reshape(-1), out
+
+    def _logJ_const(self, shape):
+        """
+        Constant part of the log-Jacobian of a point of shape[-1] coordinates.
+        """
+        k = shape[-1]
+        if self.dim > 1:
+            return k, -0.5*k*log2PI - self.log_volume
+        return k, -k*(0.5*log2PI + self.log_scale[0])
+
+    @staticmethod
+    def _return(out):
+        if out.ndim == 0:
+            return out[()]
+        return out
+
+    def to_probit(self, x, out = None):
+        """
+        Coordinate change into probit space.
+        WARNING: returns NAN if x is not in [xmin, xmax].
+
+        Arguments:
+            :np.ndarray x:   point(s) to transform
+            :np.ndarray out: output array (optional)
+
+        Returns:
+            :np.ndarray: point(s) in probit space
+        """
+        x_flat, shape = self._flatten(x)
+        out_flat, out = self._output(shape, x_flat.dtype, out)
+        _to_probit(x_flat, self.lo, self.scale, out_flat)
+        return out
+
+    def from_probit(self, t, out = None):
+        """
+        Coordinate change from probit to natural space.
+
+        Arguments:
+            :np.ndarray t:   point(s) to antitransform
+            :np.ndarray out: output array (optional)
+
+        Returns:
+            :np.ndarray: point(s) in natural space
+        """
+        t_flat, shape = self._flatten(t)
+        out_flat, out = self._output(shape, t_flat.dtype, out)
+        _from_probit(t_flat, self.lo, self.scale, out_flat)
+        return out
+
+    def logJ(self, t, out = None):
+        """
+        Log-Jacobian of the probit transformation (natural to probit), as a function of the probit coordinates: log|dx/dt| summed over the last axis.
+
+        Arguments:
+            :np.ndarray t:   point(s) in probit space
+            :np.ndarray out: output array (optional)
+
+        Returns:
+            :np.ndarray: log-Jacobian
+        """
+        t_flat, shape = self._flatten(t)
+        k, const      = self._logJ_const(shape)
+        out_flat, out = self._output(shape[:-1], t_flat.dtype, out)
+        _logJ(t_flat, k, const, out_flat)
+        return self._return(out)
+
+    def to_probit_logJ(self, x, out = None, out_logJ = None):
+        """
+        Coordinate change into probit space and log-Jacobian at the transformed point(s), in a single pass.
+        Equivalent to t = self.to_probit(x); self.logJ(t).
+
+        Arguments:
+            :np.ndarray x:        point(s) to transform
+            :np.ndarray out:      output array for the transformed point(s) (optional)
+            :np.ndarray out_logJ: output array for the log-Jacobian (optional)
+
+        Returns:
+            :np.ndarray: point(s) in probit space
+            :np.ndarray: log-Jacobian
+        """
+        x_flat, shape        = self._flatten(x)
+        k, const             = self._logJ_const(shape)
+        out_flat, out        = self._output(shape, x_flat.dtype, out)
+        logJ_flat, out_logJ  = self._output(shape[:-1], x_flat.dtype, out_logJ)
+        _to_probit_logJ(x_flat, self.lo, self.scale, k, const, out_flat, logJ_flat)
+        return out, self._return(out_logJ)
+
+@lru_cache(maxsize = 128)
+def _cached_transform(key, shape):
+    return ProbitTransform(np.frombuffer(key, dtype = np.float64).reshape(shape))
+
+def probit_transform(bounds):
+    """
+    ProbitTransform for a set of bounds, built once per distinct bounds and then reused.
+
+    Arguments:
+        :np.ndarray bounds: boundaries of the rectangle over which the distribution is defined. It should be in the format [[xmin, xmax],[ymin, ymax],...]
+
+    Returns:
+        :ProbitTransform: transform
+    """
+    bounds = np.ascontiguousarray(bounds, dtype = np.float64)
+    return _cached_transform(bounds.tobytes(), bounds.shape)
+
 def transform_to_probit(x, bounds):
     '''
     Coordinate change into probit space.
     cdf_normal is the cumulative distribution function of the unit normal distribution.
     WARNING: returns NAN if x is not in [xmin, xmax].
-    
+
     t(x) = cdf^-1_normal((x-x_min)/(x_max - x_min))
 
-    
+
     Arguments:
         :float or np.ndarray samples: sample(s) to transform
-        
+
     Returns:
         :float or np.ndarray: sample(s)
     '''
-    cdf = (x - bounds[:,0])/(bounds[:,1]-bounds[:,0])
-    o = np.sqrt(2.0)*erfinv(2*cdf-1)
-    return o
+    return probit_transform(bounds).to_probit(x)
 
 def transform_from_probit(x, bounds):
     '''
     Coordinate change from probit to natural space.
     cdf_normal is the cumulative distribution function of the unit normal distribution.
-    
+
     x(t) = xmin + (xmax-xmin)*cdf_normal(t|0,1)
-    
+
     Arguments:
         :float or np.ndarray samples: sample(s) to antitransform
-        
+
     Returns:
         :float or np.ndarray: sample(s)
     '''
-    cdf = 0.5*(1.0+erf(x/np.sqrt(2.0)))
-    o = bounds[:,0]+(bounds[:,1]-bounds[:,0])*cdf
-    return o
+    return probit_transform(bounds).from_probit(x)
 
 def probit_logJ(x, bounds):
-    res = np.sum(-0.5*x**2-0.5*log2PI-np.log(bounds[:,1]-bounds[:,0]), axis = -1)
-    return res
+    return probit_transform(bounds).logJ(x)
@@ -1,22 +1,10 @@
 import numpy as np
-import matplotlib.pyplot as plt
+import sys
 import warnings
 from pathlib import Path
-from distutils.spawn import find_executable
-from matplotlib import rcParams
-from corner import corner
 from collections import Counter
 
-if find_executable('latex'):
-    rcParams["text.usetex"] = True
-rcParams["xtick.labelsize"]=14
-rcParams["ytick.labelsize"]=14
-rcParams["xtick.direction"]="in"
-rcParams["ytick.direction"]="in"
-rcParams["legend.fontsize"]=12
-rcParams["axes.labelsize"]=16
-rcParams["axes.grid"] = True
-rcParams["grid.alpha"] = 0.6
+from figaro.plot_settings import pyplot, latex_available
 
 #-------------#
 #   Options   #
@@ -60,6 +48,7 @@ def save_options(options):
 #-------------#
 
 def plot_median_cr(draws, injected = None, samples = None, bounds = None, out_folder = '.', name = 'density', n_pts = 1000, label = None, unit = None, hierarchical = False, show = False, save = True):
+    plt = pyplot({'legend.fontsize': 12, 'text.usetex': latex_available()})
     
     if hierarchical:
         rec_label = '\mathrm{(H)DPGMM}'
@@ -134,6 +123,8 @@ def plot_median_cr(draws, injected = None, samples = None, bounds = None, out_fo
         np.savetxt(Path(out_folder, 'prob_{0}.txt'.format(name)), np.array([x, p[50], p[5], p[16], p[84], p[95]]).T, header = 'x 50 5 16 84 95')
 
 def plot_multidim(draws, dim, samples = None, out_folder = '.', name = 'density', labels = None, units = None, hierarchical = False, show = False, save = True):
+    from corner import corner
+    plt = pyplot({'legend.fontsize': 12, 'text.usetex': latex_available()})
 
     if hierarchical:
         rec_label = '\mathrm{(H)DPGMM}'
@@ -1,21 +1,25 @@
 import numpy as np
 
 import optparse as op
+import sys
 import configparser
 import json
-import dill
 import importlib
 
 from pathlib import Path
 from tqdm import tqdm
 
-from figaro.mixture import DPGMM, HDPGMM
-from figaro.transform import transform_to_probit
+from figaro.mixture import HDPGMM
 from figaro.utils import save_options, plot_median_cr, plot_multidim
 from figaro.load import load_data
+from figaro.batch import run_single_events, single_event_keys, completed_events, list_samples_files, check_unique_names, event_name, draws_file, save_draws, load_draws, seed_everything
+from figaro.exceptions import except_hook
 
 def main():
 
+    # FIGARO-specific hints for known improper usages
+    sys.excepthook = except_hook
+
     parser = op.OptionParser()
     # Input/output
     parser.add_option("-i", "--input", type = "string", dest = "samples_folder", help = "Folder with single-event samples files")
@@ -29,12 +33,18 @@ def main():
     parser.add_option("--symbol", type = "string", dest = "symbol", help = "LaTeX-style quantity symbol, for plotting purposes", default = None)
     parser.add_option("--unit", type = "string", dest = "unit", help = "LaTeX-style quantity unit, for plotting purposes", default = None)
     parser.add_option("--hier_samples", type = "string", dest = "true_vals", help = "Samples from hierarchical distribution (true single-event values, for simulations only)", default = None)
+    parser.add_option("--no_se_plots", dest = "se_plots", action = 'store_false', help = "Do not plot the single-event reconstructions", default = True)
     # Settings
     parser.add_option("--draws", type = "int", dest = "n_draws", help = "Number of draws for hierarchical distribution", default = 100)
     parser.add_option("--se_draws", type = "int", dest = "n_se_draws", help = "Number of draws for single-event distribution. Default: same as hierarchical distribution", default = None)
     parser.add_option("--n_samples_dsp", type = "int", dest = "n_samples_dsp", help = "Number of samples to analyse (downsampling). Default: all", default = -1)
     parser.add_option("--cosmology", type = "string", dest = "cosmology", help = "Cosmological parameters (h, om, ol). Default values from Planck (2021)", default = '0.674,0.315,0.685')
     parser.add_option("-e", "--events", dest = "run_events", action = 'store_false', help = "Run single-event analysis", default = True)
+    parser.add_option("--n_parallel", type = "int", dest = "n_parallel", help = "Number of processes reading the samples files and running the single-event analyses", default = 1)
+    parser.add_option("--seed", type = "int", dest = "seed", help = "Random seed. Default: not fixed", default = None)
+    parser.add_option("--resume", dest = "resume", action = 'store_true', help = "Skip the events already reconstructed with the same samples file and settings (see manifest.json in the draws folder)", default = False)
+    parser.add_option("--overwrite", dest = "resume", action = 'store_false', help = "Reconstruct every event again (default)")
+    parser.add_option("--no_cache", dest = "cache", action = 'store_false', help = "Do not use the binary cache of parsed samples files", default = True)
 
     (options, args) = parser.parse_args()
 
@@ -85,7 +95,7 @@ def main():
     save_options(options)
     
     # Load samples
-    events, names = load_data(options.samples_folder, par = options.par, n_samples = options.n_samples_dsp, h = options.h, om = options.om, ol = options.ol)
+    events, names = load_data(options.samples_folder, par = options.par, n_samples = options.n_samples_dsp, h = options.h, om = options.om, ol = options.ol, n_parallel = options.n_parallel, cache = options.cache)
     try:
         dim = np.shape(events[0][0])[-1]
     except IndexError:
@@ -101,47 +111,47 @@ def main():
         else:
             units = options.unit
     
+    def plot_event(draws, ev, name):
+        if dim == 1:
+            plot_median_cr(draws, injected = inj_density, samples = ev, out_folder = output_plots, name = name, label = options.symbol, unit = options.unit)
+        else:
+            plot_multidim(draws, dim, samples = ev, out_folder = output_plots, name = name, labels = symbols, units = units)
+    
     # Reconstruction
     if not options.postprocess:
+        # Single-event keys: samples file (size, modification time) and settings
+        files = list_samples_files(options.samples_folder)
+        try:
+            check_unique_names(files)
+        except ValueError as e:
+            print(e)
+            exit()
+        files = {event_name(f): f for f in files}
+        keys  = single_event_keys(names, [files[name] for name in names], options.bounds, n_draws = options.n_se_draws, seed = options.seed, settings = {'par': options.par, 'n_samples': options.n_samples_dsp, 'cosmology': [options.h, options.om, options.ol]})
         if options.run_events:
-            mix = DPGMM(options.bounds)
-            posteriors = []
-            # Run each single-event analysis
-            for i in tqdm(range(len(events)), desc = 'Events'):
-                ev   = events[i]
-                name = names[i]
-                # Variance prior from samples
-                probit_samples = transform_to_probit(ev, options.bounds)
-                sigma = (np.std(probit_samples)/5)**2
-                mix.initialise(prior_pars = (1e-1, np.identity(dim)*sigma, dim, np.zeros(dim)))
-                # Draw samples
-                draws = []
-                for _ in range(options.n_se_draws):
-                    np.random.shuffle(ev)
-                    mix.density_from_samples(ev)
-                    draws.append(mix.build_mixture())
-                    mix.initialise()
-                posteriors.append(draws)
-                # Make plots
-                if dim == 1:
-                    plot_median_cr(draws, injected = inj_density, samples = ev, out_folder = output_plots, name = name, label = options.symbol, unit = options.unit)
-                else:
-                    plot_multidim(draws, dim, samples = ev, out_folder = output_plots, name = name, labels = symbols, units = units)
-                # Save single-event draws
-                with open(Path(output_pkl, 'draws_'+name+'.pkl'), 'wb') as f:
-                    dill.dump(np.array(draws), f)
+            # Run the single-event analyses (one event per process). Draws are stored as soon as each event is done. With --resume, events completed with the same key are skipped
+            n_done = len(completed_events(names, output_pkl, keys)) if options.resume else 0
+            if n_done > 0:
+                print("Skipping {0} completed event(s)".format(n_done))
+            samples_dict = dict(zip(names, events))
+            for name in tqdm(run_single_events(events, names, keys, options.bounds, output_pkl, n_draws = options.n_se_draws, n_parallel = options.n_parallel, seed = options.seed, resume = options.resume), total = len(names) - n_done, desc = 'Events'):
+                # Plots are made here, while the workers keep running
+                if options.se_plots:
+                    plot_event(load_draws(draws_file(output_pkl, name)), samples_dict[name], name)
             # Save all single-event draws together
-            posteriors = np.array(posteriors)
-            with open(Path(output_pkl, 'posteriors_single_event.pkl'), 'wb') as f:
-                dill.dump(posteriors, f)
+            posteriors = np.array([load_draws(draws_file(output_pkl, name)) for name in names])
+            save_draws(posteriors, Path(output_pkl, 'posteriors_single_event.pkl'))
         else:
             # Load pre-computed posteriors
             try:
-                with open(Path(output_pkl, 'posteriors_single_event.pkl'), 'rb') as f:
-                    draws = dill.load(f)
+                posteriors = load_draws(Path(output_pkl, 'posteriors_single_event.pkl'))
             except FileNotFoundError:
-                print("No posteriors_single_event.pkl file found. Please provide it or re-run the single-event inference")
-                exit()
+                if len(completed_events(names, output_pkl, keys)) < len(names):
+                    print("No posteriors_single_event.pkl file found. Please provide it or re-run the single-event inference")
+                    exit()
+                posteriors = np.array([load_draws(draws_file(output_pkl, name)) for name in names])
+        if options.seed is not None:
+            seed_everything(options.seed)
         mix = HDPGMM(options.bounds)
         draws = []
         # Run hierarchical analysis
@@ -151,15 +161,18 @@ def main():
             draws.append(mix.build_mixture())
             mix.initialise()
         draws = np.array(draws)
-        with open(Path(output_pkl, 'draws_'+options.h_name+'.pkl'), 'wb') as f:
-            dill.dump(draws, f)
+        save_draws(draws, Path(output_pkl, 'draws_'+options.h_name+'.pkl'))
     else:
         try:
-            with open(Path(output_pkl, 'draws_'+options.h_name+'.pkl'), 'rb') as f:
-                draws = dill.load(f)
+            draws = load_draws(Path(output_pkl, 'draws_'+options.h_name+'.pkl'))
         except FileNotFoundError:
             print("No draws_{0}.pkl file found. Please provide it or re-run the inference".format(options.h_name))
             exit()
+        # Single-event plots
+        if options.se_plots:
+            for name, ev in zip(names, events):
+                if draws_file(output_pkl, name).exists():
+                    plot_event(load_draws(draws_file(output_pkl, name)), ev, name)
     # Plot
     if dim == 1:
         plot_median_cr(draws, injected = inj_density, samples = true_vals, out_folder = output_plots, name = options.h_name, label = options.symbol, unit = options.unit)
@@ -1,6 +1,7 @@
 import numpy as np
 
 import optparse as op
+import sys
 import configparser
 import json
 import dill
@@ -11,13 +12,64 @@ from tqdm import tqdm
 
 from figaro.mixture import DPGMM
 from figaro.utils import save_options, plot_median_cr, plot_multidim
-from figaro.load import load_single_event
+from figaro.load import load_single_event, SampleStream
+from figaro.batch import list_samples_files, check_unique_names, run_density_batch, read_manifest, load_draws
+from figaro.exceptions import except_hook
+
+def plot_draws(draws, samples, dim, options, out_folder, name, inj_density = None):
+    if dim == 1:
+        plot_median_cr(draws, injected = inj_density, samples = samples, out_folder = out_folder, name = name, label = options.symbol, unit = options.unit)
+    else:
+        if options.symbol is not None:
+            symbols = options.symbol.split(',')
+        else:
+            symbols = options.symbol
+        if options.unit is not None:
+            units = options.unit.split(',')
+        else:
+            units = options.unit
+        plot_multidim(draws, dim, samples = samples, out_folder = out_folder, name = name, labels = symbols, units = units)
+
+def run_batch(options, inj_density = None):
+    # Batch mode: draws are stored in output/draws (one .npz file per event, see figaro.batch), plots are made in postprocessing only
+    output_draws = Path(options.output, 'draws')
+    if not output_draws.exists():
+        output_draws.mkdir()
+    output_plots = Path(options.output, 'plots')
+    if not output_plots.exists():
+        output_plots.mkdir()
+    if not options.postprocess:
+        files = list_samples_files(options.samples_file)
+        try:
+            check_unique_names(files)
+        except ValueError as e:
+            print(e)
+            exit()
+        # Files already reconstructed with the same settings are skipped
+        n_new = 0
+        for name in tqdm(run_density_batch(files, options.bounds, output_draws, n_draws = options.n_draws, par = options.par, n_samples = options.n_samples_dsp, h = options.h, om = options.om, ol = options.ol, chunk_size = options.chunk_size, n_parallel = options.n_parallel, seed = options.seed), desc = 'Events'):
+            n_new += 1
+        print("{0} new reconstruction(s), {1} file(s) skipped. Draws stored in {2}. Run with -p to make the plots".format(n_new, len(files) - n_new, output_draws))
+    else:
+        manifest = read_manifest(output_draws)
+        if len(manifest) == 0:
+            print("No manifest.json file found in {0}. Please re-run the inference".format(output_draws))
+            exit()
+        for name in tqdm(sorted(manifest.keys()), desc = 'Plots'):
+            draws = load_draws(Path(output_draws, manifest[name]['draws']))
+            n_samples = options.n_plot_samples if options.n_samples_dsp == -1 else min(options.n_plot_samples, options.n_samples_dsp)
+            samples, _ = load_single_event(manifest[name]['file'], par = options.par, n_samples = n_samples, h = options.h, om = options.om, ol = options.ol)
+            plot_draws(draws, samples, draws[0].dim, options, output_plots, name, inj_density = inj_density)
 
 def main():
 
+    # FIGARO-specific hints for known improper usages
+    sys.excepthook = except_hook
+
     parser = op.OptionParser()
     # Input/output
-    parser.add_option("-i", "--input", type = "string", dest = "samples_file", help = "File with samples")
+    parser.add_option("-i", "--input", type = "string", dest = "samples_file", help = "File with samples, or folder with samples files (batch mode)")
+    parser.add_option("--batch", dest = "batch", action = 'store_true', help = "Batch mode: the input is a folder with samples files or a text file listing samples files (one per line). Implied if the input is a folder", default = False)
     parser.add_option("-b", "--bounds", type = "string", dest = "bounds", help = "Density bounds. Must be a string formatted as '[[xmin, xmax], [ymin, ymax],...]'. For 1D distributions use '[[xmin, xmax]]'", default = None)
     parser.add_option("-o", "--output", type = "string", dest = "output", help = "Output folder. Default: same directory as samples", default = None)
     parser.add_option("--inj_density", type = "string", dest = "inj_density_file", help = "Python module with injected density - please name the method 'density'", default = None)
@@ -30,11 +82,17 @@ def main():
     parser.add_option("--draws", type = "int", dest = "n_draws", help = "Number of draws", default = 100)
     parser.add_option("--n_samples_dsp", type = "int", dest = "n_samples_dsp", help = "Number of samples to analyse (downsampling). Default: all", default = -1)
     parser.add_option("--cosmology", type = "string", dest = "cosmology", help = "Cosmological parameters (h, om, ol). Default values from Planck (2021)", default = '0.674,0.315,0.685')
+    parser.add_option("--chunk_size", type = "int", dest = "chunk_size", help = "Stream the samples from a memory-mapped file in shuffled chunks of this size instead of loading them in memory (for very large files). Default: no streaming", default = None)
+    parser.add_option("--n_plot_samples", type = "int", dest = "n_plot_samples", help = "Number of samples shown in plots when streaming or in batch mode", default = 100000)
+    parser.add_option("--n_parallel", type = "int", dest = "n_parallel", help = "Number of processes (batch mode)", default = 1)
+    parser.add_option("--seed", type = "int", dest = "seed", help = "Random seed (batch mode). Default: not fixed", default = None)
 
     (options, args) = parser.parse_args()
 
     # Paths
     options.samples_file = Path(options.samples_file).resolve()
+    if options.samples_file.is_dir():
+        options.batch = True
     if options.output is not None:
         options.output = Path(options.output).resolve()
         if not options.output.exists():
@@ -62,12 +120,22 @@ def main():
 
     save_options(options)
     
+    if options.batch:
+        run_batch(options, inj_density)
+        return
+    
     # Load samples
-    samples, name = load_single_event(options.samples_file, par = options.par, n_samples = options.n_samples_dsp, h = options.h, om = options.om, ol = options.ol)
-    try:
-        dim = np.shape(samples[0])[-1]
-    except IndexError:
-        dim = 1
+    if options.chunk_size is not None:
+        stream  = SampleStream(options.samples_file, chunk_size = options.chunk_size, par = options.par, n_samples = options.n_samples_dsp, h = options.h, om = options.om, ol = options.ol)
+        name    = stream.name
+        dim     = stream.dim
+        samples = stream.subsample(options.n_plot_samples)
+    else:
+        samples, name = load_single_event(options.samples_file, par = options.par, n_samples = options.n_samples_dsp, h = options.h, om = options.om, ol = options.ol)
+        try:
+            dim = np.shape(samples[0])[-1]
+        except IndexError:
+            dim = 1
     
     # Reconstruction
     if not options.postprocess:
@@ -75,8 +143,13 @@ def main():
         draws = []
         
         for _ in tqdm(range(options.n_draws), desc = name):
-            np.random.shuffle(samples)
-            mix.density_from_samples(samples)
+            if options.chunk_size is not None:
+                # A new permutation of the samples at every pass
+                for chunk in stream:
+                    mix.density_from_samples(chunk)
+            else:
+                np.random.shuffle(samples)
+                mix.density_from_samples(samples)
             draws.append(mix.build_mixture())
             mix.initialise()
 
@@ -93,18 +166,7 @@ def main():
             exit()
 
     # Plot
-    if dim == 1:
-        plot_median_cr(draws, injected = inj_density, samples = samples, out_folder = options.output, name = name, label = options.symbol, unit = options.unit)
-    else:
-        if options.symbol is not None:
-            symbols = options.symbol.split(',')
-        else:
-            symbols = options.symbol
-        if options.unit is not None:
-            units = options.unit.split(',')
-        else:
-            units = options.unit
-        plot_multidim(draws, dim, samples = samples, out_folder = options.output, name = name, labels = symbols, units = units)
+    plot_draws(draws, samples, dim, options, options.output, name, inj_density = inj_density)
 
 if __name__ == '__main__':
     main()
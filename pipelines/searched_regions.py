@@ -0,0 +1,66 @@
+import numpy as np
+
+import optparse as op
+import sys
+from pathlib import Path
+
+from figaro.threeDvolume import batch_searched_regions
+from figaro.utils import save_options
+from figaro.exceptions import except_hook
+
+def main():
+
+    # FIGARO-specific hints for known improper usages
+    sys.excepthook = except_hook
+
+    parser = op.OptionParser()
+    # Input/output
+    parser.add_option("-i", "--input", type = "string", dest = "input", help = "Folder with density files (*_density.pkl, see VolumeReconstruction.save_density)")
+    parser.add_option("--hosts", type = "string", dest = "hosts_file", help = "Text file with host positions. Columns: name ra dec D (name must match the density file name). Multiple lines with the same name are allowed")
+    parser.add_option("-o", "--output", type = "string", dest = "output", help = "Output folder. Default: same directory as input", default = None)
+    # Settings
+    parser.add_option("--n_gridpoints", type = "string", dest = "n_gridpoints", help = "Number of grid points (RA, dec, DL)", default = '720,360,100')
+    parser.add_option("--grid_cache", type = "string", dest = "grid_cache", help = "Folder for memory-mapped grid cache", default = None)
+    parser.add_option("--n_parallel", type = "int", dest = "n_parallel", help = "Number of parallel processes", default = 1)
+    parser.add_option("--single_precision", dest = "single_precision", action = 'store_true', help = "Evaluate grid and maps in single precision (halves memory)", default = False)
+
+    (options, args) = parser.parse_args()
+
+    # Paths
+    options.input      = Path(options.input).resolve()
+    options.hosts_file = Path(options.hosts_file).resolve()
+    if options.output is not None:
+        options.output = Path(options.output).resolve()
+        if not options.output.exists():
+            options.output.mkdir(parents=True)
+    else:
+        options.output = options.input
+    if options.grid_cache is not None:
+        options.grid_cache = Path(options.grid_cache).resolve()
+    options.n_gridpoints = [int(n) for n in options.n_gridpoints.split(',')]
+
+    save_options(options)
+
+    # Hosts
+    names = np.atleast_1d(np.genfromtxt(options.hosts_file, usecols = 0, dtype = str))
+    pos   = np.atleast_2d(np.genfromtxt(options.hosts_file, usecols = (1,2,3)))
+    events, files, hosts = [], [], []
+    for name in dict.fromkeys(names):
+        density_file = Path(options.input, name+'_density.pkl')
+        if not density_file.exists():
+            print("No density file found for {0}".format(name))
+            continue
+        events.append(name)
+        files.append(density_file)
+        hosts.append(pos[names == name])
+
+    results = batch_searched_regions(files, hosts, n_gridpoints = options.n_gridpoints, grid_cache_folder = options.grid_cache, n_parallel = options.n_parallel, dtype = np.float32 if options.single_precision else np.float64)
+
+    with open(Path(options.output, 'searched_regions.txt'), 'w') as f:
+        f.write('# name ra dec D CR CV searched_area searched_volume\n')
+        for name, h, res in zip(events, hosts, results):
+            for i in range(len(h)):
+                f.write('{0} {1} {2} {3} {4} {5} {6} {7}\n'.format(name, *h[i], res['CR'][i], res['CV'][i], res['searched_area'][i], res['searched_volume'][i]))
+
+if __name__ == '__main__':
+    main()
@@ -9,7 +9,7 @@ import os
 import warnings
 
 if not("LAL_PREFIX" in os.environ):
-    warnings.warn("No LAL installation found, please install LAL from source or source your LAL installation, see https://wiki.ligo.org/Computing/LALSuiteInstall. Some functions - GW posterior samples loading and catalog loading - won't be available and errors might be raised.")
+    warnings.warn("No LAL installation found, please install LAL from source or source your LAL installation, see https://wiki.ligo.org/Computing/LALSuiteInstall. The LAL cosmology backend won't be available: FIGARO will use its numba cosmology backend.")
     lal_flag = False
 else:
     lal_prefix = os.environ.get("LAL_PREFIX")
@@ -38,7 +38,8 @@ ext_modules=[
              Extension("figaro.cumulative",
                        sources=[os.path.join("figaro","cumulative.pyx")],
                        libraries=["m"], # Unix-like specific
-                       extra_compile_args=["-O3","-ffast-math"],
+                       extra_compile_args=["-O3","-ffast-math","-fopenmp"],
+                       extra_link_args=["-fopenmp"],
                        include_dirs=['figaro', numpy.get_include()]
                        ),
             ]
@@ -76,7 +77,7 @@ setup(
     install_requires=requirements,
     include_dirs = [numpy.get_include()],
     setup_requires=['numpy', 'cython', 'setuptools_scm'],
-    entry_points={},
+    entry_points={'console_scripts': ['figaro = figaro.cli:main']},
     package_data={"": ['*.c', '*.pyx', '*.pxd']},
     ext_modules=ext_modules,
     )